@@ -0,0 +1,153 @@
+"""
+Query plans and timings of common statements on a generated database,
+without and with the secondary indexes added in 0.7.4.
+
+    $ python benchmarks/db_indexes.py --files 1000000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sqlite3
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+from esgpull.database import Database
+from esgpull.models import File, FileStatus, sql
+from esgpull.models.query import query_file_proxy
+
+INDEXES = [
+    "ix_file_status",
+    "ix_file_master_id",
+    "ix_file_dataset_id",
+    "ix_file_data_node",
+    "ix_query_file_file_sha_query_sha",
+]
+
+
+def generate(path: Path, nb_files: int, nb_queries: int) -> None:
+    Database(f"sqlite:///{path}")  # create tables and indexes
+    statuses = [status.name for status in FileStatus]
+    weights = [1] * (len(statuses) - 1) + [50]  # mostly done
+    conn = sqlite3.connect(path)
+    rows = []
+    links = []
+    for i in range(nb_files):
+        dataset = f"project.model.exp{i // 1000}.v{i % 3}"
+        master = f"project.model.exp{i // 1000}.file{i % 1000}.nc"
+        sha = f"{i:040x}"
+        rows.append(
+            (
+                sha,
+                f"{dataset}.file{i % 1000}.nc",
+                dataset,
+                master,
+                f"https://node{i % 20}/file{i}.nc",
+                f"v{i % 3}",
+                f"file{i % 1000}.nc",
+                dataset.replace(".", "/"),
+                f"node{i % 20}",
+                "0" * 64,
+                "SHA256",
+                random.randint(1, 1 << 30),
+                random.choices(statuses, weights)[0],
+            )
+        )
+        links.append((f"query{i % nb_queries}", sha))
+    conn.executemany(
+        "INSERT INTO file (sha, file_id, dataset_id, master_id, url, version,"
+        " filename, local_path, data_node, checksum, checksum_type, size,"
+        " status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.executemany(
+        "INSERT INTO query_file (query_sha, file_sha) VALUES (?, ?)",
+        links,
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def statements() -> dict[str, sa.Select]:
+    file_sha = f"{12345:040x}"
+    return {
+        "with_status": sql.file.with_status(FileStatus.Queued),
+        "duplicates": sql.file.duplicates(),
+        "status_count_size": sql.file.status_count_size(),
+        "shas_from_query": sql.file.shas_from_query("query1"),
+        "file_queries": sa.select(query_file_proxy.c.query_sha).where(
+            query_file_proxy.c.file_sha == file_sha
+        ),
+        "dataset_files": sa.select(File).where(
+            File.dataset_id == "project.model.exp42.v1"
+        ),
+        "data_node_files": sa.select(File.sha).where(
+            File.data_node == "node3", File.status == FileStatus.Queued
+        ),
+    }
+
+
+def compile_literal(stmt: sa.Select) -> str:
+    compiled = stmt.compile(
+        dialect=sqlite.dialect(),
+        compile_kwargs={"literal_binds": True},
+    )
+    return str(compiled)
+
+
+def measure(
+    conn: sqlite3.Connection,
+    query: str,
+    repeat: int = 3,
+) -> tuple[list[str], float]:
+    plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+    timings: list[float] = []
+    for _ in range(repeat):
+        tic = perf_counter()
+        conn.execute(query).fetchall()
+        timings.append(perf_counter() - tic)
+    return plan, min(timings)
+
+
+def report(conn: sqlite3.Connection, title: str) -> dict[str, float]:
+    print(f"\n### {title}\n")
+    timings: dict[str, float] = {}
+    for name, stmt in statements().items():
+        plan, elapsed = measure(conn, compile_literal(stmt))
+        timings[name] = elapsed
+        print(f"{name} ({elapsed * 1000:.1f} ms)")
+        for line in plan:
+            print(f"    {line}")
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "esgpull.db"
+        tic = perf_counter()
+        generate(path, args.files, args.queries)
+        print(f"Generated {args.files} files in {perf_counter() - tic:.1f}s")
+        conn = sqlite3.connect(path)
+        after = report(conn, "with indexes")
+        for index in INDEXES:
+            conn.execute(f"DROP INDEX {index}")
+        conn.execute("ANALYZE")
+        before = report(conn, "without indexes")
+        conn.close()
+    print("\n### speedup\n")
+    for name in after:
+        print(f"{name}: x{before[name] / max(after[name], 1e-6):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Short sha lookups in a graph of generated queries, with the sorted sha
+index used since 0.7.6 and with the previous linear scan.
+
+    $ python benchmarks/graph_prefix.py --queries 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+from collections.abc import Callable, Sequence
+from time import perf_counter
+
+from esgpull.graph import Graph
+from esgpull.models import Query
+
+
+def linear_matching_shas(name: str, shas: set[str]) -> list[str]:
+    """
+    `Graph.matching_shas` before 0.7.6, kept for comparison.
+    """
+    shas_copy = list(shas)
+    for pos, c in enumerate(name):
+        idx = 0
+        while idx < len(shas_copy):
+            if shas_copy[idx][pos] != c:
+                shas_copy.pop(idx)
+            else:
+                idx += 1
+    return shas_copy
+
+
+def generate(nb_queries: int) -> list[Query]:
+    queries: list[Query] = []
+    for i in range(nb_queries):
+        query = Query(
+            selection={
+                "project": "CMIP6",
+                "experiment_id": f"exp{i // 100}",
+                "variable_id": f"var{i % 100}",
+            }
+        )
+        query.compute_sha()
+        queries.append(query)
+    return queries
+
+
+def measure(fn: Callable[[], object], repeat: int) -> float:
+    tic = perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (perf_counter() - tic) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=1_000)
+    parser.add_argument("--linear-lookups", type=int, default=10)
+    args = parser.parse_args()
+    tic = perf_counter()
+    queries = generate(args.queries)
+    print(f"Generated {args.queries} queries in {perf_counter() - tic:.1f}s")
+    *others, last = queries
+    graph = Graph(None)
+    tic = perf_counter()
+    graph.add(*others, clone=False)
+    print(f"Graph.add ({len(others)} queries): {perf_counter() - tic:.2f}s")
+    tic = perf_counter()
+    graph.add(last, clone=False)
+    print(f"Graph.add (1 more query): {(perf_counter() - tic) * 1e3:.1f} ms")
+    names = [q.sha[:8] for q in random.sample(queries, args.lookups)]
+    sorted_shas: Sequence[str] = graph._sorted_shas
+
+    def bisect_lookups() -> None:
+        for name in names:
+            graph.matching_shas(name, sorted_shas)
+
+    def linear_lookups() -> None:
+        for name in names[: args.linear_lookups]:
+            linear_matching_shas(name, graph._shas)
+
+    per_bisect = measure(bisect_lookups, 3) / len(names)
+    per_linear = measure(linear_lookups, 1) / args.linear_lookups
+    print(f"matching_shas (sorted index): {per_bisect * 1e6:.1f} µs/lookup")
+    print(f"matching_shas (linear scan): {per_linear * 1e3:.1f} ms/lookup")
+    print(f"speedup: x{per_linear / per_bisect:.0f}")
+    tic = perf_counter()
+    for name in names:
+        graph.get(name)
+    per_get = (perf_counter() - tic) / len(names)
+    print(f"Graph.get(short sha): {per_get * 1e6:.1f} µs/lookup")
+
+
+if __name__ == "__main__":
+    main()
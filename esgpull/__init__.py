@@ -1,8 +1,15 @@
-from esgpull.context import Context
-from esgpull.esgpull import Esgpull
-from esgpull.models import File, Query
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
 from esgpull.version import __version__
 
+if TYPE_CHECKING:
+    from esgpull.context import Context
+    from esgpull.esgpull import Esgpull
+    from esgpull.models import File, Query
+
 __all__ = [
     "Context",
     "Esgpull",
@@ -10,3 +17,18 @@ __all__ = [
     "Query",
     "__version__",
 ]
+
+# imported on first access, so that `import esgpull` stays cheap
+_lazy_imports = {
+    "Context": "esgpull.context",
+    "Esgpull": "esgpull.esgpull",
+    "File": "esgpull.models",
+    "Query": "esgpull.models",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _lazy_imports:
+        module = importlib.import_module(_lazy_imports[name])
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
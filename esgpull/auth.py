@@ -16,8 +16,6 @@ from xml.etree import ElementTree
 import httpx
 import tomlkit
 from attrs import Factory, define, field
-from myproxy.client import MyProxyClient
-from OpenSSL import crypto
 
 from esgpull.config import Config
 from esgpull.constants import PROVIDERS
@@ -146,6 +144,8 @@ class Auth:
         return self.__status
 
     def _get_status(self) -> AuthStatus:
+        from OpenSSL import crypto
+
         if not self.cert_file.exists():
             return AuthStatus.Missing
         with self.cert_file.open("rb") as f:
@@ -158,6 +158,8 @@ class Auth:
 
     # TODO: review this
     def renew(self) -> None:
+        from myproxy.client import MyProxyClient
+
         if self.cert_dir.is_dir():
             rmtree(self.cert_dir)
         self.cert_file.unlink(missing_ok=True)
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import sqlite3
+import zlib
+from dataclasses import dataclass, field
+from functools import cached_property
+from hashlib import sha256
+from pathlib import Path
+from time import time
+
+from esgpull.config import Config
+from esgpull.tui import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS response (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    content BLOB NOT NULL
+)
+"""
+
+
+@dataclass
+class Cache:
+    """
+    On-disk cache of index node responses, stored in a sqlite database.
+
+    Entries are keyed on the sha256 of the request's url and expire after
+    the `ttl` of their kind (hits, hints or search). Content is compressed,
+    least recently used entries are evicted when the total size of the
+    cache exceeds `max_size` bytes.
+
+    `oldest` is the creation time of the oldest entry returned by `get`,
+    responses read from the cache are at least as recent as that.
+    """
+
+    path: Path
+    max_size: int
+    ttl: dict[str, float] = field(default_factory=dict)
+    oldest: float | None = field(init=False, default=None)
+
+    @staticmethod
+    def from_config(config: Config) -> Cache:
+        cache_config = config.api.cache
+        return Cache(
+            path=config.paths.db / cache_config.filename,
+            max_size=cache_config.max_size,
+            ttl={
+                "hits": cache_config.ttl_hits,
+                "hints": cache_config.ttl_hints,
+                "search": cache_config.ttl_search,
+            },
+        )
+
+    @cached_property
+    def conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL;")
+        conn.execute(SCHEMA)
+        return conn
+
+    @staticmethod
+    def key(url: str) -> str:
+        return sha256(url.encode()).hexdigest()
+
+    def get(self, url: str, kind: str) -> bytes | None:
+        key = self.key(url)
+        now = time()
+        row = self.conn.execute(
+            "SELECT created, content FROM response WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        created, content = row
+        if now - created > self.ttl.get(kind, 0):
+            self.conn.execute("DELETE FROM response WHERE key = ?", (key,))
+            return None
+        self.conn.execute(
+            "UPDATE response SET accessed = ? WHERE key = ?",
+            (now, key),
+        )
+        if self.oldest is None or created < self.oldest:
+            self.oldest = created
+        return zlib.decompress(content)
+
+    def set(self, url: str, kind: str, content: bytes) -> None:
+        if self.ttl.get(kind, 0) <= 0:
+            return
+        compressed = zlib.compress(content, level=1)
+        now = time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?)",
+            (self.key(url), kind, now, now, len(compressed), compressed),
+        )
+        self.evict()
+
+    def size(self) -> int:
+        (size,) = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response"
+        ).fetchone()
+        return size
+
+    def evict(self) -> None:
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return
+        keys: list[tuple[str]] = []
+        rows = self.conn.execute(
+            "SELECT key, size FROM response ORDER BY accessed"
+        )
+        for key, size in rows:
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        self.conn.executemany("DELETE FROM response WHERE key = ?", keys)
+        logger.debug(f"Evicted {len(keys)} responses from cache")
+
+    def clear(self) -> None:
+        self.conn.execute("DELETE FROM response")
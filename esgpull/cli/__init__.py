@@ -1,24 +1,12 @@
 #!/usr/bin/env python3
 
 # https://click.palletsprojects.com/en/latest/
+import importlib
+
 import click
+from click.utils import make_default_short_help
 
-from esgpull import __version__
-from esgpull.cli.add import add
-from esgpull.cli.config import config
-from esgpull.cli.convert import convert
-from esgpull.cli.datasets import datasets
-from esgpull.cli.download import download
-from esgpull.cli.login import login
-from esgpull.cli.remove import remove
-from esgpull.cli.retry import retry
-from esgpull.cli.search import search
-from esgpull.cli.self import self
-from esgpull.cli.show import show
-from esgpull.cli.status import status
-from esgpull.cli.track import track, untrack
-from esgpull.cli.update import update
-from esgpull.tui import UI
+from esgpull.version import __version__
 
 # from esgpull.cli.autoremove import autoremove
 # from esgpull.cli.facet import facet
@@ -30,46 +18,120 @@ from esgpull.tui import UI
 #   - total disk usage
 #   - log config for later optimisation ?
 
-SUBCOMMANDS: list[click.Command] = [
-    add,
-    # autoremove,
-    config,
-    convert,
-    datasets,
-    download,
-    # facet,
-    # get,
-    self,
-    # install,
-    login,
-    remove,
-    retry,
-    search,
-    show,
-    track,
-    untrack,
-    status,
-    # # stats,
-    update,
-]
+# name -> (module, short help)
+SUBCOMMANDS: dict[str, tuple[str, str]] = {
+    "add": ("esgpull.cli.add", "Add queries to the database"),
+    # "autoremove": ...,
+    "config": ("esgpull.cli.config", "View/modify config"),
+    "convert": (
+        "esgpull.cli.convert",
+        "Convert synda selection files to esgpull queries",
+    ),
+    "daemon": ("esgpull.cli.daemon", "Download queued files continuously"),
+    "datasets": (
+        "esgpull.cli.datasets",
+        "View datasets completeness per query.",
+    ),
+    "download": (
+        "esgpull.cli.download",
+        "Asynchronously download files linked to queries",
+    ),
+    # "facet": ...,
+    # "get": ...,
+    "self": (
+        "esgpull.cli.self",
+        "Manage esgpull installations / import synda database",
+    ),
+    # "install": ...,
+    "login": (
+        "esgpull.cli.login",
+        "OpenID authentication and certificates renewal",
+    ),
+    "nodes": ("esgpull.cli.nodes", "View index nodes health"),
+    "remove": ("esgpull.cli.remove", "Remove queries from the database"),
+    "retry": ("esgpull.cli.retry", "Re-queue failed and cancelled downloads"),
+    "search": ("esgpull.cli.search", "Search datasets and files on ESGF"),
+    "show": ("esgpull.cli.show", "View query tree"),
+    "track": ("esgpull.cli.track", "Track queries"),
+    "untrack": ("esgpull.cli.track", "Untrack queries"),
+    "status": ("esgpull.cli.status", "View file queue status"),
+    # # "stats": ...,
+    "update": (
+        "esgpull.cli.update",
+        "Fetch files, link files <-> queries, send files to download queue",
+    ),
+    "verify": ("esgpull.cli.verify", "Verify checksums of downloaded files"),
+}
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
-_ui = UI("/tmp")
-version_msg = _ui.render(f"esgpull, version [green]{__version__}[/]")
 
+class LazyGroup(click.Group):
+    """
+    Imports a subcommand's module only when that subcommand is invoked.
+
+    The short help of each subcommand is duplicated in `SUBCOMMANDS`,
+    so that `esgpull --help` does not import any of them.
+    """
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(set(super().list_commands(ctx)) | set(SUBCOMMANDS))
+
+    def get_command(
+        self,
+        ctx: click.Context,
+        cmd_name: str,
+    ) -> click.Command | None:
+        if cmd_name not in self.commands and cmd_name in SUBCOMMANDS:
+            module_name, _ = SUBCOMMANDS[cmd_name]
+            module = importlib.import_module(module_name)
+            self.add_command(getattr(module, cmd_name))
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(
+        self,
+        ctx: click.Context,
+        formatter: click.HelpFormatter,
+    ) -> None:
+        names = self.list_commands(ctx)
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows: list[tuple[str, str]] = []
+        for name in names:
+            if name in SUBCOMMANDS:
+                _, short_help = SUBCOMMANDS[name]
+                short_help = make_default_short_help(short_help, limit)
+            else:
+                short_help = self.commands[name].get_short_help_str(limit)
+            rows.append((name, short_help))
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
 
-@click.group(context_settings=CONTEXT_SETTINGS)
-@click.version_option(None, "-V", "--version", message=version_msg)
+
+def print_version(ctx: click.Context, _: click.Parameter, value: bool) -> None:
+    if not value or ctx.resilient_parsing:
+        return
+    from esgpull.tui import UI
+
+    ui = UI("/tmp")
+    click.echo(ui.render(f"esgpull, version [green]{__version__}[/]"))
+    ctx.exit()
+
+
+@click.group(cls=LazyGroup, context_settings=CONTEXT_SETTINGS)
+@click.option(
+    "-V",
+    "--version",
+    is_flag=True,
+    expose_value=False,
+    is_eager=True,
+    callback=print_version,
+    help="Show the version and exit.",
+)
 def cli():
     """
     esgpull is a management utility for files and datasets from ESGF.
     """
 
 
-for subcmd in SUBCOMMANDS:
-    cli.add_command(subcmd)
-
-
 def main():
     cli()
@@ -0,0 +1,40 @@
+import asyncio
+
+import click
+from click.exceptions import Abort, Exit
+
+from esgpull.cli.decorators import opts
+from esgpull.cli.utils import init_esgpull
+from esgpull.daemon import Daemon
+from esgpull.tui import Verbosity
+
+
+@click.command()
+@opts.verbosity
+def daemon(
+    verbosity: Verbosity,
+):
+    """
+    Download queued files continuously
+
+    The `file` table is polled every `daemon.poll_interval` seconds for
+    queued files, which are downloaded as download slots free up.
+    Files left starting/started by an interrupted daemon are queued again.
+    SIGTERM or ctrl-c stops pulling new files and waits for downloads in
+    flight, a second one cancels them.
+    """
+    esg = init_esgpull(verbosity)
+    with esg.ui.logging("daemon", onraise=Abort):
+        daemon = Daemon.from_esgpull(esg)
+        esg.ui.print(
+            f"Polling queued files every {daemon.poll_interval:g}s,"
+            f" {daemon.max_inflight} files in flight at most."
+        )
+        try:
+            asyncio.run(daemon.serve())
+        except asyncio.CancelledError:
+            pass
+        esg.ui.print(
+            f"Downloaded {daemon.done} files, {daemon.errors} errors."
+        )
+        raise Exit(0)
@@ -7,6 +7,7 @@ from click_params import StringListParamType
 
 from esgpull.cli.utils import EnumParam
 from esgpull.models import FileStatus, Option
+from esgpull.scheduler import Policy
 from esgpull.tui import Verbosity
 
 F = TypeVar("F", bound=Callable[..., Any])
@@ -103,6 +104,11 @@ class opts:
         is_flag=True,
         default=False,
     )
+    discover: Dec = click.option(
+        "--discover",
+        is_flag=True,
+        default=False,
+    )
     dry_run: Dec = click.option(
         "--dry-run",
         "-z",
@@ -132,6 +138,11 @@ class opts:
         is_flag=True,
         default=False,
     )
+    full: Dec = click.option(
+        "--full",
+        is_flag=True,
+        default=False,
+    )
     generate: Dec = click.option(
         "--generate",
         is_flag=True,
@@ -143,17 +154,39 @@ class opts:
         type=StringListParamType(","),
         default=None,
     )
+    jobs: Dec = click.option(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+    )
+    mmap: Dec = click.option(
+        "--mmap",
+        is_flag=True,
+        default=False,
+    )
     name: Dec = click.option(
         "--name",
         "-n",
         type=str,
         default=None,
     )
+    no_cache: Dec = click.option(
+        "--no-cache",
+        is_flag=True,
+        default=False,
+    )
     no_default_query: Dec = click.option(
         "--no-default-query",
         is_flag=True,
         default=False,
     )
+    priority: Dec = click.option(
+        "--priority",
+        type=str,
+        default=(),
+        multiple=True,
+    )
     query_file: Dec = click.option(
         "--query-file",
         "-q",
@@ -175,6 +208,11 @@ class opts:
         is_flag=True,
         default=False,
     )
+    schedule: Dec = click.option(
+        "--schedule",
+        type=EnumParam(Policy),
+        default=None,
+    )
     shas: Dec = click.option(
         "--shas",
         "-s",
@@ -10,7 +10,8 @@ if sys.version_info < (3, 11):
 
 from esgpull.cli.decorators import args, opts
 from esgpull.cli.utils import get_queries, init_esgpull, valid_name_tag
-from esgpull.models import File, FileStatus
+from esgpull.models import sql
+from esgpull.scheduler import Policy, Scheduler
 from esgpull.tui import Verbosity, logger
 from esgpull.utils import format_size
 
@@ -19,6 +20,8 @@ from esgpull.utils import format_size
 @args.query_id
 @opts.tag
 @opts.disable_ssl
+@opts.schedule
+@opts.priority
 @opts.quiet
 @opts.record
 @opts.verbosity
@@ -26,12 +29,18 @@ def download(
     query_id: str | None,
     tag: str | None,
     disable_ssl: bool,
+    schedule: Policy | None,
+    priority: tuple[str, ...],
     quiet: bool,
     record: bool,
     verbosity: Verbosity,
 ):
     """
     Asynchronously download files linked to queries
+
+    The order in which files are downloaded is set with `--schedule`
+    (default is `download.schedule`). Queries given with `--priority`
+    are downloaded first, in the order they are given.
     """
     esg = init_esgpull(verbosity, record=record)
     if disable_ssl:
@@ -50,17 +59,31 @@ def download(
                 parents=True,
             )
         esg.ui.print(graph)
-        shas: set[str] = set()
-        queue: list[File] = []
-        for query in graph.queries.values():
-            for file in query.files:
-                if file.status == FileStatus.Queued and file.sha not in shas:
-                    shas.add(file.sha)
-                    queue.append(file)
+        # files are loaded when picked, only their sha, size and data node
+        # are kept for scheduling
+        stmt = sql.file.queued_from_queries(list(graph.queries))
+        queue = esg.db.rows(stmt)
         if not queue:
             rich.print("Download queue is empty.")
             esg.ui.raise_maybe_record(Exit(0))
-        coro = esg.download(queue, show_progress=not quiet)
+        scheduler = Scheduler.from_config(esg.config)
+        if schedule is not None:
+            scheduler.policy = schedule
+        elif priority:
+            scheduler.policy = Policy.Priority
+        priorities: dict[str, int] = {}
+        for i, priority_id in enumerate(priority):
+            if not valid_name_tag(esg.graph, esg.ui, priority_id, None):
+                esg.ui.raise_maybe_record(Exit(1))
+            priority_sha = esg.graph.get(priority_id).sha
+            for sha in esg.db.scalars(sql.file.shas_from_query(priority_sha)):
+                priorities.setdefault(sha, len(priority) - i)
+        scheduler.priorities = priorities
+        coro = esg.download(
+            queue,
+            show_progress=not quiet,
+            scheduler=scheduler,
+        )
         files, errors = asyncio.run(coro)
         if files:
             size = format_size(sum(file.size for file in files))
@@ -0,0 +1,76 @@
+import click
+from click.exceptions import Abort, Exit
+from rich.box import MINIMAL_DOUBLE_HEAD
+from rich.table import Table
+
+from esgpull.cli.decorators import opts
+from esgpull.cli.utils import init_esgpull
+from esgpull.tui import Verbosity
+from esgpull.utils import url2index
+
+
+@click.command()
+@opts.discover
+@opts.verbosity
+def nodes(
+    discover: bool,
+    verbosity: Verbosity,
+):
+    """
+    View index nodes health
+
+    Latency and error rate are moving averages over the last requests sent
+    to each index node, nodes are listed from best to worst.
+    The configured index node is underlined.
+    Use the `--discover` flag to add all index nodes known to ESGF.
+    """
+    esg = init_esgpull(verbosity)
+    with esg.ui.logging("nodes", onraise=Abort):
+        health = esg.context.health
+        if health is None:
+            raise Abort
+        if discover:
+            with esg.ui.spinner("Fetching index nodes"):
+                health.add(*esg.fetch_index_nodes())
+            health.save()
+        if not health.nodes:
+            esg.ui.print("No index node was requested yet.")
+            raise Exit(0)
+        index_node = url2index(esg.config.api.index_node)
+        table = Table(box=MINIMAL_DOUBLE_HEAD, show_edge=False)
+        table.add_column(
+            "index node",
+            justify="right",
+            style="bold blue",
+            no_wrap=True,
+        )
+        table.add_column("requests", justify="right")
+        table.add_column("errors", justify="right")
+        table.add_column("error rate", justify="right", style="red")
+        table.add_column("latency", justify="right", style="magenta")
+        table.add_column("last seen", justify="right")
+        table.add_column("status", justify="center")
+        for host in health.ranked(index_node):
+            node = health[host]
+            if node.latency is None:
+                latency = "-"
+            else:
+                latency = f"{node.latency * 1000:.0f} ms"
+            if node.last_seen is None:
+                last_seen = "-"
+            else:
+                last_seen = f"{node.last_seen:%Y-%m-%d %H:%M:%S}"
+            if health.healthy(host):
+                status = "[green]healthy[/]"
+            else:
+                status = "[red]unhealthy[/]"
+            table.add_row(
+                f"[u]{host}[/]" if host == index_node else host,
+                str(node.requests),
+                str(node.errors),
+                f"{node.error_rate:.0%}",
+                latency,
+                last_seen,
+                status,
+            )
+        esg.ui.print(table)
@@ -20,6 +20,7 @@ from esgpull.tui import Verbosity
 @groups.display
 @groups.json_yaml
 @opts.detail
+@opts.no_cache
 @opts.no_default_query
 @opts.show
 @opts.dry_run
@@ -50,6 +51,7 @@ def search(
     yaml: bool,
     ## ungrouped
     detail: int | None,
+    no_cache: bool,
     no_default_query: bool,
     show: bool,
     dry_run: bool,
@@ -70,6 +72,7 @@ def search(
         safe=False,
         record=record,
         no_default_query=no_default_query,
+        no_cache=no_cache,
     )
     with esg.ui.logging("search", onraise=Abort):
         query = parse_query(
@@ -1,15 +1,22 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 
 import click
 from click.exceptions import Abort, Exit
 
 from esgpull.cli.decorators import args, opts
 from esgpull.cli.utils import get_queries, init_esgpull, valid_name_tag
-from esgpull.context import HintsDict, ResultSearch
+from esgpull.context import (
+    FastFileFieldParams,
+    HintsDict,
+    ResultHints,
+    ResultSearch,
+)
+from esgpull.esgpull import Esgpull
 from esgpull.exceptions import UnsetOptionsError
-from esgpull.models import File, FileStatus, Query
+from esgpull.models import File, Query
 from esgpull.tui import Verbosity, logger
 from esgpull.utils import format_size
 
@@ -18,7 +25,9 @@ from esgpull.utils import format_size
 class QueryFiles:
     query: Query
     expanded: Query
+    date_from: datetime | None = None
     skip: bool = False
+    synced: bool = False
     files: list[File] = field(default_factory=list)
     hits: int = field(init=False)
     hints: HintsDict = field(init=False)
@@ -29,6 +38,8 @@ class QueryFiles:
 @args.query_id
 @opts.tag
 @opts.children
+@opts.full
+@opts.no_cache
 @opts.yes
 @opts.record
 @opts.verbosity
@@ -36,14 +47,19 @@ def update(
     query_id: str | None,
     tag: str | None,
     children: bool,
+    full: bool,
+    no_cache: bool,
     yes: bool,
     record: bool,
     verbosity: Verbosity,
 ) -> None:
     """
     Fetch files, link files <-> queries, send files to download queue
+
+    Only files published or modified on ESGF since the last successful
+    update of a query are fetched, use `--full` to fetch all of them.
     """
-    esg = init_esgpull(verbosity, record=record)
+    esg = init_esgpull(verbosity, record=record, no_cache=no_cache)
     with esg.ui.logging("update", onraise=Abort):
         # Select which queries to update + setup
         if query_id is None and tag is None:
@@ -58,6 +74,9 @@ def update(
                 tag,
                 children=children,
             )
+        # Timestamp taken before fetching anything, so that files published
+        # while this update runs are fetched again by the next one.
+        started_at = datetime.utcnow()
         qfs: list[QueryFiles] = []
         for query in queries:
             expanded = esg.graph.expand(query.sha)
@@ -65,7 +84,8 @@ def update(
                 esg.ui.print(query)
                 raise UnsetOptionsError(query.name)
             elif query.tracked:
-                qfs.append(QueryFiles(query, expanded))
+                date_from = None if full else query.updated_at
+                qfs.append(QueryFiles(query, expanded, date_from))
         queries = [
             query
             for query in queries
@@ -74,37 +94,52 @@ def update(
         if not qfs:
             esg.ui.print(":stop_sign: Trying to update untracked queries.")
             esg.ui.raise_maybe_record(Exit(0))
-        hints = esg.context.hints(
-            *[qf.expanded for qf in qfs],
-            file=True,
-            facets=["index_node"],
-        )
-        for qf, qf_hints in zip(qfs, hints):
+        hints_results: list[ResultHints] = []
+        for qf in qfs:
+            hints_results += esg.context.prepare_hints(
+                qf.expanded,
+                file=True,
+                facets=["index_node"],
+                date_from=qf.date_from,
+            )
+        esg.context._sync(esg.context._hints(*hints_results))
+        for qf, hints_result in zip(qfs, hints_results):
+            if hints_result.processed:
+                qf_hints = hints_result.data
+            else:
+                qf_hints = {}
             qf.hits = sum(esg.context.hits_from_hints(qf_hints))
             if qf_hints:
                 qf.hints = qf_hints
             else:
                 qf.skip = True
+                qf.synced = hints_result.processed
         for qf in qfs:
             s = "s" if qf.hits > 1 else ""
-            esg.ui.print(f"{qf.query.rich_name} -> {qf.hits} file{s}.")
+            if qf.date_from is None:
+                since = ""
+            else:
+                since = f" since {qf.date_from:%Y-%m-%d %H:%M:%S}"
+            esg.ui.print(f"{qf.query.rich_name} -> {qf.hits} file{s}{since}.")
         total_hits = sum([qf.hits for qf in qfs])
         if total_hits == 0:
             esg.ui.print("No files found.")
+            set_updated_at(esg, qfs, started_at)
             esg.ui.raise_maybe_record(Exit(0))
         else:
             esg.ui.print(f"{total_hits} files found.")
+        tracked_qfs = qfs
         qfs = [qf for qf in qfs if not qf.skip]
-        # Prepare optimally distributed requests to ESGF
-        # [?] TODO: fetch FastFile first to determine what to fetch in detail later
-        #   It might be interesting for the special case where all files already
-        #   exist in db, then the detailed fetch could be skipped.
+        # Prepare optimally distributed requests to ESGF,
+        # only ids and checksums are fetched at first
         for qf in qfs:
             qf_results = esg.context.prepare_search_distributed(
                 qf.expanded,
                 file=True,
                 hints=[qf.hints],
                 max_hits=None,
+                fields_param=FastFileFieldParams,
+                date_from=qf.date_from,
             )
             nb_req = len(qf_results)
             if nb_req > 50:
@@ -125,19 +160,47 @@ def update(
         # Fetch files and update db
         # [?] TODO: dry_run to print urls here
         with esg.ui.spinner("Fetching files"):
+            fast_coros = [esg.context._fast_files(*qf.results) for qf in qfs]
+            fast_files = esg.context.sync_gather(*fast_coros)
+            # Full metadata is only fetched for files unknown to the database
             coros = []
-            for qf in qfs:
-                coro = esg.context._files(*qf.results, keep_duplicates=False)
-                coros.append(coro)
+            unknown_shas: list[set[str]] = []
+            for qf, qf_fast_files in zip(qfs, fast_files):
+                qf.synced = bool(qf.results) and all(
+                    result.success for result in qf.results
+                )
+                qf_unknown_shas: set[str] = set()
+                search_results: list[ResultSearch] = []
+                for index_url, index_fast_files in qf_fast_files.items():
+                    known, unknown = esg.split_fast_files(
+                        qf.query,
+                        index_fast_files,
+                    )
+                    qf.files.extend(known)
+                    qf_unknown_shas |= {fast_file.sha for fast_file in unknown}
+                    search_results += esg.context.prepare_search_filenames(
+                        qf.expanded,
+                        [fast_file.filename for fast_file in unknown],
+                        index_url=index_url,
+                    )
+                unknown_shas.append(qf_unknown_shas)
+                coros.append(
+                    esg.context._files(*search_results, keep_duplicates=False)
+                )
             files = esg.context.sync_gather(*coros)
-            for qf, qf_files in zip(qfs, files):
-                qf.files = qf_files
+            for qf, qf_unknown_shas, qf_files in zip(qfs, unknown_shas, files):
+                for file in qf_files:
+                    if file.sha in qf_unknown_shas:
+                        qf.files.append(file)
+                        qf_unknown_shas.remove(file.sha)
+                if qf_unknown_shas:
+                    logger.warning(
+                        f"{len(qf_unknown_shas)} files of {qf.query.name}"
+                        " could not be fetched"
+                    )
+                    qf.synced = False
         for qf in qfs:
-            shas = {f.sha for f in qf.query.files}
-            new_files: list[File] = []
-            for file in qf.files:
-                if file.sha not in shas:
-                    new_files.append(file)
+            new_files = qf.files
             nb_files = len(new_files)
             if not qf.query.tracked:
                 esg.db.add(qf.query)
@@ -163,25 +226,43 @@ def update(
                 ) and choice == "show":
                     esg.ui.print(esg.graph.subgraph(qf.query, parents=True))
             if choice == "y":
-                legacy = esg.legacy_query
-                has_legacy = legacy.state.persistent
-                with esg.db.commit_context():
-                    for file in esg.ui.track(
-                        new_files,
-                        description=qf.query.rich_name,
-                    ):
-                        file_db = esg.db.get(File, file.sha)
-                        if file_db is None:
-                            if esg.db.has_file_id(file):
-                                logger.error(
-                                    "File id already exists in database, "
-                                    "there might be an error with its checksum"
-                                    f"\n{file}"
-                                )
-                                continue
-                            file.status = FileStatus.Queued
-                            esg.db.session.add(file)
-                        elif has_legacy and legacy in file_db.queries:
-                            esg.db.unlink(query=legacy, file=file_db)
-                        esg.db.link(query=qf.query, file=file)
+                with esg.ui.spinner(f"Updating {qf.query.rich_name}"):
+                    rejected = esg.link_files(qf.query, new_files)
+                for file in rejected:
+                    logger.error(
+                        "File id already exists in database, "
+                        "there might be an error with its checksum"
+                        f"\n{file}"
+                    )
+            else:
+                qf.synced = False
+        set_updated_at(esg, tracked_qfs, started_at)
         esg.ui.raise_maybe_record(Exit(0))
+
+
+# files are fetched by their index `_timestamp`, set by another clock
+CLOCK_SKEW_MARGIN = timedelta(minutes=5)
+
+
+def set_updated_at(
+    esg: Esgpull,
+    qfs: list[QueryFiles],
+    started_at: datetime,
+) -> None:
+    """
+    Record the start of this update on queries that were fully fetched,
+    next updates of these queries only fetch files newer than that.
+
+    Responses read from the cache can be older than `started_at`, the
+    oldest of them is used instead, minus `CLOCK_SKEW_MARGIN`.
+    """
+    updated_at = started_at
+    cache = esg.context.cache
+    if cache is not None and cache.oldest is not None:
+        updated_at = min(updated_at, datetime.utcfromtimestamp(cache.oldest))
+    updated_at -= CLOCK_SKEW_MARGIN
+    queries = [qf.query for qf in qfs if qf.synced and qf.query.tracked]
+    for query in queries:
+        query.updated_at = updated_at
+    if queries:
+        esg.db.add(*queries)
@@ -31,6 +31,7 @@ def init_esgpull(
     record: bool = False,
     load_db: bool = True,
     no_default_query: bool = False,
+    no_cache: bool = False,
 ) -> Esgpull:
     TempUI.verbosity = Verbosity.Errors
     with TempUI.logging():
@@ -42,8 +43,13 @@ def init_esgpull(
         )
         if no_default_query:
             esg.config.api.default_query_id = ""
+        if no_cache:
+            esg.context.cache = None
         if record:
             esg.ui.print(get_command())
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None:
+        ctx.call_on_close(esg.close)
     return esg
 
 
@@ -208,7 +214,7 @@ def valid_name_tag(
 ) -> bool:
     result = True
     if query_id is not None:
-        shas = graph.matching_shas(query_id, graph._shas)
+        shas = graph.matching_shas(query_id, graph._sorted_shas)
         if len(shas) > 1:
             ui.print(Messages.multimatch(query_id))
             ui.print(shas, json=True)
@@ -0,0 +1,99 @@
+import click
+from click.exceptions import Abort, Exit
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    MofNCompleteColumn,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+)
+
+from esgpull.cli.decorators import opts
+from esgpull.cli.utils import init_esgpull
+from esgpull.fs import FileCheck
+from esgpull.tui import Verbosity
+from esgpull.verify import Verifier, VerifyJob
+
+
+@click.command()
+@opts.jobs
+@opts.mmap
+@opts.reset
+@opts.dry_run
+@opts.yes
+@opts.verbosity
+def verify(
+    jobs: int | None,
+    mmap: bool,
+    reset: bool,
+    dry_run: bool,
+    yes: bool,
+    verbosity: Verbosity,
+):
+    """
+    Verify checksums of downloaded files
+
+    Files are checked in parallel with one process per CPU by default,
+    an interrupted verification resumes where it stopped unless `--reset`
+    is used. Corrupted or missing files are sent back to the download queue
+    once confirmed (corrupted files are deleted), `--yes` skips confirmation
+    and `--dry-run` only reports them.
+    """
+    esg = init_esgpull(verbosity)
+    if jobs is not None:
+        esg.config.verify.max_workers = jobs
+    if mmap:
+        esg.config.verify.use_mmap = True
+    with esg.ui.logging("verify", onraise=Abort):
+        verifier = Verifier(
+            esg.config,
+            esg.db,
+            esg.fs,
+            requeue=False,
+            dry_run=dry_run,
+        )
+        if reset:
+            verifier.reset()
+        todo = verifier.jobs(resume=not reset)
+        if not todo:
+            esg.ui.print("No files to verify.")
+            raise Exit(0)
+        progress = esg.ui.make_progress(
+            MofNCompleteColumn(),
+            BarColumn(),
+            DownloadColumn(binary_units=True),
+            TransferSpeedColumn(),
+            TimeRemainingColumn(compact=True, elapsed_when_finished=True),
+        )
+        files_task = progress.add_task("", total=len(todo))
+        bytes_task = progress.add_task("", total=sum(j.size for j in todo))
+
+        def on_check(job: VerifyJob, check: FileCheck) -> None:
+            progress.update(files_task, advance=1)
+            progress.update(bytes_task, advance=job.size)
+
+        with progress:
+            counts = verifier.run(todo, on_check)
+        unsupported = counts[FileCheck.Unsupported]
+        msg = (
+            f"Verified {sum(counts.values())} files: {counts[FileCheck.Ok]} ok"
+        )
+        for check in [FileCheck.BadSize, FileCheck.BadChecksum]:
+            if counts[check]:
+                msg += f", {counts[check]} [bold red]{check.name}[/]"
+        if counts[FileCheck.Missing]:
+            msg += f", {counts[FileCheck.Missing]} [bold red]missing[/]"
+        if unsupported:
+            msg += f", {unsupported} [yellow]unsupported checksum type[/]"
+        if counts[FileCheck.Unreadable]:
+            unreadable = counts[FileCheck.Unreadable]
+            msg += f", {unreadable} [yellow]unreadable[/]"
+        esg.ui.print(msg)
+        if verifier.bad:
+            message = (
+                f"Send {len(verifier.bad)} files back to the queue?"
+                " Corrupted files are deleted."
+            )
+            if yes or esg.ui.ask(message, default=False):
+                sent = verifier.send_back(verifier.bad)
+                esg.ui.print(f"Sent {sent} files back to the queue.")
@@ -90,6 +90,25 @@ class Cli:
 @define
 class Db:
     filename: str = "esgpull.db"
+    batch_size: int = 10_000
+    flush_every: int = 100  # files
+    flush_interval: int = 5  # seconds
+
+
+@define
+class Retry:
+    max_attempts: int = 3
+    backoff_base: int = 1  # seconds
+    backoff_cap: int = 60
+    jitter: bool = True
+    status_codes: str = "429,500,502,503,504"
+    retry_after: bool = True
+
+
+@define
+class Lease:
+    duration: int = 300  # seconds
+    heartbeat: int = 60
 
 
 @define
@@ -97,9 +116,30 @@ class Download:
     chunk_size: int = 1 << 26  # 64 MiB
     http_timeout: int = 20
     max_concurrent: int = 5
+    max_concurrent_per_node: int = 5
+    adaptive_concurrency: bool = True
+    range_size: int = 1 << 28  # 256 MiB
+    max_connections_per_file: int = 1
+    distributed: bool = False
     disable_ssl: bool = False
     disable_checksum: bool = False
     show_filename: bool = False
+    schedule: str = "fifo"
+    retry: Retry = Factory(Retry)
+    lease: Lease = Factory(Lease)
+
+
+@define
+class Daemon:
+    poll_interval: int = 10  # seconds
+    lookahead: int = 10
+
+
+@define
+class Verify:
+    block_size: int = 1 << 23  # 8 MiB
+    max_workers: int = 0  # 0 uses the number of CPUs
+    use_mmap: bool = False
 
 
 @define
@@ -118,6 +158,25 @@ class DefaultOptions:
         )
 
 
+@define
+class Cache:
+    enabled: bool = False
+    filename: str = "cache.db"
+    max_size: int = 1 << 28  # 256 MiB
+    ttl_hits: int = 600  # seconds
+    ttl_hints: int = 600
+    ttl_search: int = 3600
+
+
+@define
+class Failover:
+    enabled: bool = False
+    max_nodes: int = 3
+    hedge: bool = False
+    hedge_delay: int = 2  # seconds
+    cooldown: int = 300  # seconds
+
+
 @define
 class API:
     index_node: str = "esgf-node.ipsl.upmc.fr"
@@ -126,6 +185,9 @@ class API:
     page_limit: int = 50
     default_options: DefaultOptions = Factory(DefaultOptions)
     default_query_id: str = ""
+    cache: Cache = Factory(Cache)
+    retry: Retry = Factory(Retry)
+    failover: Failover = Factory(Failover)
 
 
 def fix_rename_search_api(doc: TOMLDocument) -> TOMLDocument:
@@ -219,6 +281,8 @@ class Config:
     cli: Cli = Factory(Cli)
     db: Db = Factory(Db)
     download: Download = Factory(Download)
+    daemon: Daemon = Factory(Daemon)
+    verify: Verify = Factory(Verify)
     api: API = Factory(API)
     _raw: TOMLDocument | None = field(init=False, default=None)
     _config_file: Path | None = field(init=False, default=None)
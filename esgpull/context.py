@@ -1,24 +1,36 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import sys
-from collections.abc import AsyncIterator, Callable, Coroutine, Sequence
+from collections.abc import (
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Iterable,
+    Iterator,
+    Sequence,
+)
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
+from time import perf_counter
 from typing import Any, TypeAlias, TypeVar
 
 if sys.version_info < (3, 11):
     from exceptiongroup import BaseExceptionGroup
 
-from httpx import AsyncClient, HTTPError, Request
+from httpx import AsyncClient, HTTPError, Request, Response
 from rich.pretty import pretty_repr
 
+from esgpull.cache import Cache
 from esgpull.config import Config
 from esgpull.exceptions import SolrUnstableQueryError
-from esgpull.models import Dataset, File, Query
+from esgpull.health import Health
+from esgpull.models import Dataset, FastFile, File, Query
+from esgpull.retry import RetryPolicy
+from esgpull.solr import DocsParser, loads
 from esgpull.tui import logger
-from esgpull.utils import format_date, index2url, sync
+from esgpull.utils import format_date, index2url, sync, url2index
 
 # workaround for notebooks with running event loop
 if asyncio.get_event_loop().is_running():
@@ -27,9 +39,19 @@ if asyncio.get_event_loop().is_running():
     nest_asyncio.apply()
 
 
+def _running_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
 T = TypeVar("T")
 RT = TypeVar("RT", bound="Result")
 HintsDict: TypeAlias = dict[str, dict[str, int]]
+MaxPageLimit = 10_000  # maximum number of documents per page on ESGF
+MaxFilenamesLength = 4_000  # keeps urls under the usual 8 KiB limit
 DangerousFacets = {
     "instance_id",
     "dataset_id",
@@ -47,11 +69,17 @@ class Result:
     json: dict[str, Any] = field(init=False, repr=False)
     exc: BaseException | None = field(init=False, default=None, repr=False)
     processed: bool = field(init=False, default=False, repr=False)
+    retries: int = field(init=False, default=0, repr=False)
+    routable: bool = field(init=False, default=False, repr=False)
 
     @property
     def success(self) -> bool:
         return self.exc is None
 
+    @property
+    def index_url(self) -> str:
+        return str(self.request.url.copy_with(query=None))
+
     def prepare(
         self,
         index_node: str,
@@ -164,14 +192,17 @@ class ResultDatasets(Result):
     def process(self) -> None:
         self.data = []
         if self.success:
-            for doc in self.json["response"]["docs"]:
-                try:
-                    dataset = Dataset.serialize(doc)
-                    self.data.append(dataset)
-                except KeyError as exc:
-                    logger.exception(exc)
+            self.data = list(self.serialize(self.json["response"]["docs"]))
             self.processed = True
 
+    @staticmethod
+    def serialize(docs: Iterable[dict]) -> Iterator[Dataset]:
+        for doc in docs:
+            try:
+                yield Dataset.serialize(doc)
+            except KeyError as exc:
+                logger.exception(exc)
+
 
 @dataclass
 class ResultFiles(Result):
@@ -180,17 +211,39 @@ class ResultFiles(Result):
     def process(self) -> None:
         self.data = []
         if self.success:
-            for doc in self.json["response"]["docs"]:
-                try:
-                    file = File.serialize(doc)
-                    self.data.append(file)
-                except KeyError as exc:
-                    logger.exception(exc)
-                    fid = doc["instance_id"]
-                    logger.warning(f"File {fid} has invalid metadata")
-                    logger.debug(pretty_repr(doc))
+            self.data = list(self.serialize(self.json["response"]["docs"]))
+            self.processed = True
+
+    @staticmethod
+    def serialize(docs: Iterable[dict]) -> Iterator[File]:
+        for doc in docs:
+            try:
+                yield File.serialize(doc)
+            except KeyError as exc:
+                logger.exception(exc)
+                fid = doc["instance_id"]
+                logger.warning(f"File {fid} has invalid metadata")
+                logger.debug(pretty_repr(doc))
+
+
+@dataclass
+class ResultFastFiles(Result):
+    data: Sequence[FastFile] = field(init=False, repr=False)
+
+    def process(self) -> None:
+        self.data = []
+        if self.success:
+            self.data = list(self.serialize(self.json["response"]["docs"]))
             self.processed = True
 
+    @staticmethod
+    def serialize(docs: Iterable[dict]) -> Iterator[FastFile]:
+        for doc in docs:
+            try:
+                yield FastFile.serialize(doc)
+            except KeyError as exc:
+                logger.exception(exc)
+
 
 @dataclass
 class ResultSearchAsQueries(Result):
@@ -251,7 +304,10 @@ def _distribute_hits(
 
 
 FileFieldParams = ["*"]
+# `id` is used to skip documents already yielded when a request is retried
+FastFileFieldParams = ["id", "dataset_id", "title", "checksum"]
 DatasetFieldParams = [
+    "id",
     "instance_id",
     "data_node",
     "size",
@@ -261,6 +317,15 @@ DatasetFieldParams = [
 
 @dataclass
 class Context:
+    """
+    Client for the ESGF search api.
+
+    Async methods (`ahits`, `ahints`, `afiles`, `adatasets`...) share the
+    client opened by `async with Context() as ctx`. Their synchronous
+    counterparts run them on an event loop kept by the context, until
+    `close` is called.
+    """
+
     config: Config = field(default_factory=Config.default)
     client: AsyncClient = field(
         init=False,
@@ -272,6 +337,19 @@ class Context:
         default_factory=dict,
     )
     noraise: bool = False
+    cache: Cache | None = field(init=False, repr=False, default=None)
+    retry: RetryPolicy = field(init=False, repr=False)
+    health: Health | None = field(init=False, repr=False, default=None)
+    _loop: asyncio.AbstractEventLoop | None = field(
+        init=False,
+        repr=False,
+        default=None,
+    )
+
+    def __post_init__(self) -> None:
+        if self.config.api.cache.enabled:
+            self.cache = Cache.from_config(self.config)
+        self.retry = RetryPolicy.from_config(self.config.api.retry)
 
     # def __init__(
     #     self,
@@ -295,6 +373,8 @@ class Context:
             raise Exception("Context is not initialized.")
         await self.client.aclose()
         del self.client
+        if self.health is not None:
+            self.health.save()
 
     def prepare_hits(
         self,
@@ -315,6 +395,7 @@ class Context:
                 date_from=date_from,
                 date_to=date_to,
             )
+            result.routable = index_node is None and index_url is None
             results.append(result)
         return results
 
@@ -339,6 +420,7 @@ class Context:
                 date_from=date_from,
                 date_to=date_to,
             )
+            result.routable = index_node is None and index_url is None
             results.append(result)
         return results
 
@@ -382,6 +464,7 @@ class Context:
                     date_from=date_from,
                     date_to=date_to,
                 )
+                result.routable = index_node is None and index_url is None
                 results.append(result)
         return results
 
@@ -410,6 +493,9 @@ class Context:
         results = []
         not_distrib = Query(options=dict(distrib=False))
         for query, query_hints, query_max_hits in zip(queries, hints, hits):
+            # copied without its files, a clone of `query` would be added to
+            # `file.queries` of every file, but never to the session
+            search_query = Query(**query.asdict()) << not_distrib
             nodes = query_hints["index_node"]
             nodes_hits = [nodes[node] for node in nodes]
             slices = _distribute_hits(
@@ -420,7 +506,7 @@ class Context:
             )
             for node, node_slices in zip(nodes, slices):
                 for sl in node_slices:
-                    result = ResultSearch(query << not_distrib, file=file)
+                    result = ResultSearch(search_query, file=file)
                     result.prepare(
                         index_node=node,
                         offset=sl.start,
@@ -432,37 +518,296 @@ class Context:
                     results.append(result)
         return results
 
-    async def _fetch_one(self, result: RT) -> RT:
+    @staticmethod
+    def _cache_kind(result: Result) -> str:
+        if isinstance(result, ResultHits):
+            return "hits"
+        elif isinstance(result, ResultHints):
+            return "hints"
+        else:
+            return "search"
+
+    def prepare_search_filenames(
+        self,
+        query: Query,
+        filenames: list[str],
+        index_url: str,
+        fields_param: list[str] | None = None,
+    ) -> list[ResultSearch]:
+        """
+        Search files of `query` on a single index, restricted to `filenames`.
+
+        Filenames are split into requests with urls shorter than
+        `MaxFilenamesLength`, each request fetches all of its matches.
+        Queries that already select filenames are sent as a single request.
+        """
+        if fields_param is None:
+            fields_param = FileFieldParams
+        if not filenames:
+            return []
+        options = query.options.asdict()
+        options["distrib"] = False
+        selection = query.selection.asdict()
+        chunks: list[list[str]] = [[]]
+        length = 0
+        for filename in filenames:
+            if length + len(filename) > MaxFilenamesLength and chunks[-1]:
+                chunks.append([])
+                length = 0
+            chunks[-1].append(filename)
+            length += len(filename) + 1
+        if "title" in selection:
+            chunks = chunks[:1]
+        results = []
+        for chunk in chunks:
+            chunk_query = Query(options=options, selection=selection)
+            if "title" not in selection:
+                chunk_query.selection["title"] = chunk
+            result = ResultSearch(chunk_query, file=True)
+            result.prepare(
+                index_node=self.config.api.index_node,
+                page_limit=MaxPageLimit,
+                fields_param=fields_param,
+                index_url=index_url,
+            )
+            results.append(result)
+        return results
+
+    def _semaphore(self, result: Result) -> asyncio.Semaphore:
         host = result.request.url.host
         if host not in self.semaphores:
             max_concurrent = self.config.api.max_concurrent
             self.semaphores[host] = asyncio.Semaphore(max_concurrent)
-        async with self.semaphores[host]:
-            logger.debug(f"GET {host} params={result.request.url.params}")
+        logger.debug(f"GET {host} params={result.request.url.params}")
+        return self.semaphores[host]
+
+    def _route(self, result: Result) -> list[str]:
+        """
+        Index nodes to send `result.request` to, in order of preference.
+
+        With failover enabled, requests prepared without an explicit index
+        node go to the healthiest known nodes, the configured index node
+        first until others are known to be faster. Requests targeting a
+        specific index node (e.g. distributed searches) are never rerouted.
+        """
+        failover = self.config.api.failover
+        if self.health is None or not failover.enabled or not result.routable:
+            return [result.request.url.host]
+        index_node = url2index(self.config.api.index_node)
+        return self.health.ranked(index_node)[: max(1, failover.max_nodes)]
+
+    async def _send_one(self, request: Request) -> Response:
+        host = request.url.host
+        start = perf_counter()
+        try:
+            resp = await self.client.send(request, stream=True)
             try:
-                resp = await self.client.send(result.request)
                 resp.raise_for_status()
-                result.json = json.loads(
-                    resp.content.decode(encoding="latin-1")
-                )
-                logger.info(f"✓ Fetched in {resp.elapsed}s {resp.url}")
-            except HTTPError as exc:
-                result.exc = exc
-            except (Exception, asyncio.CancelledError) as exc:
-                result.exc = exc
-            return result
+            except HTTPError:
+                await resp.aclose()
+                raise
+        except HTTPError as exc:
+            # client errors (e.g. a bad query) say nothing of the node
+            if self.health is not None and self.retry.retryable(exc):
+                self.health.record(host, error=True)
+            raise
+        if self.health is not None:
+            self.health.record(host, perf_counter() - start)
+        return resp
+
+    async def _send(self, result: Result) -> Response:
+        """
+        Send `result.request` to the nodes from `_route`, the response is
+        streamed and `result.request` is set to the request answered.
 
-    async def _fetch(self, *in_results: RT) -> AsyncIterator[RT]:
-        tasks = [
-            asyncio.create_task(self._fetch_one(result))
-            for result in in_results
+        The next node is tried when a node fails with a retryable error.
+        With hedging, it is also tried when a node does not answer within
+        `hedge_delay` seconds, the first successful response wins and the
+        other requests are cancelled.
+        """
+        failover = self.config.api.failover
+        url = result.request.url
+        requests = [
+            Request("GET", url.copy_with(host=host))
+            for host in self._route(result)
         ]
-        excs = []
-        for task in tasks:
-            result = await task
-            yield result
-            if result.exc is not None:
-                excs.append(result.exc)
+        delay = failover.hedge_delay if failover.hedge else None
+        tasks: dict[asyncio.Task[Response], Request] = {}
+        exc: BaseException | None = None
+        try:
+            while requests or tasks:
+                if requests:
+                    request = requests.pop(0)
+                    if request.url.host != url.host:
+                        logger.info(f"Sending request to {request.url.host}")
+                    task = asyncio.create_task(self._send_one(request))
+                    tasks[task] = request
+                done, _ = await asyncio.wait(
+                    tasks,
+                    timeout=delay if requests else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    request = tasks.pop(task)
+                    exc = task.exception()
+                    if exc is None:
+                        if request.url.host != url.host:
+                            result.request = request
+                        return task.result()
+                    elif not self.retry.retryable(exc):
+                        raise exc
+            assert exc is not None
+            raise exc
+        finally:
+            for task in tasks:
+                task.cancel()
+            for resp in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(resp, Response):
+                    await resp.aclose()
+
+    async def _fetch_one(self, result: RT) -> RT:
+        url = str(result.request.url)
+        kind = self._cache_kind(result)
+        if self.cache is not None:
+            content = self.cache.get(url, kind)
+            if content is not None:
+                result.json = loads(content)
+                logger.info(f"✓ Cached {url}")
+                return result
+        async with self._semaphore(result):
+            while True:
+                try:
+                    resp = await self._send(result)
+                    try:
+                        await resp.aread()
+                    finally:
+                        await resp.aclose()
+                    result.json = loads(resp.content)
+                    logger.info(f"✓ Fetched in {resp.elapsed}s {resp.url}")
+                    if self.cache is not None:
+                        self.cache.set(url, kind, resp.content)
+                except HTTPError as exc:
+                    if await self._backoff(result, exc):
+                        continue
+                    result.exc = exc
+                except (Exception, asyncio.CancelledError) as exc:
+                    result.exc = exc
+                return result
+
+    async def _backoff(self, result: Result, exc: BaseException) -> bool:
+        """
+        Wait before sending `result.request` again, if `exc` is transient
+        and the retry policy allows another attempt.
+        """
+        delay = self.retry.delay(result.retries, exc)
+        if delay is None:
+            return False
+        result.retries += 1
+        logger.warning(
+            f"Retrying in {delay:.1f}s ({result.retries}/"
+            f"{self.retry.max_attempts - 1}) {result.request.url}: {exc!r}"
+        )
+        await asyncio.sleep(delay)
+        return True
+
+    async def _stream_one(
+        self,
+        result: RT,
+    ) -> AsyncIterator[tuple[RT, list[dict]]]:
+        """
+        Streaming version of `_fetch_one`, documents are parsed and yielded
+        by batches as the response body is received.
+        `result.json` is set to the response without its documents.
+
+        When a retry happens after some documents were yielded, those are
+        skipped from the new response by `id`, since it can come in another
+        order (e.g. from another index node after a failover).
+        """
+        url = str(result.request.url)
+        kind = self._cache_kind(result)
+        parser = DocsParser()
+        if self.cache is not None:
+            content = self.cache.get(url, kind)
+            if content is not None:
+                yield result, parser.feed(content)
+                result.json = parser.close()
+                logger.info(f"✓ Cached {url}")
+                return
+        yielded: set[str] = set()
+        async with self._semaphore(result):
+            while True:
+                parser = DocsParser()
+                chunks: list[bytes] = []
+                retried = bool(yielded)
+                try:
+                    resp = await self._send(result)
+                    try:
+                        async for chunk in resp.aiter_bytes():
+                            if self.cache is not None:
+                                chunks.append(chunk)
+                            docs = parser.feed(chunk)
+                            if retried:
+                                docs = [
+                                    doc
+                                    for doc in docs
+                                    if doc.get("id") not in yielded
+                                ]
+                            if docs:
+                                yielded.update(
+                                    doc["id"] for doc in docs if "id" in doc
+                                )
+                                yield result, docs
+                    finally:
+                        await resp.aclose()
+                    result.json = parser.close()
+                    logger.info(f"✓ Fetched in {resp.elapsed}s {resp.url}")
+                    if self.cache is not None:
+                        self.cache.set(url, kind, b"".join(chunks))
+                except HTTPError as exc:
+                    if await self._backoff(result, exc):
+                        continue
+                    result.exc = exc
+                except (Exception, asyncio.CancelledError) as exc:
+                    result.exc = exc
+                return
+
+    async def _stream_bounded(
+        self,
+        result: RT,
+        pages: asyncio.Semaphore,
+    ) -> AsyncIterator[tuple[RT, list[dict]]]:
+        async with pages:
+            async for result_docs in self._stream_one(result):
+                yield result_docs
+
+    async def _stream(
+        self,
+        *results: RT,
+        max_pages: int | None = None,
+    ) -> AsyncIterator[tuple[RT, list[dict]]]:
+        """
+        Documents from all `results`, in the order they are received.
+        At most `max_pages` responses are read at once, in addition to the
+        limit of `api.max_concurrent` requests per index node.
+        """
+        from aiostream.stream import merge
+
+        streams: list[AsyncIterator[tuple[RT, list[dict]]]]
+        if max_pages is None:
+            streams = [self._stream_one(result) for result in results]
+        else:
+            pages = asyncio.Semaphore(max_pages)
+            streams = [
+                self._stream_bounded(result, pages) for result in results
+            ]
+        if streams:
+            async with merge(*streams).stream() as merged:
+                async for result_docs in merged:
+                    yield result_docs
+        self._raise_excs(*results)
+
+    def _raise_excs(self, *results: Result) -> None:
+        excs = [result.exc for result in results if result.exc is not None]
         if excs:
             group = BaseExceptionGroup("fetch", excs)
             if self.noraise:
@@ -472,6 +817,15 @@ class Context:
             else:
                 raise group
 
+    async def _fetch(self, *in_results: RT) -> AsyncIterator[RT]:
+        tasks = [
+            asyncio.create_task(self._fetch_one(result))
+            for result in in_results
+        ]
+        for task in tasks:
+            yield await task
+        self._raise_excs(*in_results)
+
     async def _hits(self, *results: ResultHits) -> list[int]:
         hits = []
         async for result in self._fetch(*results):
@@ -494,38 +848,84 @@ class Context:
         keep_duplicates: bool,
     ) -> list[Dataset]:
         datasets: list[Dataset] = []
-        ids: set[str] = set()
-        async for result in self._fetch(*results):
-            dataset_result = result.to(ResultDatasets)
-            dataset_result.process()
-            if dataset_result.processed:
-                for d in dataset_result.data:
-                    if not keep_duplicates and d.dataset_id in ids:
-                        logger.warning(f"Duplicate dataset {d.dataset_id}")
-                    else:
-                        datasets.append(d)
-                        ids.add(d.dataset_id)
+        async for dataset in self._iter_datasets(
+            *results,
+            keep_duplicates=keep_duplicates,
+        ):
+            datasets.append(dataset)
         return datasets
 
+    async def _iter_datasets(
+        self,
+        *results: ResultSearch,
+        keep_duplicates: bool,
+        max_pages: int | None = None,
+    ) -> AsyncIterator[Dataset]:
+        """
+        Datasets are yielded as soon as they are parsed from any response.
+        """
+        ids: set[str] = set()
+        async for _, docs in self._stream(*results, max_pages=max_pages):
+            for d in ResultDatasets.serialize(docs):
+                if keep_duplicates:
+                    yield d
+                elif d.dataset_id in ids:
+                    logger.warning(f"Duplicate dataset {d.dataset_id}")
+                else:
+                    ids.add(d.dataset_id)
+                    yield d
+
     async def _files(
         self,
         *results: ResultSearch,
         keep_duplicates: bool,
     ) -> list[File]:
         files: list[File] = []
-        shas: set[str] = set()
-        async for result in self._fetch(*results):
-            files_result = result.to(ResultFiles)
-            files_result.process()
-            if files_result.processed:
-                for file in files_result.data:
-                    if not keep_duplicates and file.sha in shas:
-                        logger.warning(f"Duplicate file {file.file_id}")
-                    else:
-                        files.append(file)
-                        shas.add(file.sha)
+        async for file in self._iter_files(
+            *results,
+            keep_duplicates=keep_duplicates,
+        ):
+            files.append(file)
         return files
 
+    async def _iter_files(
+        self,
+        *results: ResultSearch,
+        keep_duplicates: bool,
+        max_pages: int | None = None,
+    ) -> AsyncIterator[File]:
+        """
+        Files are yielded as soon as they are parsed from any response.
+        """
+        shas: set[str] = set()
+        async for _, docs in self._stream(*results, max_pages=max_pages):
+            for file in ResultFiles.serialize(docs):
+                if keep_duplicates:
+                    yield file
+                elif file.sha in shas:
+                    logger.warning(f"Duplicate file {file.file_id}")
+                else:
+                    shas.add(file.sha)
+                    yield file
+
+    async def _fast_files(
+        self,
+        *results: ResultSearch,
+    ) -> dict[str, list[FastFile]]:
+        """
+        Fast files grouped by the index url that returned them,
+        duplicates are only kept for the first index.
+        """
+        fast_files: dict[str, list[FastFile]] = {}
+        shas: set[str] = set()
+        async for result, docs in self._stream(*results):
+            index_fast_files = fast_files.setdefault(result.index_url, [])
+            for fast_file in ResultFastFiles.serialize(docs):
+                if fast_file.sha not in shas:
+                    index_fast_files.append(fast_file)
+                    shas.add(fast_file.sha)
+        return fast_files
+
     async def _search_as_queries(
         self,
         *results: ResultSearch,
@@ -554,11 +954,42 @@ class Context:
 
     def _sync(self, coro: Coroutine[None, None, T]) -> T:
         """
-        Reset semaphore to ensure none is bound to an expired event loop.
-        Run through `_with_client` wrapper to use `async with` synchronously.
+        Run `coro` on an event loop owned by this context.
+
+        The loop and its client are kept between calls, so that synchronous
+        calls share the connection pool and semaphores, until `close`.
+        When an event loop is already running (e.g. notebooks), a new loop
+        and client are created for each call.
         """
-        self.free_semaphores()
-        return sync(self._with_client(coro))
+        if _running_loop():
+            self.free_semaphores()
+            return sync(self._with_client(coro))
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self.free_semaphores()
+        if not hasattr(self, "client"):
+            self._loop.run_until_complete(self.__aenter__())
+        try:
+            return self._loop.run_until_complete(coro)
+        finally:
+            if self.health is not None:
+                self.health.save()
+
+    def close(self) -> None:
+        """
+        Close the client and event loop used by synchronous calls.
+        """
+        if self._loop is None:
+            return
+        if _running_loop():
+            # the loop cannot run from within another loop's thread
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(self.close).result()
+            return
+        if hasattr(self, "client"):
+            self._loop.run_until_complete(self.__aexit__())
+        self._loop.close()
+        self._loop = None
 
     async def _gather(self, *coros: Coroutine[None, None, T]) -> list[T]:
         return await asyncio.gather(*coros)
@@ -566,7 +997,7 @@ class Context:
     def sync_gather(self, *coros: Coroutine[None, None, T]) -> list[T]:
         return self._sync(self._gather(*coros))
 
-    def hits(
+    async def ahits(
         self,
         *queries: Query,
         file: bool,
@@ -583,7 +1014,26 @@ class Context:
             date_from=date_from,
             date_to=date_to,
         )
-        return self._sync(self._hits(*results))
+        return await self._hits(*results)
+
+    def hits(
+        self,
+        *queries: Query,
+        file: bool,
+        index_url: str | None = None,
+        index_node: str | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+    ) -> list[int]:
+        coro = self.ahits(
+            *queries,
+            file=file,
+            index_url=index_url,
+            index_node=index_node,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        return self._sync(coro)
 
     def hits_from_hints(self, *hints: HintsDict) -> list[int]:
         result: list[int] = []
@@ -596,7 +1046,7 @@ class Context:
             result.append(num)
         return result
 
-    def hints(
+    async def ahints(
         self,
         *queries: Query,
         file: bool,
@@ -615,9 +1065,30 @@ class Context:
             date_from=date_from,
             date_to=date_to,
         )
-        return self._sync(self._hints(*results))
+        return await self._hints(*results)
 
-    def datasets(
+    def hints(
+        self,
+        *queries: Query,
+        file: bool,
+        facets: list[str],
+        index_url: str | None = None,
+        index_node: str | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+    ) -> list[HintsDict]:
+        coro = self.ahints(
+            *queries,
+            file=file,
+            facets=facets,
+            index_url=index_url,
+            index_node=index_node,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        return self._sync(coro)
+
+    async def adatasets(
         self,
         *queries: Query,
         hits: list[int] | None = None,
@@ -629,7 +1100,42 @@ class Context:
         keep_duplicates: bool = True,
     ) -> list[Dataset]:
         if hits is None:
-            hits = self.hits(*queries, file=False)
+            hits = await self.ahits(*queries, file=False)
+        results = self.prepare_search(
+            *queries,
+            file=False,
+            hits=hits,
+            offset=offset,
+            page_limit=page_limit,
+            max_hits=max_hits,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        return await self._datasets(*results, keep_duplicates=keep_duplicates)
+
+    async def iter_datasets(
+        self,
+        *queries: Query,
+        hits: list[int] | None = None,
+        offset: int = 0,
+        max_hits: int | None = 200,
+        page_limit: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        keep_duplicates: bool = True,
+        max_pages: int | None = None,
+    ) -> AsyncIterator[Dataset]:
+        """
+        Like `adatasets`, datasets are yielded as pages are received.
+
+        At most `max_pages` pages are in flight (`api.max_concurrent` by
+        default). Deduplication keeps the ids of all yielded datasets,
+        it is disabled with `keep_duplicates`.
+        """
+        if hits is None:
+            hits = await self.ahits(*queries, file=False)
+        if max_pages is None:
+            max_pages = self.config.api.max_concurrent
         results = self.prepare_search(
             *queries,
             file=False,
@@ -640,10 +1146,37 @@ class Context:
             date_from=date_from,
             date_to=date_to,
         )
-        coro = self._datasets(*results, keep_duplicates=keep_duplicates)
+        async for dataset in self._iter_datasets(
+            *results,
+            keep_duplicates=keep_duplicates,
+            max_pages=max_pages,
+        ):
+            yield dataset
+
+    def datasets(
+        self,
+        *queries: Query,
+        hits: list[int] | None = None,
+        offset: int = 0,
+        max_hits: int | None = 200,
+        page_limit: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        keep_duplicates: bool = True,
+    ) -> list[Dataset]:
+        coro = self.adatasets(
+            *queries,
+            hits=hits,
+            offset=offset,
+            max_hits=max_hits,
+            page_limit=page_limit,
+            date_from=date_from,
+            date_to=date_to,
+            keep_duplicates=keep_duplicates,
+        )
         return self._sync(coro)
 
-    def files(
+    async def afiles(
         self,
         *queries: Query,
         hits: list[int] | None = None,
@@ -655,7 +1188,7 @@ class Context:
         keep_duplicates: bool = True,
     ) -> list[File]:
         if hits is None:
-            hits = self.hits(*queries, file=True)
+            hits = await self.ahits(*queries, file=True)
         results = self.prepare_search(
             *queries,
             file=True,
@@ -666,10 +1199,72 @@ class Context:
             date_from=date_from,
             date_to=date_to,
         )
-        coro = self._files(*results, keep_duplicates=keep_duplicates)
+        return await self._files(*results, keep_duplicates=keep_duplicates)
+
+    async def iter_files(
+        self,
+        *queries: Query,
+        hits: list[int] | None = None,
+        offset: int = 0,
+        max_hits: int | None = 200,
+        page_limit: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        keep_duplicates: bool = True,
+        max_pages: int | None = None,
+    ) -> AsyncIterator[File]:
+        """
+        Like `afiles`, files are yielded as pages are received.
+
+        At most `max_pages` pages are in flight (`api.max_concurrent` by
+        default). Deduplication keeps the shas of all yielded files,
+        it is disabled with `keep_duplicates`.
+        """
+        if hits is None:
+            hits = await self.ahits(*queries, file=True)
+        if max_pages is None:
+            max_pages = self.config.api.max_concurrent
+        results = self.prepare_search(
+            *queries,
+            file=True,
+            hits=hits,
+            offset=offset,
+            page_limit=page_limit,
+            max_hits=max_hits,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        async for file in self._iter_files(
+            *results,
+            keep_duplicates=keep_duplicates,
+            max_pages=max_pages,
+        ):
+            yield file
+
+    def files(
+        self,
+        *queries: Query,
+        hits: list[int] | None = None,
+        offset: int = 0,
+        max_hits: int | None = 200,
+        page_limit: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        keep_duplicates: bool = True,
+    ) -> list[File]:
+        coro = self.afiles(
+            *queries,
+            hits=hits,
+            offset=offset,
+            max_hits=max_hits,
+            page_limit=page_limit,
+            date_from=date_from,
+            date_to=date_to,
+            keep_duplicates=keep_duplicates,
+        )
         return self._sync(coro)
 
-    def search_as_queries(
+    async def asearch_as_queries(
         self,
         *queries: Query,
         file: bool,
@@ -682,7 +1277,7 @@ class Context:
         keep_duplicates: bool = True,
     ) -> Sequence[Query]:
         if hits is None:
-            hits = self.hits(*queries, file=file)
+            hits = await self.ahits(*queries, file=file)
         results = self.prepare_search(
             *queries,
             file=file,
@@ -694,13 +1289,37 @@ class Context:
             date_to=date_to,
             fields_param=["*"],
         )
-        coro = self._search_as_queries(
+        return await self._search_as_queries(
             *results,
             keep_duplicates=keep_duplicates,
         )
+
+    def search_as_queries(
+        self,
+        *queries: Query,
+        file: bool,
+        hits: list[int] | None = None,
+        offset: int = 0,
+        max_hits: int | None = 1,
+        page_limit: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        keep_duplicates: bool = True,
+    ) -> Sequence[Query]:
+        coro = self.asearch_as_queries(
+            *queries,
+            file=file,
+            hits=hits,
+            offset=offset,
+            max_hits=max_hits,
+            page_limit=page_limit,
+            date_from=date_from,
+            date_to=date_to,
+            keep_duplicates=keep_duplicates,
+        )
         return self._sync(coro)
 
-    def search(
+    async def asearch(
         self,
         *queries: Query,
         file: bool,
@@ -712,12 +1331,12 @@ class Context:
         date_to: datetime | None = None,
         keep_duplicates: bool = True,
     ) -> Sequence[File | Dataset]:
-        fun: Callable[..., Sequence[File | Dataset]]
+        fun: Callable[..., Coroutine[None, None, Sequence[File | Dataset]]]
         if file:
-            fun = self.files
+            fun = self.afiles
         else:
-            fun = self.datasets
-        return fun(
+            fun = self.adatasets
+        return await fun(
             *queries,
             hits=hits,
             offset=offset,
@@ -727,3 +1346,28 @@ class Context:
             date_to=date_to,
             keep_duplicates=keep_duplicates,
         )
+
+    def search(
+        self,
+        *queries: Query,
+        file: bool,
+        hits: list[int] | None = None,
+        offset: int = 0,
+        max_hits: int | None = 200,
+        page_limit: int | None = None,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        keep_duplicates: bool = True,
+    ) -> Sequence[File | Dataset]:
+        coro = self.asearch(
+            *queries,
+            file=file,
+            hits=hits,
+            offset=offset,
+            max_hits=max_hits,
+            page_limit=page_limit,
+            date_from=date_from,
+            date_to=date_to,
+            keep_duplicates=keep_duplicates,
+        )
+        return self._sync(coro)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import signal
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+
+from esgpull.database import WriteBuffer
+from esgpull.esgpull import Esgpull
+from esgpull.lease import Lease
+from esgpull.models import File, FileStatus
+from esgpull.processor import Processor
+from esgpull.result import Err, Ok, Result
+from esgpull.tui import logger
+from esgpull.utils import format_size
+
+
+@dataclass
+class Daemon:
+    """
+    Long-lived download loop over the `file` table.
+
+    `Queued` files are polled every `poll_interval` seconds and fed to a
+    single `Processor`, with at most `max_inflight` files downloading or
+    waiting for a download slot. Files are claimed with a `Lease`, several
+    daemons (or `esgpull download`) can share the same database.
+
+    `stop` drains the daemon: no new file is pulled and files in flight
+    are downloaded to completion. Files left `Starting`/`Started` without
+    a live lease (e.g. by a killed daemon) are queued again by `recover`,
+    their download resumes from the bytes already on disk.
+    When `run` ends with an error or is cancelled, files in flight are
+    queued again and their leases released.
+    """
+
+    esg: Esgpull
+    lease: Lease
+    buffer: WriteBuffer
+    poll_interval: float = 10.0
+    max_inflight: int = 15
+    stopping: asyncio.Event = field(init=False, default_factory=asyncio.Event)
+    done: int = field(init=False, default=0)
+    errors: int = field(init=False, default=0)
+    inflight: dict[str, File] = field(init=False, default_factory=dict)
+
+    @staticmethod
+    def from_esgpull(esg: Esgpull) -> Daemon:
+        return Daemon(
+            esg,
+            Lease.from_config(esg.db, esg.config),
+            WriteBuffer.from_config(esg.db, esg.config),
+            poll_interval=esg.config.daemon.poll_interval,
+            max_inflight=(
+                esg.config.download.max_concurrent
+                + esg.config.daemon.lookahead
+            ),
+        )
+
+    def recover(self) -> list[File]:
+        self.esg.recover_installed()
+        files = self.lease.orphaned()
+        for file in files:
+            file.status = FileStatus.Queued
+            self.lease.release(file)
+        if files:
+            self.esg.db.add(*files, refresh=False)
+            logger.warning(f"Re-queued {len(files)} interrupted downloads.")
+        return files
+
+    def stop(self) -> None:
+        if not self.stopping.is_set():
+            logger.info("Stopping, waiting for downloads in flight.")
+            self.stopping.set()
+
+    async def wait(self) -> None:
+        """
+        Sleep for `poll_interval` seconds, or until stopping.
+        """
+        try:
+            await asyncio.wait_for(self.stopping.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def files(self, processor: Processor) -> AsyncIterator[File]:
+        while not self.stopping.is_set():
+            match self.lease.claim_next():
+                case []:
+                    await self.wait()
+                case [file] if processor.should_download(file):
+                    self.inflight[file.sha] = file
+                    yield file
+                case [file]:
+                    file.status = FileStatus.Done
+                    self.lease.release(file)
+                    self.buffer.add(file)
+
+    def on_start(self, file: File) -> None:
+        file.status = FileStatus.Started
+        self.buffer.add(file)
+
+    async def run(self) -> None:
+        self.recover()
+        processor = Processor(
+            config=self.esg.config,
+            auth=self.esg.auth,
+            fs=self.esg.fs,
+        )
+        stream = processor.feed(
+            self.files(processor),
+            max_inflight=self.max_inflight,
+            on_start=self.on_start,
+        )
+        async with self.lease.keepalive(), self.buffer.autoflush():
+            try:
+                async for result in stream:
+                    self.on_result(result)
+            finally:
+                self.requeue_inflight()
+
+    def requeue_inflight(self) -> None:
+        files = list(self.inflight.values())
+        self.inflight.clear()
+        for file in files:
+            file.status = FileStatus.Queued
+            self.lease.release(file)
+        if files:
+            self.buffer.add(*files)
+            logger.warning(f"Re-queued {len(files)} downloads in flight.")
+
+    def on_result(self, result: Result) -> None:
+        file = result.data.file
+        match result:
+            case Ok() if not result.data.finished:
+                return
+            case Ok():
+                digest = result.data.digest
+                match self.esg.fs.finalize(file, digest=digest):
+                    case Ok():
+                        file.status = FileStatus.Done
+                        self.done += 1
+                        size = format_size(file.size)
+                        logger.info(f"Downloaded {file.file_id} ({size})")
+                    case Err(_, err):
+                        file.status = FileStatus.Error
+                        self.errors += 1
+                        logger.error(f"{file.file_id}: {err!r}")
+            case Err(_, err):
+                file.status = FileStatus.Error
+                self.errors += 1
+                logger.error(f"{file.file_id}: {err!r}")
+        self.inflight.pop(file.sha, None)
+        self.lease.release(file)
+        self.buffer.add(file)
+
+    async def serve(self) -> None:
+        """
+        `run` until SIGINT/SIGTERM, the first signal drains the daemon,
+        a second one cancels downloads in flight.
+        """
+        loop = asyncio.get_running_loop()
+        main = asyncio.current_task()
+
+        def on_signal() -> None:
+            if self.stopping.is_set() and main is not None:
+                logger.warning("Cancelling downloads in flight.")
+                main.cancel()
+            else:
+                self.stop()
+
+        signals = (signal.SIGINT, signal.SIGTERM)
+        for sig in signals:
+            loop.add_signal_handler(sig, on_signal)
+        try:
+            await self.run()
+        finally:
+            for sig in signals:
+                loop.remove_signal_handler(sig)
@@ -1,22 +1,21 @@
 from __future__ import annotations
 
-from collections.abc import Iterator, Sequence
-from contextlib import contextmanager
+import asyncio
+from collections.abc import AsyncIterator, Iterator, Mapping, Sequence
+from contextlib import asynccontextmanager, contextmanager, suppress
 from dataclasses import InitVar, dataclass, field
 from pathlib import Path
-from typing import TypeVar
+from typing import Any, TypeVar, cast
 
-import alembic.command
 import sqlalchemy as sa
 import sqlalchemy.orm
-from alembic.config import Config as AlembicConfig
-from alembic.migration import MigrationContext
-from alembic.script import ScriptDirectory
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import Session, joinedload, make_transient
+from sqlalchemy.sql.dml import ReturningUpdate
 
 from esgpull import __file__
 from esgpull.config import Config
-from esgpull.models import File, Query, Table, sql
+from esgpull.models import Base, File, Query, Table, sql
 from esgpull.version import __version__
 
 # from esgpull.exceptions import NoClauseError
@@ -32,14 +31,20 @@ class Database:
 
     url: str
     run_migrations: InitVar[bool] = True
+    batch_size: int = 10_000
     _engine: sa.Engine = field(init=False)
     session: Session = field(init=False)
     version: str | None = field(init=False, default=None)
+    _flushed: bool = field(init=False, default=False)
 
     @staticmethod
     def from_config(config: Config, run_migrations: bool = True) -> Database:
         url = f"sqlite:///{config.paths.db / config.db.filename}"
-        return Database(url, run_migrations=run_migrations)
+        return Database(
+            url,
+            run_migrations=run_migrations,
+            batch_size=config.db.batch_size,
+        )
 
     def _setup_sqlite(self, conn, record):
         cursor = conn.cursor()
@@ -52,10 +57,32 @@ class Database:
         self._engine = sa.create_engine(self.url)
         sa.event.listen(self._engine, "connect", self._setup_sqlite)
         self.session = Session(self._engine)
+        sa.event.listen(self.session, "after_flush", self._on_flush)
+        sa.event.listen(self.session, "after_commit", self._on_end)
+        sa.event.listen(self.session, "after_rollback", self._on_end)
         if run_migrations:
-            self._update()
+            self.version = self._stored_version()
+            if self.version != __version__ or "+dev" in __version__:
+                self._update()
+
+    def _stored_version(self) -> str | None:
+        """
+        Read the revision stored by alembic without importing it,
+        migrations are only checked when it differs from `__version__`.
+        """
+        stmt = sa.text("SELECT version_num FROM version")
+        try:
+            with self._engine.connect() as conn:
+                return conn.execute(stmt).scalar()
+        except sa.exc.OperationalError:  # no version table yet
+            return None
 
     def _update(self) -> None:
+        import alembic.command
+        from alembic.config import Config as AlembicConfig
+        from alembic.migration import MigrationContext
+        from alembic.script import ScriptDirectory
+
         alembic_config = AlembicConfig()
         migrations_path = Path(__file__).parent / "migrations"
         alembic_config.set_main_option("script_location", str(migrations_path))
@@ -78,6 +105,12 @@ class Database:
             )
             self.version = __version__
 
+    def _on_flush(self, *args: Any) -> None:
+        self._flushed = True
+
+    def _on_end(self, *args: Any) -> None:
+        self._flushed = False
+
     @property
     @contextmanager
     def safe(self) -> Iterator[None]:
@@ -130,12 +163,101 @@ class Database:
         with self.safe:
             return list(self.session.execute(statement).all())
 
-    def add(self, *items: Table) -> None:
+    @contextmanager
+    def _writer(self) -> Iterator[sa.Connection]:
+        """
+        Connection for a write committed in its own transaction, so that
+        pending changes of the session are neither flushed nor expired.
+        Once the session flushed, it holds sqlite's write lock until its
+        commit, the write is then committed along with the session.
+        """
+        if not self._flushed:
+            with self._engine.begin() as conn:
+                yield conn
+            return
+        with self.safe:
+            yield self.session.connection()
+            self.session.expire_on_commit = False
+            try:
+                self.session.commit()
+            finally:
+                self.session.expire_on_commit = True
+
+    def update(self, statement: sa.Update) -> int:
+        """
+        Execute and commit a bulk UPDATE, returns the number of rows.
+        Items already loaded in the session are left untouched.
+        """
+        with self._writer() as conn:
+            return conn.execute(statement).rowcount
+
+    def update_returning(
+        self, statement: ReturningUpdate[tuple[T]]
+    ) -> list[T]:
+        """
+        Same as `update`, returns the first column of updated rows.
+        """
+        with self._writer() as conn:
+            return list(conn.execute(statement).scalars())
+
+    def add(self, *items: Table, refresh: bool = True) -> None:
+        """
+        With `refresh` disabled, items are neither expired nor reloaded after
+        the commit, which saves one SELECT per item when their in-memory state
+        is known to match the database.
+        """
         with self.safe:
             self.session.add_all(items)
-            self.session.commit()
-            for item in items:
-                self.session.refresh(item)
+            self.session.expire_on_commit = refresh
+            try:
+                self.session.commit()
+            finally:
+                self.session.expire_on_commit = True
+            if refresh:
+                for item in items:
+                    self.session.refresh(item)
+
+    def _executemany(
+        self,
+        statement: sa.Insert,
+        rows: Sequence[Mapping[str, Any]],
+    ) -> None:
+        with self.safe:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start : start + self.batch_size]
+                self.session.execute(statement, batch)
+                self.session.commit()
+
+    def upsert(self, *items: Table, update: bool = True) -> None:
+        """
+        Bulk insert of `items` sharing the same table, bypassing the ORM.
+
+        Rows are inserted with `executemany` in transactions of `batch_size`
+        rows, without refreshing items. Existing rows (same sha) are updated,
+        or left untouched if `update` is False.
+        Relationships are not inserted, see `link_many` for query/file links.
+        """
+        if not items:
+            return
+        table = type(items[0]).__table__
+        assert isinstance(table, sa.Table)
+        names = [column.key for column in table.columns]
+        rows = [
+            {name: getattr(item, name) for name in names} for item in items
+        ]
+        stmt = sqlite.insert(table)
+        if update:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["sha"],
+                set_={
+                    name: stmt.excluded[name]
+                    for name in names
+                    if name != "sha"
+                },
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=["sha"])
+        self._executemany(stmt, rows)
 
     def delete(self, *items: Table) -> None:
         with self.safe:
@@ -148,9 +270,28 @@ class Database:
     def link(self, query: Query, file: File):
         self.session.execute(sql.query_file.link(query, file))
 
+    def link_many(self, query: Query, *files: File) -> None:
+        """
+        Bulk version of `link`, existing links are ignored.
+        Links are committed in transactions of `batch_size` rows.
+        """
+        rows = [dict(query_sha=query.sha, file_sha=file.sha) for file in files]
+        self._executemany(sql.query_file.insert_ignore(), rows)
+
     def unlink(self, query: Query, file: File):
         self.session.execute(sql.query_file.unlink(query, file))
 
+    def unlink_many(self, query: Query, *files: File) -> None:
+        """
+        Bulk version of `unlink`, a single DELETE per `batch_size` files.
+        """
+        shas = [file.sha for file in files]
+        with self.safe:
+            for start in range(0, len(shas), self.batch_size):
+                batch = shas[start : start + self.batch_size]
+                self.session.execute(sql.query_file.unlink_many(query, batch))
+            self.session.commit()
+
     def __contains__(self, item: Table) -> bool:
         return self.scalars(sql.count(item))[0] > 0
 
@@ -178,3 +319,56 @@ class Database:
                 if file.version != latest_version:
                     deprecated.append(file)
         return deprecated
+
+
+@dataclass
+class WriteBuffer:
+    """
+    Write-behind buffer for `Database.add`, during downloads.
+
+    Items are committed in a single transaction once `max_items` are
+    pending, every `max_delay` seconds with `autoflush`, and on exit.
+    Status updates that were not flushed are lost on crash, installed files
+    are recovered from their DRS path (see `Esgpull.recover_installed`).
+    """
+
+    db: Database
+    max_items: int = 100
+    max_delay: float = 5.0
+    items: dict[str, Base] = field(init=False, default_factory=dict)
+
+    @staticmethod
+    def from_config(db: Database, config: Config) -> WriteBuffer:
+        return WriteBuffer(
+            db,
+            max_items=config.db.flush_every,
+            max_delay=config.db.flush_interval,
+        )
+
+    def add(self, *items: Base) -> None:
+        for item in items:
+            self.items[item.sha] = item
+        if len(self.items) >= self.max_items:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.items:
+            items = list(self.items.values())
+            self.items.clear()
+            self.db.add(*items, refresh=False)
+
+    @asynccontextmanager
+    async def autoflush(self) -> AsyncIterator[None]:
+        async def flush_loop() -> None:
+            while True:
+                await asyncio.sleep(self.max_delay)
+                self.flush()
+
+        task = asyncio.create_task(flush_loop())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+            self.flush()
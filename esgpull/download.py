@@ -1,24 +1,33 @@
-# from math import ceil
+from __future__ import annotations
+
+import asyncio
 from collections.abc import AsyncGenerator
-from dataclasses import dataclass
+from contextlib import aclosing
+from dataclasses import dataclass, field, replace
+from time import perf_counter
+from urllib.parse import urlsplit
 
-from httpx import AsyncClient
+from httpx import AsyncClient, HTTPError
 
+from esgpull.config import Config
+from esgpull.context import Context
+from esgpull.exceptions import DownloadRangeError
 from esgpull.fs import Digest
-from esgpull.models import File
+from esgpull.models import File, Query
+from esgpull.tui import logger
 
-# import asyncio
-# from urllib.parse import urlsplit
-# from esgpull.auth import Auth
-# from esgpull.context import Context
+Range = tuple[int, int]
 
 
 @dataclass
 class DownloadCtx:
     file: File
     completed: int = 0
+    contiguous: int = 0  # bytes written without gaps from the start
     chunk: bytes | None = None
+    offset: int | None = None  # position of `chunk` in file, None appends
     digest: Digest | None = None
+    retries: int = 0
 
     @property
     def finished(self) -> bool:
@@ -28,9 +37,53 @@ class DownloadCtx:
     def error(self) -> bool:
         return self.completed > self.file.size
 
-    def update_digest(self) -> None:
+    def snapshot(self) -> DownloadCtx:
+        """
+        Copy of the current state, for results consumed after the download
+        went on (e.g. `finished` must not turn true on an earlier result).
+        """
+        return replace(self, chunk=None, offset=None)
+
+    async def update_digest(self) -> None:
         if self.digest is not None and self.chunk is not None:
-            self.digest.update(self.chunk)
+            await self.digest.aupdate(self.chunk)
+
+    def restart(self) -> None:
+        """
+        Discard resumed bytes, next chunk is written at the start of file.
+        """
+        self.completed = 0
+        self.contiguous = 0
+        self.offset = 0
+        if self.digest is not None:
+            self.digest = Digest(self.file, executor=self.digest.executor)
+
+
+@dataclass
+class Extents:
+    """
+    Tracks written byte intervals to find the contiguous prefix of a file
+    written out of order.
+    """
+
+    prefix: int
+    ends: dict[int, int] = field(default_factory=dict)  # start -> end
+    starts: dict[int, int] = field(default_factory=dict)  # end -> start
+
+    def add(self, offset: int, size: int) -> int:
+        start, end = offset, offset + size
+        if start in self.starts:
+            start = self.starts.pop(start)
+            del self.ends[start]
+        if end in self.ends:
+            end = self.ends.pop(end)
+            del self.starts[end]
+        if start == self.prefix:
+            self.prefix = end
+        else:
+            self.ends[start] = end
+            self.starts[end] = start
+        return self.prefix
 
 
 class BaseDownloader:
@@ -46,6 +99,9 @@ class BaseDownloader:
 class Simple(BaseDownloader):
     """
     Simple chunked async downloader.
+
+    Resumes from `ctx.completed` with a `Range` header, the download
+    restarts from scratch if the server does not honor it.
     """
 
     async def stream(
@@ -54,109 +110,305 @@ class Simple(BaseDownloader):
         ctx: DownloadCtx,
         chunk_size: int,
     ) -> AsyncGenerator[DownloadCtx, None]:
-        async with client.stream("GET", ctx.file.url) as resp:
+        headers = {}
+        if ctx.completed > 0:
+            headers["Range"] = f"bytes={ctx.completed}-"
+        async with client.stream("GET", ctx.file.url, headers=headers) as resp:
             resp.raise_for_status()
+            if ctx.completed > 0 and resp.status_code != 206:
+                ctx.restart()
             async for chunk in resp.aiter_bytes(chunk_size=chunk_size):
                 ctx.completed += len(chunk)
+                ctx.contiguous = ctx.completed
                 ctx.chunk = chunk
-                ctx.update_digest()
+                await ctx.update_digest()
+                yield ctx
+
+
+class Ranged(BaseDownloader):
+    """
+    Ranged chunked async downloader.
+    Splits the file into byte ranges fetched concurrently using `Range`
+    headers, each chunk is yielded with its offset in the file.
+
+    Falls back to `Simple` if the server does not accept byte ranges.
+
+    Chunks are not received in order, the checksum is thus computed
+    from the completed file instead of during the download.
+    """
+
+    def __init__(self, range_size: int, max_connections: int) -> None:
+        self.range_size = range_size
+        self.max_connections = max_connections
+
+    def make_ranges(self, offset: int, size: int) -> asyncio.Queue[Range]:
+        ranges: asyncio.Queue[Range] = asyncio.Queue()
+        for start in range(offset, size, self.range_size):
+            ranges.put_nowait((start, min(start + self.range_size, size) - 1))
+        return ranges
+
+    async def probe(
+        self,
+        client: AsyncClient,
+        url: str,
+        size: int,
+    ) -> str | None:
+        """
+        Returns the final url (after redirects) if it accepts byte ranges.
+        """
+        try:
+            resp = await client.head(url)
+            resp.raise_for_status()
+        except HTTPError:
+            return None
+        accept_ranges = resp.headers.get("Accept-Ranges")
+        content_length = resp.headers.get("Content-Length")
+        if accept_ranges == "bytes" and content_length == str(size):
+            return str(resp.url)
+        else:
+            return None
+
+    async def iter_range(
+        self,
+        client: AsyncClient,
+        url: str,
+        start: int,
+        end: int,
+        chunk_size: int,
+    ) -> AsyncGenerator[bytes, None]:
+        headers = {"Range": f"bytes={start}-{end}"}
+        async with client.stream("GET", url, headers=headers) as resp:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise DownloadRangeError(resp.status_code, url)
+            async for chunk in resp.aiter_bytes(chunk_size=chunk_size):
+                yield chunk
+
+    async def worker(
+        self,
+        client: AsyncClient,
+        url: str,
+        ranges: asyncio.Queue[Range],
+        output: asyncio.Queue,
+        chunk_size: int,
+    ) -> None:
+        while True:
+            start, end = await ranges.get()
+            try:
+                offset = start
+                chunks = self.iter_range(client, url, start, end, chunk_size)
+                async with aclosing(chunks):
+                    async for chunk in chunks:
+                        await output.put((offset, chunk))
+                        offset += len(chunk)
+            except Exception as exc:
+                await output.put(exc)
+                return
+            finally:
+                ranges.task_done()
+
+    async def collect(
+        self,
+        ctx: DownloadCtx,
+        ranges: asyncio.Queue[Range],
+        output: asyncio.Queue,
+        workers: list[asyncio.Task],
+    ) -> AsyncGenerator[DownloadCtx, None]:
+        async def join() -> None:
+            await ranges.join()
+            await output.put(None)
+
+        tasks = workers + [asyncio.create_task(join())]
+        extents = Extents(ctx.contiguous)
+        ctx.digest = None
+        try:
+            while (item := await output.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                offset, chunk = item
+                ctx.offset, ctx.chunk = offset, chunk
+                ctx.completed += len(chunk)
+                ctx.contiguous = extents.add(offset, len(chunk))
+                yield ctx
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stream(
+        self,
+        client: AsyncClient,
+        ctx: DownloadCtx,
+        chunk_size: int,
+    ) -> AsyncGenerator[DownloadCtx, None]:
+        size = ctx.file.size
+        url: str | None = None
+        if self.max_connections > 1 and size - ctx.completed > self.range_size:
+            url = await self.probe(client, ctx.file.url, size)
+        if url is None:
+            async for ctx in Simple().stream(client, ctx, chunk_size):
                 yield ctx
+            return
+        ranges = self.make_ranges(ctx.completed, size)
+        output: asyncio.Queue = asyncio.Queue(self.max_connections)
+        workers = [
+            asyncio.create_task(
+                self.worker(client, url, ranges, output, chunk_size)
+            )
+            for _ in range(min(self.max_connections, ranges.qsize()))
+        ]
+        async for ctx in self.collect(ctx, ranges, output, workers):
+            yield ctx
+
+
+class Distributed(Ranged):
+    """
+    Distributed chunked async downloader.
+    Fetches ranges from multiple URLs pointing to replicas of the same file.
+
+    Replicas are found with a distributed search on the file's instance_id,
+    then each mirror is probed with a HEAD request. Workers take ranges
+    from a shared queue, a mirror that fails or becomes much slower than
+    the fastest one is dropped and the rest of its range is put back into
+    the queue for the other mirrors. There is one worker per mirror.
+    """
+
+    max_ping: float = 5.0
+    slow_ratio: float = 4.0
 
+    def __init__(
+        self,
+        config: Config,
+        range_size: int,
+        max_connections: int,
+    ) -> None:
+        super().__init__(range_size, max_connections)
+        self.config = config
+
+    async def fetch_urls(self, file: File) -> list[str]:
+        query = Query(
+            selection=dict(instance_id=file.file_id),
+            options=dict(distrib=True, latest=None, replica=None),
+        )
+        urls = [file.url]
+        try:
+            async with Context(self.config, noraise=True) as ctx:
+                hits = await ctx._hits(*ctx.prepare_hits(query, file=True))
+                results = ctx.prepare_search(
+                    query,
+                    file=True,
+                    hits=hits,
+                    max_hits=None,
+                )
+                replicas = await ctx._files(*results, keep_duplicates=True)
+        except Exception as exc:
+            logger.warning(f"Could not fetch replicas of {file.file_id}")
+            logger.exception(exc)
+            return urls
+        for replica in replicas:
+            if replica.sha == file.sha and replica.url not in urls:
+                urls.append(replica.url)
+        return urls
+
+    async def probe_mirrors(
+        self,
+        client: AsyncClient,
+        urls: list[str],
+        size: int,
+    ) -> list[str]:
+        """
+        Returns the mirrors accepting byte ranges, fastest to answer first.
+        Urls redirecting to the same mirror are only returned once.
+        """
+        mirrors: list[str] = []
+
+        async def probe_one(url: str) -> None:
+            try:
+                probe = self.probe(client, url, size)
+                mirror = await asyncio.wait_for(probe, self.max_ping)
+            except asyncio.TimeoutError:
+                logger.info(f"Mirror {urlsplit(url).netloc} is too slow")
+                return
+            if mirror is not None:
+                mirrors.append(mirror)
+
+        await asyncio.gather(*[probe_one(url) for url in urls])
+        return list(dict.fromkeys(mirrors))
+
+    async def mirror_worker(
+        self,
+        client: AsyncClient,
+        url: str,
+        ranges: asyncio.Queue[Range],
+        output: asyncio.Queue,
+        chunk_size: int,
+        speeds: dict[str, float],
+    ) -> None:
+        while True:
+            start, end = await ranges.get()
+            offset = start
+            error: Exception | None = None
+            too_slow = False
+            try:
+                tic = perf_counter()
+                chunks = self.iter_range(client, url, start, end, chunk_size)
+                # closes the response when breaking on a slow mirror
+                async with aclosing(chunks):
+                    async for chunk in chunks:
+                        await output.put((offset, chunk))
+                        offset += len(chunk)
+                        elapsed = perf_counter() - tic
+                        speeds[url] = (offset - start) / elapsed
+                        too_slow = (
+                            offset <= end
+                            and len(speeds) > 1
+                            and speeds[url] * self.slow_ratio
+                            < max(speeds.values())
+                        )
+                        if too_slow:
+                            break
+            except Exception as exc:
+                error = exc
+            if error is None and not too_slow:
+                ranges.task_done()
+                continue
+            speeds.pop(url, None)
+            if offset <= end:
+                ranges.put_nowait((offset, end))
+            ranges.task_done()
+            reason = "too slow" if error is None else repr(error)
+            logger.warning(f"Dropped mirror {urlsplit(url).netloc}: {reason}")
+            if not speeds and error is not None:
+                await output.put(error)
+            return
 
-# class Distributed(BaseDownloader):
-#     """
-#     Distributed chunked async downloader.
-#     Fetches chunks from multiple URLs pointing to the same file.
-#     """
-
-#     def __init__(
-#         self,
-#         auth: Auth,
-#         *,
-#         file: File | None = None,
-#         url: str | None = None,
-#         config: Config | None = None,
-#         max_ping: float = 5.0,
-#     ) -> None:
-#         super().__init__(auth, file=file, url=url, config=config)
-#         self.max_ping = max_ping
-
-#     async def try_url(self, url: str, client: AsyncClient) -> str | None:
-#         result = None
-#         node = urlsplit(url).netloc
-#         print(f"trying url on '{node}'")
-#         try:
-#             resp = await client.head(url)
-#             print(f"got response on '{node}'")
-#             resp.raise_for_status()
-#             accept_ranges = resp.headers.get("Accept-Ranges")
-#             content_length = resp.headers.get("Content-Length")
-#             if (
-#                 accept_ranges == "bytes"
-#                 and int(content_length) == self.file.size
-#             ):
-#                 result = str(resp.url)
-#             else:
-#                 print(dict(resp.headers))
-#         except HTTPError as err:
-#             print(type(err))
-#             print(err.request.headers)
-#         return result
-
-#     async def process_queue(
-#         self, url: str, queue: asyncio.Queue
-#     ) -> tuple[list[tuple[int, bytes]], str]:
-#         node = urlsplit(url).netloc
-#         print(f"starting process on '{node}'")
-#         chunks: list[tuple[int, bytes]] = []
-#         async with self.make_client() as client:
-#             final_url = await self.try_url(url, client)
-#             if final_url is None:
-#                 print(f"no url found for '{node}'")
-#                 return chunks, url
-#             else:
-#                 url = final_url
-#             while not queue.empty():
-#                 chunk_idx = await queue.get()
-#                 print(f"processing chunk {chunk_idx} on '{node}'")
-#                 start = chunk_idx * self.config.download.chunk_size
-#                 end = min(
-#                     self.file.size,
-#                     (chunk_idx + 1) * self.config.download.chunk_size - 1,
-#                 )
-#                 headers = {"Range": f"bytes={start}-{end}"}
-#                 resp = await client.get(url, headers=headers)
-#                 queue.task_done()
-#                 if resp.status_code == 206:
-#                     chunks.append((chunk_idx, resp.content))
-#                 else:
-#                     await queue.put(chunk_idx)
-#                     print(f"error status {resp.status_code} on '{node}'")
-#                     break
-#         return chunks, url
-
-#     async def fetch_urls(self) -> list[str]:
-#         ctx = Context(distrib=True)
-#         ctx.query.instance_id = self.file.file_id
-#         results = await ctx._search(file=True)
-#         files = [File.from_dict(item) for item in results]
-#         return [file.url for file in files]
-
-# async def aget(self) -> bytes:
-#     nb_chunks = ceil(self.file.size / self.config.download.chunk_size)
-#     queue: asyncio.Queue[int] = asyncio.Queue(nb_chunks)
-#     for chunk_idx in range(nb_chunks):
-#         queue.put_nowait(chunk_idx)
-#     completed: list[bool] = [False for _ in range(nb_chunks)]
-#     chunks: list[bytes] = [bytes() for _ in range(nb_chunks)]
-#     urls = await self.fetch_urls()
-#     workers = [self.process_queue(url, queue) for url in urls]
-#     for future in asyncio.as_completed(workers):
-#         some_chunks, url = await future
-#         print(f"got {len(some_chunks)} chunks from {url}")
-#         for chunk_idx, chunk in some_chunks:
-#             completed[chunk_idx] = True
-#             chunks[chunk_idx] = chunk
-#     if not all(completed):
-#         raise ValueError("TODO: progressive write (with .part file)")
-#     return b"".join(chunks)
+    async def stream(
+        self,
+        client: AsyncClient,
+        ctx: DownloadCtx,
+        chunk_size: int,
+    ) -> AsyncGenerator[DownloadCtx, None]:
+        size = ctx.file.size
+        mirrors: list[str] = []
+        if size - ctx.completed > self.range_size:
+            urls = await self.fetch_urls(ctx.file)
+            mirrors = await self.probe_mirrors(client, urls, size)
+        if len(mirrors) < 2:
+            async for ctx in super().stream(client, ctx, chunk_size):
+                yield ctx
+            return
+        nodes = ", ".join(urlsplit(url).netloc for url in mirrors)
+        logger.info(f"Downloading {ctx.file.file_id} from {nodes}")
+        ranges = self.make_ranges(ctx.completed, size)
+        output: asyncio.Queue = asyncio.Queue(len(mirrors))
+        speeds = {url: 0.0 for url in mirrors}
+        workers = [
+            asyncio.create_task(
+                self.mirror_worker(
+                    client, url, ranges, output, chunk_size, speeds
+                )
+            )
+            for url in mirrors
+        ]
+        async for ctx in self.collect(ctx, ranges, output, workers):
+            yield ctx
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import logging
-from collections.abc import AsyncIterator
+import weakref
+from collections.abc import AsyncIterator, Sequence
+from contextlib import nullcontext
 from dataclasses import dataclass
 from functools import cached_property, partial
 from pathlib import Path
@@ -24,7 +26,7 @@ from rich.progress import (
 from esgpull.auth import Auth, Credentials
 from esgpull.config import Config
 from esgpull.context import Context
-from esgpull.database import Database
+from esgpull.database import Database, WriteBuffer
 from esgpull.exceptions import (
     DownloadCancelled,
     InvalidInstallPath,
@@ -33,9 +35,12 @@ from esgpull.exceptions import (
 )
 from esgpull.fs import Filesystem
 from esgpull.graph import Graph
+from esgpull.health import Health
 from esgpull.install_config import InstallConfig
+from esgpull.lease import Lease
 from esgpull.models import (
     Facet,
+    FastFile,
     File,
     FileStatus,
     LegacyQuery,
@@ -44,8 +49,9 @@ from esgpull.models import (
     sql,
 )
 from esgpull.models.utils import short_sha
-from esgpull.processor import Processor
+from esgpull.processor import Processor, Task
 from esgpull.result import Err, Ok, Result
+from esgpull.scheduler import Schedulable, Scheduler
 from esgpull.tui import UI, DummyLive, Verbosity, logger
 from esgpull.utils import format_size
 
@@ -114,9 +120,24 @@ class Esgpull:
         credentials = Credentials.from_config(self.config)
         self.auth = Auth.from_config(self.config, credentials)
         self.context = Context(self.config, noraise=True)
+        # at the latest when garbage collected or at exit
+        weakref.finalize(self, self.context.close)
         if load_db:
             self.db = Database.from_config(self.config)
             self.graph = Graph(self.db)
+            self.context.health = Health.from_db(self.db, self.config)
+
+    def __enter__(self) -> Esgpull:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Release the event loop and http client of synchronous requests.
+        """
+        self.context.close()
 
     def fetch_index_nodes(self) -> list[str]:
         """
@@ -205,17 +226,20 @@ class Esgpull:
         self,
         url: Path,
         track: bool = False,
-        size: int = 5000,
+        size: int | None = None,
         ask: bool = False,
     ) -> int:
         assert url.is_file()
+        if size is None:
+            size = self.config.db.batch_size
         synda = Database(f"sqlite:///{url}", run_migrations=False)
         synda_ids = synda.scalars(sql.synda_file.ids())
         shas = set(self.db.scalars(sql.file.linked()))
         msg = f"Found {len(synda_ids)} files to import, proceed?"
         if ask and not self.ui.ask(msg):
             return 0
-        synda_shas: set[str] = set()
+        if self.legacy_query not in self.db:
+            self.db.add(self.legacy_query)
         idx_range = range(0, len(synda_ids), size)
         if track:
             iter_idx_range = self.ui.track(idx_range)
@@ -230,14 +254,76 @@ class Esgpull:
             for synda_file in synda_files:
                 file = synda_file.to_file()
                 if file.sha not in shas:
-                    file.queries.append(self.legacy_query)
                     files.append(file)
-                    synda_shas.add(file.sha)
+                    shas.add(file.sha)
             if files:
                 nb_imported += len(files)
-                self.db.add(*files)
+                self.db.upsert(*files)
+                self.db.link_many(self.legacy_query, *files)
         return nb_imported
 
+    def split_fast_files(
+        self,
+        query: Query,
+        fast_files: list[FastFile],
+    ) -> tuple[list[File], list[FastFile]]:
+        """
+        Split `fast_files` into files from the database that are not linked
+        to `query` yet, and fast files that are unknown to the database.
+        Fast files already linked to `query` are dropped.
+        """
+        batch_size = self.db.batch_size
+        known: list[File] = []
+        unknown: list[FastFile] = []
+        for start in range(0, len(fast_files), batch_size):
+            batch = fast_files[start : start + batch_size]
+            shas = [fast_file.sha for fast_file in batch]
+            linked_stmt = sql.query_file.linked_shas(query, shas)
+            linked = set(self.db.scalars(linked_stmt))
+            unlinked = [sha for sha in shas if sha not in linked]
+            batch_known = self.db.scalars(sql.file.with_shas(unlinked))
+            known.extend(batch_known)
+            skip = linked | {file.sha for file in batch_known}
+            for fast_file in batch:
+                if fast_file.sha not in skip:
+                    unknown.append(fast_file)
+        return known, unknown
+
+    def link_files(self, query: Query, files: list[File]) -> list[File]:
+        """
+        Link `files` to `query`, unknown files are added with queued status.
+
+        Existing shas and file_ids are resolved with one query per batch of
+        `db.batch_size` files, files and links are inserted in bulk.
+        Known files are unlinked from the legacy query.
+        Returns the files that could not be added, as their file_id already
+        exists in the database with a different checksum.
+        """
+        legacy = self.legacy_query
+        has_legacy = legacy.state.persistent
+        batch_size = self.db.batch_size
+        rejected: list[File] = []
+        for start in range(0, len(files), batch_size):
+            batch = files[start : start + batch_size]
+            shas = [file.sha for file in batch]
+            known_shas = set(self.db.scalars(sql.file.known_shas(shas)))
+            known = [file for file in batch if file.sha in known_shas]
+            unknown = [file for file in batch if file.sha not in known_shas]
+            file_ids = [file.file_id for file in unknown]
+            known_ids = set(self.db.scalars(sql.file.known_file_ids(file_ids)))
+            new_files: list[File] = []
+            for file in unknown:
+                if file.file_id in known_ids:
+                    rejected.append(file)
+                else:
+                    file.status = FileStatus.Queued
+                    new_files.append(file)
+            if has_legacy and known:
+                self.db.unlink_many(legacy, *known)
+            self.db.upsert(*new_files, update=False)
+            self.db.link_many(query, *known, *new_files)
+        return rejected
+
     # def add(
     #     self,
     #     *queries: Query,
@@ -320,7 +406,8 @@ class Esgpull:
                     if task.finished:
                         # TODO: add checksum verif here
                         progress.stop_task(task.id)
-                        progress.update(task.id, visible=False)
+                        progress.remove_task(task.id)
+                        task_ids.pop(result.data.file.sha)
                         sha = f"[b blue]{task.fields['sha']}[/]"
                         file = result.data.file
                         digest = result.data.digest
@@ -340,6 +427,10 @@ class Esgpull:
                                     f"[blue]{task.fields['data_node']}[/]"
                                 )
                                 parts = [sha, size, speed, data_node]
+                                if retries := result.data.retries:
+                                    parts.append(
+                                        f"[yellow]retried {retries}x[/]"
+                                    )
                                 if self.config.download.show_filename:
                                     parts.append(task.fields["filename"])
                                 msg = " · ".join(parts)
@@ -347,25 +438,69 @@ class Esgpull:
                                 live.console.print(msg)
                                 yield result
                             case Err(_, err):
-                                progress.remove_task(task.id)
                                 yield Err(result.data, err)
                 case Err():
                     progress.remove_task(task.id)
+                    task_ids.pop(result.data.file.sha)
                     yield result
                 case _:
                     raise ValueError("Unexpected result")
 
+    def recover_installed(self) -> list[File]:
+        """
+        Set files that were installed by a download interrupted before
+        their status was written (see `WriteBuffer`) to done.
+        Files are moved to their DRS path only once their checksum is
+        verified, so the DRS file with the right size is enough.
+        """
+        lease = Lease.from_config(self.db, self.config)
+        installed: list[File] = []
+        for file in lease.orphaned():
+            drs = self.fs[file].drs
+            if drs.is_file() and drs.stat().st_size == file.size:
+                file.status = FileStatus.Done
+                lease.release(file)
+                installed.append(file)
+        if installed:
+            self.db.add(*installed, refresh=False)
+            logger.info(f"Recovered {len(installed)} installed files.")
+        return installed
+
     async def download(
         self,
-        queue: list[File],
+        queue: Sequence[Schedulable],
         use_db: bool = True,
         show_progress: bool = True,
+        scheduler: Scheduler | None = None,
+        lease: Lease | None = None,
     ) -> tuple[list[File], list[Err]]:
         """
         Download files provided in `queue`.
+
+        With `use_db`, each file is claimed when it is picked for download,
+        files leased by another process sharing the database are skipped.
+        `queue` can then hold rows of `sql.file.queued_from_queries`, files
+        are only loaded once claimed. Without `use_db`, it must hold files.
+        Files that were not picked yet when the download is interrupted
+        are left in the queue.
         """
-        for file in queue:
-            file.status = FileStatus.Starting
+        if lease is None:
+            lease = Lease.from_config(self.db, self.config)
+        buffer = WriteBuffer.from_config(self.db, self.config)
+        skipped: list[Schedulable] = []
+
+        def claim(item: Schedulable) -> File | None:
+            if isinstance(item, File):
+                claimed = lease.claim(item)
+            else:
+                claimed = lease.claim_shas(item.sha)
+            if claimed:
+                return claimed[0]
+            skipped.append(item)
+            return None
+
+        if use_db:
+            self.recover_installed()
         main_progress = self.ui.make_progress(
             SpinnerColumn(),
             MofNCompleteColumn(),
@@ -393,73 +528,82 @@ class Esgpull:
             *file_columns,
             transient=True,
         )
-        file_task_shas = {}
-        start_callbacks = {}
-        for file in queue:
+        # progress tasks only exist for files being downloaded
+        file_task_shas: dict[str, TaskID] = {}
+        started: dict[str, File] = {}
+
+        def on_task(task: Task) -> None:
+            task.file.status = FileStatus.Starting
+            started[task.file.sha] = task.file
             task_id = file_progress.add_task(
                 "",
-                total=file.size,
+                total=task.file.size,
                 visible=False,
                 start=False,
-                sha=short_sha(file.sha),
-                filename=file.filename,
-                data_node=file.data_node,
+                sha=short_sha(task.file.sha),
+                filename=task.file.filename,
+                data_node=task.file.data_node,
             )
             callback = partial(file_progress.start_task, task_id)
-            file_task_shas[file.sha] = task_id
-            start_callbacks[file.sha] = [callback]
+            task.start_callbacks.append(callback)
+            file_task_shas[task.file.sha] = task_id
+
         processor = Processor(
             config=self.config,
             auth=self.auth,
             fs=self.fs,
             files=queue,
-            start_callbacks=start_callbacks,
+            scheduler=scheduler,
+            on_task=on_task,
+            claim=claim if use_db else None,
         )
-        if use_db:
-            self.db.add(*processor.files)
-        queue_size = len(processor.tasks)
-        main_task_id = main_progress.add_task("", total=queue_size)
+        main_task_id = main_progress.add_task("", total=len(queue))
         # TODO: rename ? installed/downloaded/completed/...
         files: list[File] = []
         errors: list[Err] = []
-        remaining_dict = {file.sha: file for file in processor.files}
+        keepalive = lease.keepalive() if use_db else nullcontext()
+        autoflush = buffer.autoflush() if use_db else nullcontext()
         try:
-            with self.ui.live(
-                file_progress,
-                main_progress,
-                disable=not show_progress,
-            ) as live:
-                async for result in self.iter_results(
-                    processor,
+            async with keepalive, autoflush:
+                with self.ui.live(
                     file_progress,
-                    file_task_shas,
-                    live,
-                ):
-                    match result:
-                        case Ok():
-                            main_progress.update(main_task_id, advance=1)
-                            result.data.file.status = FileStatus.Done
-                            files.append(result.data.file)
-                        case Err():
-                            queue_size -= 1
-                            main_progress.update(
-                                main_task_id, total=queue_size
-                            )
-                            result.data.file.status = FileStatus.Error
-                            errors.append(result)
-                    if use_db:
-                        self.db.add(result.data.file)
-                    remaining_dict.pop(result.data.file.sha, None)
+                    main_progress,
+                    disable=not show_progress,
+                ) as live:
+                    async for result in self.iter_results(
+                        processor,
+                        file_progress,
+                        file_task_shas,
+                        live,
+                    ):
+                        match result:
+                            case Ok():
+                                main_progress.update(main_task_id, advance=1)
+                                result.data.file.status = FileStatus.Done
+                                files.append(result.data.file)
+                            case Err():
+                                result.data.file.status = FileStatus.Error
+                                errors.append(result)
+                        lease.release(result.data.file)
+                        if use_db:
+                            buffer.add(result.data.file)
+                        started.pop(result.data.file.sha, None)
+                        queue_size = len(queue) - len(skipped) - len(errors)
+                        main_progress.update(main_task_id, total=queue_size)
         finally:
-            if remaining_dict:
-                logger.warning(f"Cancelling {len(remaining_dict)} downloads.")
+            if skipped:
+                logger.info(f"Skipped {len(skipped)} files leased by others.")
+            if started:
+                logger.warning(f"Cancelling {len(started)} downloads.")
                 cancelled: list[File] = []
-                for file in remaining_dict.values():
+                for file in started.values():
                     file.status = FileStatus.Cancelled
+                    lease.release(file)
                     cancelled.append(file)
                     errors.append(Err(file, DownloadCancelled()))
                 if use_db:
-                    self.db.add(*cancelled)
+                    buffer.add(*cancelled)
+                    buffer.flush()
         return files, errors
 
     def replace_queries(
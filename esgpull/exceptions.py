@@ -85,6 +85,12 @@ class DownloadSizeError(EsgpullException):
     """
 
 
+class DownloadRangeError(EsgpullException):
+    msg = """
+    Range request was not honored (status {}): {}
+    """
+
+
 class DownloadCancelled(EsgpullException):
     msg = """
     Download cancelled by user.
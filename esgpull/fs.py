@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
+from collections import deque
 from collections.abc import Iterator
+from concurrent.futures import Executor, Future
 from dataclasses import InitVar, dataclass, field
 from enum import Enum, auto
 from pathlib import Path
@@ -23,6 +26,8 @@ class FileCheck(Enum):
     BadChecksum = auto()  # {file.sha}.done exists AND has wrong size
     Done = auto()  # {file.sha}.done exists AND is ready to be moved
     Ok = auto()  # file is in drs with everything ok
+    Unsupported = auto()  # checksum_type cannot be computed
+    Unreadable = auto()  # exists but cannot be read (e.g. permissions)
 
     def as_err(self, file: File) -> Exception:
         err_cls = type(str(self), (Exception,), {})
@@ -31,22 +36,48 @@ class FileCheck(Enum):
 
 @dataclass
 class Digest:
+    """
+    Checksum of a file, computed chunk by chunk.
+
+    With an `executor`, `aupdate` hashes chunks in the executor's threads
+    (hashlib releases the GIL on large buffers), keeping chunk order.
+    At most `max_pending` chunks are queued before `aupdate` waits.
+    """
+
     file: InitVar[File]
+    executor: Executor | None = None
+    max_pending: int = 2
     alg: hashlib._Hash = field(init=False)
+    _pending: deque[Future[None]] = field(init=False, default_factory=deque)
 
     def __post_init__(self, file: File) -> None:
-        match file.checksum_type:
+        self.alg = self.algorithm(file.checksum_type)
+
+    @staticmethod
+    def algorithm(checksum_type: str) -> hashlib._Hash:
+        match checksum_type:
             case "SHA256":
-                self.alg = hashlib.sha256()
+                return hashlib.sha256()
             case _:
                 raise NotImplementedError
 
     @classmethod
-    def from_path(cls, file: File, path: Path) -> Digest:
+    def from_path(
+        cls,
+        file: File,
+        path: Path,
+        size: int | None = None,
+    ) -> Digest:
+        """
+        Hash the file at `path`, limited to its first `size` bytes if set.
+        """
         block_size = path.stat().st_blksize
         digest = cls(file)
         with path.open("rb") as f:
-            while True:
+            while size is None or size > 0:
+                if size is not None:
+                    block_size = min(block_size, size)
+                    size -= block_size
                 block = f.read(block_size)
                 if block == b"":
                     break
@@ -57,6 +88,30 @@ class Digest:
     def update(self, chunk: bytes) -> None:
         self.alg.update(chunk)
 
+    def _update_after(
+        self, previous: Future[None] | None, chunk: bytes
+    ) -> None:
+        if previous is not None:
+            previous.result()
+        self.alg.update(chunk)
+
+    async def aupdate(self, chunk: bytes) -> None:
+        if self.executor is None:
+            self.update(chunk)
+            return
+        while len(self._pending) >= self.max_pending:
+            await asyncio.wrap_future(self._pending.popleft())
+        previous = self._pending[-1] if self._pending else None
+        future = self.executor.submit(self._update_after, previous, chunk)
+        self._pending.append(future)
+
+    async def wait(self) -> None:
+        """
+        Wait for pending updates, required before `hexdigest`.
+        """
+        while self._pending:
+            await asyncio.wrap_future(self._pending.popleft())
+
     def hexdigest(self) -> str:
         return self.alg.hexdigest()
 
@@ -103,8 +158,8 @@ class Filesystem:
         for path in self.data.glob("**/*.nc"):
             yield path.relative_to(self.data)
 
-    def open(self, file: File) -> FileObject:
-        return FileObject(self[file])
+    def open(self, file: File, resume: bool = False) -> FileObject:
+        return FileObject(self[file], resume=resume)
 
     def isempty(self, path: Path) -> bool:
         if next(path.iterdir(), None) is None:
@@ -227,27 +282,73 @@ class FilePath:
     def done(self) -> Path:
         return self.tmp.with_suffix(".done")
 
+    @property
+    def checkpoint(self) -> Path:
+        return self.tmp.with_suffix(".ckpt")
+
     def __str__(self) -> str:
         return str(self.drs)
 
 
 @dataclass
 class FileObject:
+    """
+    Async writer for the `.part` file.
+
+    With `resume`, an existing `.part` file is reopened and truncated to its
+    last known contiguous size, `offset` is where the download resumes.
+    That size is the `.ckpt` checkpoint if one exists (written out of order),
+    or the size of the `.part` file otherwise (written sequentially).
+    """
+
     path: FilePath
+    resume: bool = False
     buffer: AsyncBufferedIOBase = field(init=False)
+    offset: int = field(init=False, default=0)
+    checkpointed: int = field(init=False, default=0)
+
+    def resume_offset(self) -> int:
+        size = self.path.tmp.stat().st_size
+        if self.path.checkpoint.is_file():
+            try:
+                size = min(size, int(self.path.checkpoint.read_text()))
+            except ValueError:
+                size = 0
+        return size
 
     async def __aenter__(self) -> FileObject:
-        self.buffer = await aiofiles.open(self.path.tmp, "wb")
+        if self.resume and self.path.tmp.is_file():
+            self.offset = self.resume_offset()
+            self.checkpointed = self.offset
+            self.buffer = await aiofiles.open(self.path.tmp, "r+b")
+            await self.buffer.truncate(self.offset)
+            await self.buffer.seek(self.offset)
+        else:
+            self.buffer = await aiofiles.open(self.path.tmp, "wb")
         return self
 
     async def __aexit__(self, exc_type, exc_value, exc_traceback) -> None:
         if not self.buffer.closed:
             await self.buffer.close()
 
-    async def write(self, chunk: bytes) -> None:
+    async def write(self, chunk: bytes, offset: int | None = None) -> None:
+        if offset is not None:
+            await self.buffer.seek(offset)
         await self.buffer.write(chunk)
 
+    async def checkpoint(self, contiguous: int) -> None:
+        """
+        Record that the first `contiguous` bytes are written to disk.
+        """
+        if contiguous == self.checkpointed:
+            return
+        await self.buffer.flush()
+        async with aiofiles.open(self.path.checkpoint, "w") as f:
+            await f.write(str(contiguous))
+        self.checkpointed = contiguous
+
     async def to_done(self) -> None:
         if not self.buffer.closed:
             await self.buffer.close()
         self.path.tmp.rename(self.path.done)
+        self.path.checkpoint.unlink(missing_ok=True)
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from bisect import bisect_left, insort
 from collections.abc import Iterator, Mapping, Sequence
 from dataclasses import dataclass
 
@@ -23,6 +24,7 @@ class Graph:
     queries: dict[str, Query]
     _db: Database | None
     _shas: set[str]
+    _sorted_shas: list[str]  # same as `_shas`, for prefix lookups
     _name_sha: dict[str, str]
     _rendered: set[str]
     _deleted_shas: set[str]
@@ -36,6 +38,7 @@ class Graph:
         self._db = db
         self.queries = {}
         self._shas = set()
+        self._sorted_shas = []
         self._name_sha = {}
         self._deleted_shas = set()
         if db is not None:
@@ -49,20 +52,24 @@ class Graph:
             return self._db
 
     @staticmethod
-    def matching_shas(name: str, shas: set[str]) -> list[str]:
-        shas_copy = list(shas)
-        for pos, c in enumerate(name):
-            idx = 0
-            while idx < len(shas_copy):
-                if shas_copy[idx][pos] != c:
-                    shas_copy.pop(idx)
-                else:
-                    idx += 1
-        return shas_copy
+    def matching_shas(name: str, sorted_shas: Sequence[str]) -> list[str]:
+        """
+        Shas starting with `name`, `sorted_shas` must be sorted.
+        Matching shas are contiguous, the first one is found by bisection.
+        """
+        result: list[str] = []
+        idx = bisect_left(sorted_shas, name)
+        while idx < len(sorted_shas) and sorted_shas[idx].startswith(name):
+            result.append(sorted_shas[idx])
+            idx += 1
+        return result
 
     @staticmethod
     def _expand_name(
-        name: str, shas: set[str], name_sha: dict[str, str]
+        name: str,
+        shas: set[str],
+        sorted_shas: Sequence[str],
+        name_sha: dict[str, str],
     ) -> str:
         if name in name_sha:
             sha = name_sha[name]
@@ -72,7 +79,7 @@ class Graph:
             short_name = name
             if short_name.startswith("#"):
                 short_name = short_name[1:]
-            matching_shas = Graph.matching_shas(short_name, shas)
+            matching_shas = Graph.matching_shas(short_name, sorted_shas)
             if len(matching_shas) > 1:
                 raise TooShortKeyError(name)
             elif len(matching_shas) == 1:
@@ -87,13 +94,17 @@ class Graph:
                 item.compute_sha()
                 sha = item.sha
             case str():
-                sha = self._expand_name(item, self._shas, self._name_sha)
+                sha = self._expand_name(
+                    item, self._shas, self._sorted_shas, self._name_sha
+                )
             case _:
                 raise TypeError(item)
         return sha in self._shas
 
     def get(self, name: str) -> Query:
-        sha = self._expand_name(name, self._shas, self._name_sha)
+        sha = self._expand_name(
+            name, self._shas, self._sorted_shas, self._name_sha
+        )
         if sha in self.queries:
             ...
         elif sha in self._shas:
@@ -107,7 +118,9 @@ class Graph:
         return self.queries[sha]
 
     def get_mutable(self, name: str) -> Query:
-        sha = self._expand_name(name, self._shas, self._name_sha)
+        sha = self._expand_name(
+            name, self._shas, self._sorted_shas, self._name_sha
+        )
         if sha in self._shas:
             query_db = self.db.get(
                 Query,
@@ -224,6 +237,7 @@ class Graph:
     def _load_db_shas(self, full: bool = False) -> None:
         name_sha: dict[str, str] = {}
         self._shas = set(self.db.scalars(sql.query.shas()))
+        self._sorted_shas = sorted(self._shas)
         for name, sha in self.db.rows(sql.query.name_sha()):
             name_sha[name] = sha
         self._name_sha = name_sha
@@ -272,6 +286,7 @@ class Graph:
         - replace query.require with full sha
         """
         new_shas: set[str] = set(self._shas)
+        added_shas: list[str] = []
         new_deleted_shas: set[str] = set(self._deleted_shas)
         new_queries: dict[str, Query] = dict(self.queries.items())
         name_shas: dict[str, list[str]] = {
@@ -293,6 +308,8 @@ class Graph:
                     replaced[query.sha] = old.clone(compute_sha=False)  # True?
                 else:
                     raise QueryDuplicate(pretty_repr(query))
+            else:
+                added_shas.append(query.sha)
             new_shas.add(query.sha)
             if query.sha in new_deleted_shas:
                 new_deleted_shas.remove(query.sha)
@@ -310,20 +327,36 @@ class Graph:
             for name, shas in name_shas.items()
             if name not in skip_tags
         }
+        self._index_shas(*added_shas)
         if not force:
-            for sha, query in new_queries.items():
-                if query.require is not None:
-                    sha = self._expand_name(
-                        query.require, new_shas, new_name_sha
-                    )
-                    if sha != query.require:
-                        raise ValueError("case change require")
+            try:
+                self._validate_requires(new_queries, new_shas, new_name_sha)
+            except Exception:
+                self._unindex_shas(*added_shas)
+                raise
         self.queries = new_queries
         self._shas = new_shas
         self._deleted_shas = new_deleted_shas
         self._name_sha = new_name_sha
         return replaced
 
+    def _validate_requires(
+        self,
+        queries: Mapping[str, Query],
+        shas: set[str],
+        name_sha: dict[str, str],
+    ) -> None:
+        for query in queries.values():
+            if query.require is not None:
+                sha = self._expand_name(
+                    query.require,
+                    shas,
+                    self._sorted_shas,
+                    name_sha,
+                )
+                if sha != query.require:
+                    raise ValueError("case change require")
+
     def get_unknown_facets(self) -> set[Facet]:
         """
         Why was this implemented?
@@ -446,8 +479,23 @@ class Graph:
         del self._rendered
         yield tree
 
+    def _index_shas(self, *shas: str) -> None:
+        if len(shas) < 64:
+            for sha in shas:
+                insort(self._sorted_shas, sha)
+        else:
+            # sorting merges the two sorted runs in linear time
+            self._sorted_shas.extend(sorted(shas))
+            self._sorted_shas.sort()
+
+    def _unindex_shas(self, *shas: str) -> None:
+        for sha in shas:
+            idx = bisect_left(self._sorted_shas, sha)
+            del self._sorted_shas[idx]
+
     def delete(self, query: Query) -> None:
         self._shas.remove(query.sha)
+        self._unindex_shas(query.sha)
         self.queries.pop(query.sha, None)
         self._deleted_shas.add(query.sha)
 
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from esgpull.config import Config
+from esgpull.database import Database
+from esgpull.models import IndexNode, sql
+
+
+@dataclass
+class Health:
+    """
+    Registry of index nodes' health, persisted in the `index_node` table.
+
+    Each request records its latency (or its failure) on the node it was
+    sent to. A node is unhealthy while its error rate is over
+    `max_error_rate`, until `cooldown` seconds after its last error, when
+    it can be tried again. Healthy nodes are ranked by expected latency,
+    `latency / (1 - error_rate)`.
+    """
+
+    db: Database | None = None
+    cooldown: float = 300.0
+    smoothing: float = 0.2  # weight of the last request in averages
+    max_error_rate: float = 0.5
+    nodes: dict[str, IndexNode] = field(default_factory=dict)
+    dirty: set[str] = field(default_factory=set)
+
+    @staticmethod
+    def from_db(db: Database, config: Config) -> Health:
+        health = Health(db, cooldown=config.api.failover.cooldown)
+        for node in db.scalars(sql.index_node.all()):
+            # detached copies, the registry is saved with `upsert`
+            health.nodes[node.host] = IndexNode(**node.asdict())
+            health.nodes[node.host].compute_sha()
+        return health
+
+    def __getitem__(self, host: str) -> IndexNode:
+        if host not in self.nodes:
+            node = IndexNode(host=host)
+            node.compute_sha()
+            self.nodes[host] = node
+            self.dirty.add(host)
+        return self.nodes[host]
+
+    def add(self, *hosts: str) -> None:
+        for host in hosts:
+            self[host]
+
+    def record(
+        self,
+        host: str,
+        latency: float | None = None,
+        error: bool = False,
+    ) -> None:
+        node = self[host]
+        now = datetime.utcnow()
+        node.requests += 1
+        node.error_rate += self.smoothing * (float(error) - node.error_rate)
+        if error:
+            node.errors += 1
+            node.last_error = now
+        else:
+            node.last_seen = now
+        if latency is not None:
+            if node.latency is None:
+                node.latency = latency
+            else:
+                node.latency += self.smoothing * (latency - node.latency)
+        self.dirty.add(host)
+
+    def healthy(self, host: str) -> bool:
+        node = self[host]
+        if node.error_rate <= self.max_error_rate or node.last_error is None:
+            return True
+        cooldown = timedelta(seconds=self.cooldown)
+        return datetime.utcnow() - node.last_error > cooldown
+
+    def score(self, host: str) -> float:
+        node = self[host]
+        if node.latency is None or node.error_rate >= 1:
+            return float("inf")
+        else:
+            return node.latency / (1 - node.error_rate)
+
+    def ranked(self, preferred: str | None = None) -> list[str]:
+        """
+        Known hosts from best to worst, `preferred` comes first among
+        hosts with the same score (e.g. never requested).
+        """
+        if preferred is not None:
+            self.add(preferred)
+        hosts = sorted(self.nodes)
+        if preferred is not None:
+            hosts.remove(preferred)
+            hosts.insert(0, preferred)
+        return sorted(
+            hosts,
+            key=lambda host: (not self.healthy(host), self.score(host)),
+        )
+
+    def save(self) -> None:
+        if self.db is None or not self.dirty:
+            return
+        nodes = [self.nodes[host] for host in sorted(self.dirty)]
+        self.db.upsert(*nodes)
+        self.dirty.clear()
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from esgpull.config import Config
+from esgpull.database import Database
+from esgpull.models import File, FileStatus, sql
+
+
+def default_worker() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def dead_worker(worker: str | None) -> bool:
+    """
+    Whether `worker` is a process of this host that no longer exists.
+    Workers from other hosts are never known to be dead.
+    """
+    if worker is None:
+        return False
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, OverflowError):
+        return False
+    return False
+
+
+@dataclass
+class Lease:
+    """
+    Download leases on the `file` table, for processes sharing a database.
+
+    A worker claims files with a single UPDATE, which sets them `Starting`
+    with its id and a lease expiry, so that two workers never claim the
+    same file. Leases are written in their own transactions, pending
+    changes of the session (e.g. a `WriteBuffer`) are left pending. Leases are renewed every `heartbeat` seconds while files
+    are downloading, and a file whose lease expired (e.g. its worker was
+    killed, or its host went down) can be claimed again by any worker.
+    """
+
+    db: Database
+    worker: str = field(default_factory=default_worker)
+    duration: float = 300.0
+    heartbeat: float = 60.0
+
+    @staticmethod
+    def from_config(db: Database, config: Config) -> Lease:
+        return Lease(
+            db,
+            duration=config.download.lease.duration,
+            heartbeat=config.download.lease.heartbeat,
+        )
+
+    def _claim(
+        self,
+        shas: list[str] | None = None,
+        limit: int | None = None,
+    ) -> tuple[list[str], datetime]:
+        now = datetime.utcnow()
+        expiry = now + timedelta(seconds=self.duration)
+        stmt = sql.file.claim(self.worker, now, expiry, shas, limit)
+        return self.db.update_returning(stmt), expiry
+
+    def claim(self, *files: File) -> list[File]:
+        """
+        Claim `files`, except those leased by another worker.
+        Claimed files are updated in place, without reloading them.
+        """
+        claimed: list[File] = []
+        for start in range(0, len(files), self.db.batch_size):
+            batch = files[start : start + self.db.batch_size]
+            shas, expiry = self._claim([file.sha for file in batch])
+            claimed_shas = set(shas)
+            for file in batch:
+                if file.sha in claimed_shas:
+                    set_committed_value(file, "status", FileStatus.Starting)
+                    set_committed_value(file, "worker", self.worker)
+                    set_committed_value(file, "lease_expiry", expiry)
+                    claimed.append(file)
+        return claimed
+
+    def claim_shas(self, *shas: str) -> list[File]:
+        """
+        Same as `claim` from the sha of files, claimed files are loaded.
+        """
+        return self._load(self._claim(list(shas))[0])
+
+    def claim_next(self, limit: int = 1) -> list[File]:
+        """
+        Claim up to `limit` files from the download queue.
+        """
+        return self._load(self._claim(limit=limit)[0])
+
+    def _load(self, shas: list[str]) -> list[File]:
+        if not shas:
+            return []
+        stmt = sql.file.with_shas(shas).execution_options(
+            populate_existing=True
+        )
+        with self.db.session.no_autoflush:
+            return list(self.db.scalars(stmt))
+
+    def renew(self) -> int:
+        expiry = datetime.utcnow() + timedelta(seconds=self.duration)
+        return self.db.update(sql.file.renew(self.worker, expiry))
+
+    def release(self, *files: File) -> None:
+        """
+        Clear leases of `files`, to be committed along with their status.
+        """
+        for file in files:
+            file.worker = None
+            file.lease_expiry = None
+
+    def orphaned(self) -> list[File]:
+        """
+        Started files without a live lease, or leased by a process of this
+        host that is gone (e.g. killed before its lease expired).
+        """
+        now = datetime.utcnow()
+        stmt = sql.file.with_status(FileStatus.Starting, FileStatus.Started)
+        return [
+            file
+            for file in self.db.scalars(stmt)
+            if file.lease_expiry is None
+            or file.lease_expiry < now
+            or (file.worker != self.worker and dead_worker(file.worker))
+        ]
+
+    @asynccontextmanager
+    async def keepalive(self) -> AsyncIterator[None]:
+        """
+        Renew leases of this worker every `heartbeat` seconds.
+        """
+
+        async def beat() -> None:
+            while True:
+                await asyncio.sleep(self.heartbeat)
+                self.renew()
+
+        task = asyncio.create_task(beat())
+        try:
+            yield
+        finally:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
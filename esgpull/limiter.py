@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from esgpull.config import Config
+from esgpull.tui import logger
+
+
+@dataclass
+class NodeSlots:
+    """
+    Concurrency state of a single data node.
+    """
+
+    node: str
+    limit: float
+    max_limit: int
+    adaptive: bool = True
+    interval: float = 2.0
+    active: int = 0
+    received: int = 0
+    speed: float = 0.0
+    sampled_at: float = field(default_factory=perf_counter)
+    waiters: deque[asyncio.Future] = field(default_factory=deque)
+
+    @property
+    def full(self) -> bool:
+        return self.active >= int(self.limit)
+
+    def wake(self) -> None:
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def record(self, nbytes: int) -> None:
+        """
+        Additive increase: one more stream every `interval` seconds,
+        as long as the node's throughput keeps rising.
+        """
+        self.received += nbytes
+        elapsed = perf_counter() - self.sampled_at
+        if not self.adaptive or elapsed < self.interval:
+            return
+        speed = self.received / elapsed
+        if speed > self.speed and self.full and self.limit < self.max_limit:
+            self.limit = min(self.limit + 1, self.max_limit)
+            logger.debug(f"{self.node}: concurrency up to {int(self.limit)}")
+            self.wake()
+        self.speed = speed
+        self.received = 0
+        self.sampled_at = perf_counter()
+
+    def failure(self) -> None:
+        """
+        Multiplicative decrease: halve the number of streams on error.
+        """
+        if not self.adaptive:
+            return
+        self.limit = max(1.0, self.limit / 2)
+        self.speed = 0.0
+        self.received = 0
+        self.sampled_at = perf_counter()
+        logger.debug(f"{self.node}: concurrency down to {int(self.limit)}")
+
+
+class Limiter:
+    """
+    Limits concurrent downloads globally and per data node.
+
+    Each data node starts with a single stream, its limit is adapted with
+    AIMD (additive increase, multiplicative decrease): the limit grows
+    while the node's throughput rises and is halved on errors/timeouts.
+    A node slot is acquired before the global one, so that a saturated
+    node never holds global slots that other nodes could use.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_concurrent_per_node: int,
+        adaptive: bool = True,
+    ) -> None:
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent_per_node = max_concurrent_per_node
+        self.adaptive = adaptive
+        self.nodes: dict[str, NodeSlots] = {}
+
+    @staticmethod
+    def from_config(config: Config) -> Limiter:
+        return Limiter(
+            max_concurrent=config.download.max_concurrent,
+            max_concurrent_per_node=config.download.max_concurrent_per_node,
+            adaptive=config.download.adaptive_concurrency,
+        )
+
+    def __getitem__(self, node: str) -> NodeSlots:
+        if node not in self.nodes:
+            if self.adaptive:
+                limit = 1.0
+            else:
+                limit = float(self.max_concurrent_per_node)
+            self.nodes[node] = NodeSlots(
+                node=node,
+                limit=limit,
+                max_limit=self.max_concurrent_per_node,
+                adaptive=self.adaptive,
+            )
+        return self.nodes[node]
+
+    @asynccontextmanager
+    async def slot(self, node: str) -> AsyncIterator[NodeSlots]:
+        slots = self[node]
+        while slots.full:
+            waiter = asyncio.get_running_loop().create_future()
+            slots.waiters.append(waiter)
+            await waiter
+        slots.active += 1
+        try:
+            async with self.semaphore:
+                yield slots
+        except Exception:
+            slots.failure()
+            raise
+        finally:
+            slots.active -= 1
+            slots.wake()
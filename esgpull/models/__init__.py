@@ -4,6 +4,7 @@ from esgpull.models.base import Base
 from esgpull.models.dataset import Dataset
 from esgpull.models.facet import Facet
 from esgpull.models.file import FastFile, FileStatus
+from esgpull.models.index_node import IndexNode
 from esgpull.models.options import Option, Options
 from esgpull.models.query import File, LegacyQuery, Query, QueryDict
 from esgpull.models.selection import Selection
@@ -19,6 +20,7 @@ __all__ = [
     "FastFile",
     "File",
     "FileStatus",
+    "IndexNode",
     "LegacyQuery",
     "Option",
     "Options",
@@ -48,6 +48,7 @@ class FileDict(TypedDict):
 class FastFile:
     sha: str
     file_id: str
+    filename: str
     checksum: str
 
     def _as_bytes(self) -> bytes:
@@ -60,6 +61,7 @@ class FastFile:
         dataset_id = find_str(source["dataset_id"]).partition("|")[0]
         filename = find_str(source["title"])
         result.file_id = ".".join([dataset_id, filename])
+        result.filename = filename
         result.checksum = find_str(source["checksum"])
         Base.compute_sha(result)  # type: ignore
         return result
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Any
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Mapped, mapped_column
+
+from esgpull.models.base import Base
+
+
+class IndexNode(Base):
+    """
+    Health statistics of an index node, updated after each request.
+    `latency` (seconds to the response headers) and `error_rate` are
+    exponentially weighted moving averages.
+    """
+
+    __tablename__ = "index_node"
+
+    host: Mapped[str] = mapped_column(sa.String(255))
+    requests: Mapped[int] = mapped_column(default=0)
+    errors: Mapped[int] = mapped_column(default=0)
+    latency: Mapped[float | None] = mapped_column(default=None)
+    error_rate: Mapped[float] = mapped_column(default=0.0)
+    last_seen: Mapped[datetime | None] = mapped_column(default=None)
+    last_error: Mapped[datetime | None] = mapped_column(default=None)
+
+    def _as_bytes(self) -> bytes:
+        return self.host.encode()
+
+    def __hash__(self) -> int:
+        return hash(self._as_bytes())
+
+    def asdict(self) -> Mapping[str, Any]:
+        return {name: getattr(self, name) for name in self._names}
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from collections.abc import Iterator, MutableMapping, Sequence
+from datetime import datetime
 from typing import Any, Literal
 
 import sqlalchemy as sa
@@ -31,6 +32,7 @@ query_file_proxy = sa.Table(
     Base.metadata,
     sa.Column("query_sha", Sha, sa.ForeignKey("query.sha"), primary_key=True),
     sa.Column("file_sha", Sha, sa.ForeignKey("file.sha"), primary_key=True),
+    sa.Index("ix_query_file_file_sha_query_sha", "file_sha", "query_sha"),
 )
 query_tag_proxy = sa.Table(
     "query_tag",
@@ -44,18 +46,25 @@ class File(Base):
     __tablename__ = "file"
 
     file_id: Mapped[str] = mapped_column(sa.String(255), unique=True)
-    dataset_id: Mapped[str] = mapped_column(sa.String(255))
-    master_id: Mapped[str] = mapped_column(sa.String(255))
+    dataset_id: Mapped[str] = mapped_column(sa.String(255), index=True)
+    master_id: Mapped[str] = mapped_column(sa.String(255), index=True)
     url: Mapped[str] = mapped_column(sa.String(255))
     version: Mapped[str] = mapped_column(sa.String(16))
     filename: Mapped[str] = mapped_column(sa.String(255))
     local_path: Mapped[str] = mapped_column(sa.String(255))
-    data_node: Mapped[str] = mapped_column(sa.String(40))
+    data_node: Mapped[str] = mapped_column(sa.String(40), index=True)
     checksum: Mapped[str] = mapped_column(sa.String(64))
     checksum_type: Mapped[str] = mapped_column(sa.String(16))
     size: Mapped[int] = mapped_column(sa.BigInteger)
     status: Mapped[FileStatus] = mapped_column(
-        sa.Enum(FileStatus), default=FileStatus.New
+        sa.Enum(FileStatus), default=FileStatus.New, index=True
+    )
+    # download claimed by `worker` until `lease_expiry`, see `esgpull.lease`
+    worker: Mapped[str | None] = mapped_column(
+        sa.String(255), default=None, repr=False
+    )
+    lease_expiry: Mapped[datetime | None] = mapped_column(
+        default=None, repr=False
     )
     queries: Mapped[list[Query]] = relationship(
         secondary=query_file_proxy,
@@ -181,6 +190,11 @@ class Query(Base):
         back_populates="queries",
         repr=False,
     )
+    updated_at: Mapped[datetime | None] = mapped_column(
+        default=None,
+        init=False,
+        repr=False,
+    )
 
     def __init__(
         self,
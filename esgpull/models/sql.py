@@ -1,10 +1,14 @@
 import functools
+from datetime import datetime
 
 import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql.dml import ReturningUpdate
 
 from esgpull.models import Table
 from esgpull.models.facet import Facet
 from esgpull.models.file import FileStatus
+from esgpull.models.index_node import IndexNode
 from esgpull.models.query import File, Query, query_file_proxy, query_tag_proxy
 from esgpull.models.selection import Selection, selection_facet_proxy
 from esgpull.models.synda_file import SyndaFile
@@ -85,7 +89,7 @@ class file:
 
     @staticmethod
     @functools.cache
-    def linked() -> sa.Select[tuple[File]]:
+    def linked() -> sa.Select[tuple[str]]:
         return sa.select(query_file_proxy.c.file_sha).distinct()
 
     __dups_cte: sa.CTE = (
@@ -109,10 +113,104 @@ class file:
             query_sha=query_sha
         )
 
+    @staticmethod
+    def queued_from_queries(
+        query_shas: list[str],
+    ) -> sa.Select[tuple[str, int, str]]:
+        """
+        Queued files of queries, only with the fields used for scheduling.
+        """
+        return (
+            sa.select(File.sha, File.size, File.data_node)
+            .join(query_file_proxy, query_file_proxy.c.file_sha == File.sha)
+            .where(
+                query_file_proxy.c.query_sha.in_(query_shas),
+                File.status == FileStatus.Queued,
+            )
+            .distinct()
+        )
+
+    @staticmethod
+    def known_shas(shas: list[str]) -> sa.Select[tuple[str]]:
+        return sa.select(File.sha).where(File.sha.in_(shas))
+
+    @staticmethod
+    def with_shas(shas: list[str]) -> sa.Select[tuple[File]]:
+        return sa.select(File).where(File.sha.in_(shas))
+
+    @staticmethod
+    def known_file_ids(file_ids: list[str]) -> sa.Select[tuple[str]]:
+        return sa.select(File.file_id).where(File.file_id.in_(file_ids))
+
     @staticmethod
     def with_status(*status: FileStatus) -> sa.Select[tuple[File]]:
         return sa.select(File).where(File.status.in_(status))
 
+    @staticmethod
+    def claimable(now: datetime) -> sa.ColumnElement[bool]:
+        """
+        Queued files, or files whose download lease expired.
+        """
+        return sa.or_(
+            File.status == FileStatus.Queued,
+            sa.and_(
+                File.status.in_([FileStatus.Starting, FileStatus.Started]),
+                File.lease_expiry < now,
+            ),
+        )
+
+    @staticmethod
+    def claim(
+        worker: str,
+        now: datetime,
+        expiry: datetime,
+        shas: list[str] | None = None,
+        limit: int | None = None,
+    ) -> ReturningUpdate[tuple[str]]:
+        """
+        Atomically set claimable files as `Starting` for `worker`,
+        returns the sha of claimed files.
+        """
+        subquery = sa.select(File.sha).where(file.claimable(now))
+        if shas is not None:
+            subquery = subquery.where(File.sha.in_(shas))
+        if limit is not None:
+            subquery = subquery.limit(limit)
+        return (
+            sa.update(File)
+            .where(File.sha.in_(subquery.scalar_subquery()))
+            .values(
+                status=FileStatus.Starting,
+                worker=worker,
+                lease_expiry=expiry,
+            )
+            .returning(File.sha)
+        )
+
+    @staticmethod
+    def renew(worker: str, expiry: datetime) -> sa.Update:
+        return (
+            sa.update(File)
+            .where(
+                File.worker == worker,
+                File.status.in_([FileStatus.Starting, FileStatus.Started]),
+            )
+            .values(lease_expiry=expiry)
+        )
+
+    @staticmethod
+    def checksums_with_status(
+        *status: FileStatus,
+    ) -> sa.Select[tuple[str, str, str, int, str, str]]:
+        return sa.select(
+            File.sha,
+            File.local_path,
+            File.filename,
+            File.size,
+            File.checksum,
+            File.checksum_type,
+        ).where(File.status.in_(status))
+
     @staticmethod
     def with_file_id(file_id: str) -> sa.Select[tuple[str]]:
         return sa.select(File.sha).where(File.file_id == file_id).limit(1)
@@ -148,6 +246,13 @@ class file:
         return stmt
 
 
+class index_node:
+    @staticmethod
+    @functools.cache
+    def all() -> sa.Select[tuple[IndexNode]]:
+        return sa.select(IndexNode)
+
+
 class query:
     @staticmethod
     @functools.cache
@@ -263,6 +368,11 @@ class query_file:
             query_sha=query.sha, file_sha=file.sha
         )
 
+    @staticmethod
+    @functools.cache
+    def insert_ignore() -> sa.Insert:
+        return sqlite.insert(query_file_proxy).on_conflict_do_nothing()
+
     @staticmethod
     def unlink(query: Query, file: File) -> sa.Delete:
         return (
@@ -270,3 +380,19 @@ class query_file:
             .where(query_file_proxy.c.query_sha == query.sha)
             .where(query_file_proxy.c.file_sha == file.sha)
         )
+
+    @staticmethod
+    def linked_shas(query: Query, shas: list[str]) -> sa.Select[tuple[str]]:
+        return (
+            sa.select(query_file_proxy.c.file_sha)
+            .where(query_file_proxy.c.query_sha == query.sha)
+            .where(query_file_proxy.c.file_sha.in_(shas))
+        )
+
+    @staticmethod
+    def unlink_many(query: Query, shas: list[str]) -> sa.Delete:
+        return (
+            sa.delete(query_file_proxy)
+            .where(query_file_proxy.c.query_sha == query.sha)
+            .where(query_file_proxy.c.file_sha.in_(shas))
+        )
@@ -1,19 +1,29 @@
 import asyncio
 import ssl
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterator, Callable, Iterable, Mapping
+from concurrent.futures import Executor, ThreadPoolExecutor
 from functools import partial
+from pathlib import Path
 from typing import TypeAlias
 
-from aiostream.stream import merge
 from httpx import AsyncClient, HTTPError
 
 from esgpull.auth import Auth
 from esgpull.config import Config
-from esgpull.download import DownloadCtx, Simple
-from esgpull.exceptions import DownloadSizeError
-from esgpull.fs import Digest, Filesystem
+from esgpull.download import (
+    BaseDownloader,
+    Distributed,
+    DownloadCtx,
+    Ranged,
+    Simple,
+)
+from esgpull.exceptions import DownloadRangeError, DownloadSizeError
+from esgpull.fs import Digest, FileObject, Filesystem
+from esgpull.limiter import Limiter
 from esgpull.models import File
 from esgpull.result import Err, Ok, Result
+from esgpull.retry import RetryPolicy
+from esgpull.scheduler import Schedulable, Scheduler
 from esgpull.tui import logger
 
 # Callback: TypeAlias = Callable[[], None] | partial[None]
@@ -46,19 +56,35 @@ class Task:
         # url: str | None = None,
         file: File,
         start_callbacks: list[Callback] | None = None,
+        executor: Executor | None = None,
     ) -> None:
         self.config = config
         self.fs = fs
+        self.executor = executor
         self.ctx = DownloadCtx(file)
+        self.retry = RetryPolicy.from_config(config.download.retry)
         if not self.config.download.disable_checksum:
-            self.ctx.digest = Digest(file)
+            self.ctx.digest = Digest(file, executor=executor)
         # if file is None and url is not None:
         #     self.file = self.fetch_file(url)
         # elif file is not None:
         #     self.file = file
         # else:
         #     raise ValueError("no arguments")
-        self.downloader = Simple()
+        self.downloader: BaseDownloader
+        if self.config.download.distributed:
+            self.downloader = Distributed(
+                config=self.config,
+                range_size=self.config.download.range_size,
+                max_connections=self.config.download.max_connections_per_file,
+            )
+        elif self.config.download.max_connections_per_file > 1:
+            self.downloader = Ranged(
+                range_size=self.config.download.range_size,
+                max_connections=self.config.download.max_connections_per_file,
+            )
+        else:
+            self.downloader = Simple()
         if start_callbacks is None:
             self.start_callbacks = []
         else:
@@ -68,6 +94,38 @@ class Task:
     def file(self) -> File:
         return self.ctx.file
 
+    async def resume(self, offset: int, path: Path) -> None:
+        """
+        Resume from the first `offset` bytes already written at `path`.
+        The digest state cannot be saved, it is rebuilt from those bytes,
+        unless it already covers exactly them (retry of a sequential stream).
+        """
+        ctx = self.ctx
+        if ctx.digest is not None and ctx.completed != offset:
+            loop = asyncio.get_running_loop()
+            ctx.digest = await loop.run_in_executor(
+                self.executor, Digest.from_path, ctx.file, path, offset
+            )
+            ctx.digest.executor = self.executor
+        ctx.completed = ctx.contiguous = offset
+        logger.info(f"Resuming {ctx.file.file_id} from byte {offset}")
+
+    async def finish(self, file_obj: FileObject) -> None:
+        """
+        Rename the complete `.part` file to `.done`. A file written out of
+        order (ranged downloads) has no digest yet, it is hashed once in
+        the executor, off the event loop.
+        """
+        ctx = self.ctx
+        if ctx.digest is not None:
+            await ctx.digest.wait()
+        await file_obj.to_done()
+        if ctx.digest is None and not self.config.download.disable_checksum:
+            loop = asyncio.get_running_loop()
+            ctx.digest = await loop.run_in_executor(
+                self.executor, Digest.from_path, ctx.file, file_obj.path.done
+            )
+
     # def fetch_file(self, url: str) -> File:
     #     ctx = Context()
     #     # [?]TODO: define map data_node->index_node to find url-file
@@ -82,14 +140,52 @@ class Task:
 
     async def stream(
         self,
-        semaphore: asyncio.Semaphore,
+        limiter: Limiter,
+        client: AsyncClient,
+    ) -> AsyncIterator[Result]:
+        """
+        Download the file, transient errors are retried with backoff.
+        Each retry resumes from the bytes already written to disk.
+        """
+        attempt = 0
+        while True:
+            delay: float | None = None
+            async for result in self.attempt(limiter, client):
+                if isinstance(result, Err):
+                    delay = self.retry.delay(attempt, result.err)
+                    if delay is not None:
+                        err = result.err
+                        continue
+                yield result
+            if delay is None:
+                return
+            attempt += 1
+            self.ctx.retries = attempt
+            logger.warning(
+                f"Retrying {self.file.file_id} in {delay:.1f}s"
+                f" ({attempt}/{self.retry.max_attempts - 1}): {err!r}"
+            )
+            await asyncio.sleep(delay)
+
+    async def attempt(
+        self,
+        limiter: Limiter,
         client: AsyncClient,
     ) -> AsyncIterator[Result]:
         ctx = self.ctx
         try:
-            async with semaphore, self.fs.open(ctx.file) as file_obj:
+            async with (
+                limiter.slot(ctx.file.data_node) as slots,
+                self.fs.open(ctx.file, resume=True) as file_obj,
+            ):
                 for callback in self.start_callbacks:
                     callback()
+                if file_obj.offset > 0 or ctx.completed > 0:
+                    await self.resume(file_obj.offset, file_obj.path.tmp)
+                if ctx.finished:
+                    await self.finish(file_obj)
+                    yield Ok(ctx)
+                    return
                 stream = self.downloader.stream(
                     client,
                     ctx,
@@ -97,19 +193,23 @@ class Task:
                 )
                 async for ctx in stream:
                     if ctx.chunk is not None:
-                        await file_obj.write(ctx.chunk)
+                        slots.record(len(ctx.chunk))
+                        await file_obj.write(ctx.chunk, ctx.offset)
+                        await file_obj.checkpoint(ctx.contiguous)
                         ctx.chunk = None
+                        ctx.offset = None
                     if ctx.error:
                         err = DownloadSizeError(ctx.completed, ctx.file.size)
                         yield Err(ctx, err)
                         await stream.aclose()
                         break
                     elif ctx.finished:
-                        await file_obj.to_done()
+                        await self.finish(file_obj)
                     yield Ok(ctx)
         except (
             HTTPError,
             DownloadSizeError,
+            DownloadRangeError,
             GeneratorExit,
             ssl.SSLError,
             FileNotFoundError,
@@ -124,14 +224,31 @@ class Processor:
         config: Config,
         auth: Auth,
         fs: Filesystem,
-        files: list[File],
-        start_callbacks: dict[str, list[Callback]],
+        files: Iterable[Schedulable] = (),
+        start_callbacks: Mapping[str, list[Callback]] | None = None,
+        scheduler: Scheduler | None = None,
+        on_task: Callable[[Task], None] | None = None,
+        claim: Callable[[Schedulable], File | None] | None = None,
     ) -> None:
+        """
+        Tasks are only created when their file is picked by the scheduler,
+        `on_task` is called with each new task.
+        With `claim`, a picked file is downloaded as the `File` returned by
+        `claim(file)`, or skipped on None (e.g. when another process already
+        downloads it), so that `files` can hold only the fields used for
+        scheduling. Without `claim`, `files` must be `File` instances.
+        """
         self.config = config
         self.auth = auth
         self.fs = fs
-        self.files = list(filter(self.should_download, files))
-        self.tasks = []
+        if scheduler is None:
+            self.scheduler = Scheduler.from_config(config)
+        else:
+            self.scheduler = scheduler
+        self.files = files
+        self.start_callbacks = start_callbacks or {}
+        self.on_task = on_task
+        self.claim = claim
         msg: str | None = None
         if not default_ssl_context_loaded:
             msg = load_default_ssl_context()
@@ -142,14 +259,10 @@ class Processor:
             if msg is not None:
                 logger.info(msg)
             self.ssl_context = default_ssl_context
-        for file in files:
-            task = Task(
-                config=config,
-                fs=fs,
-                file=file,
-                start_callbacks=start_callbacks[file.sha],
-            )
-            self.tasks.append(task)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.config.download.max_concurrent,
+            thread_name_prefix="esgpull-digest",
+        )
 
     def should_download(self, file: File) -> bool:
         if self.fs[file].drs.is_file():
@@ -157,15 +270,142 @@ class Processor:
         else:
             return True
 
-    async def process(self) -> AsyncIterator[Result]:
-        semaphore = asyncio.Semaphore(self.config.download.max_concurrent)
-        async with AsyncClient(
+    def task(self, file: File) -> Task:
+        task = Task(
+            config=self.config,
+            fs=self.fs,
+            file=file,
+            start_callbacks=list(self.start_callbacks.get(file.sha, [])),
+            executor=self.executor,
+        )
+        if self.on_task is not None:
+            self.on_task(task)
+        return task
+
+    def client(self) -> AsyncClient:
+        return AsyncClient(
             follow_redirects=True,
             cert=self.auth.cert,
             verify=self.ssl_context,
             timeout=self.config.download.http_timeout,
-        ) as client:
-            streams = [task.stream(semaphore, client) for task in self.tasks]
-            async with merge(*streams).stream() as stream:
-                async for result in stream:
+        )
+
+    async def process(self) -> AsyncIterator[Result]:
+        """
+        Download all files, the next file is picked by the scheduler
+        each time one of `download.max_concurrent` downloads is over.
+        At most `download.max_concurrent` tasks exist at once.
+        """
+        limiter = Limiter.from_config(self.config)
+        self.scheduler.push(*self.files)
+
+        async def pick() -> AsyncIterator[Task]:
+            while (item := self.scheduler.pop(limiter)) is not None:
+                if self.claim is not None:
+                    file = self.claim(item)
+                elif isinstance(item, File):
+                    file = item
+                else:
+                    raise TypeError(item)
+                if file is not None:
+                    yield self.task(file)
+                else:
+                    self.scheduler.release(item)
+
+        max_inflight = self.config.download.max_concurrent
+        async for result in self.run(pick(), limiter, max_inflight):
+            yield result
+
+    async def feed(
+        self,
+        files: AsyncIterator[File],
+        max_inflight: int,
+        on_start: Callable[[File], None] | None = None,
+    ) -> AsyncIterator[Result]:
+        """
+        Download files from `files` as they come, instead of a fixed list.
+
+        A file is only pulled from `files` when less than `max_inflight`
+        files are downloading or waiting for a download slot, so that
+        `files` can be an endless source (e.g. polling the database).
+        Results are yielded until `files` is exhausted and every download
+        is over.
+        """
+
+        async def tasks() -> AsyncIterator[Task]:
+            async for file in files:
+                task = self.task(file)
+                if on_start is not None:
+                    task.start_callbacks.append(partial(on_start, file))
+                yield task
+
+        limiter = Limiter.from_config(self.config)
+        async for result in self.run(tasks(), limiter, max_inflight):
+            yield result
+
+    async def run(
+        self,
+        tasks: AsyncIterator[Task],
+        limiter: Limiter,
+        max_inflight: int,
+    ) -> AsyncIterator[Result]:
+        """
+        Run at most `max_inflight` tasks at once, the next task is only
+        pulled from `tasks` when a running task is over.
+
+        An unexpected error in a task fails its file with an `Err` result,
+        an error raised by `tasks` itself is raised once running tasks are
+        cancelled.
+        """
+        results: asyncio.Queue[Result | None] = asyncio.Queue()
+        inflight = asyncio.Semaphore(max_inflight)
+        running: set[asyncio.Task] = set()
+
+        async def run_one(task: Task, client: AsyncClient) -> None:
+            try:
+                if self.should_download(task.file):
+                    async for result in task.stream(limiter, client):
+                        # `task.ctx` keeps changing until `results` is read
+                        result.data = result.data.snapshot()
+                        await results.put(result)
+                else:
+                    # already installed, only checked by `fs.finalize`
+                    task.ctx.completed = task.file.size
+                    task.ctx.digest = None
+                    await results.put(Ok(task.ctx))
+            except Exception as exc:
+                await results.put(Err(task.ctx.snapshot(), exc))
+            finally:
+                self.scheduler.release(task.file)
+                inflight.release()
+
+        async def produce(client: AsyncClient) -> None:
+            try:
+                while True:
+                    await inflight.acquire()
+                    task = await anext(tasks, None)
+                    if task is None:
+                        inflight.release()
+                        break
+                    coro = run_one(task, client)
+                    running_task = asyncio.create_task(coro)
+                    running_task.add_done_callback(running.discard)
+                    running.add(running_task)
+                if running:
+                    await asyncio.wait(running)
+            finally:
+                await results.put(None)
+
+        async with self.client() as client:
+            producer = asyncio.create_task(produce(client))
+            try:
+                while (result := await results.get()) is not None:
                     yield result
+                await producer  # raises errors from `tasks`
+            finally:
+                for running_task in [producer, *running]:
+                    running_task.cancel()
+                await asyncio.gather(
+                    producer, *running, return_exceptions=True
+                )
+                self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from httpx import (
+    HTTPStatusError,
+    NetworkError,
+    RemoteProtocolError,
+    TimeoutException,
+)
+
+from esgpull.config import Retry
+
+TransientErrors = (TimeoutException, NetworkError, RemoteProtocolError)
+
+
+def parse_status_codes(status_codes: str) -> frozenset[int]:
+    return frozenset(
+        int(code) for code in status_codes.split(",") if code.strip()
+    )
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    `Retry-After` is either a number of seconds or an http date.
+    """
+    if value is None:
+        return None
+    elif value.strip().isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Exponential backoff for transient http errors.
+
+    Timeouts, network errors and responses with one of `status_codes` are
+    retried until `max_attempts` requests were sent. The n-th retry waits
+    up to `backoff_base * 2**n` seconds, capped at `backoff_cap`, with full
+    jitter so that concurrent requests to a failing node spread out.
+    A `Retry-After` header from the server takes precedence (still capped).
+    """
+
+    max_attempts: int = 3
+    backoff_base: float = 1.0
+    backoff_cap: float = 60.0
+    jitter: bool = True
+    status_codes: frozenset[int] = field(
+        default_factory=lambda: frozenset({429, 500, 502, 503, 504})
+    )
+    retry_after: bool = True
+
+    @staticmethod
+    def from_config(retry: Retry) -> RetryPolicy:
+        return RetryPolicy(
+            max_attempts=retry.max_attempts,
+            backoff_base=retry.backoff_base,
+            backoff_cap=retry.backoff_cap,
+            jitter=retry.jitter,
+            status_codes=parse_status_codes(retry.status_codes),
+            retry_after=retry.retry_after,
+        )
+
+    def retryable(self, exc: BaseException) -> bool:
+        if isinstance(exc, HTTPStatusError):
+            return exc.response.status_code in self.status_codes
+        else:
+            return isinstance(exc, TransientErrors)
+
+    def delay(self, attempt: int, exc: BaseException) -> float | None:
+        """
+        Seconds to wait before retrying after `attempt` (starting at 0)
+        failed with `exc`, None if it should not be retried.
+        """
+        if attempt + 1 >= self.max_attempts or not self.retryable(exc):
+            return None
+        if self.retry_after and isinstance(exc, HTTPStatusError):
+            header = exc.response.headers.get("Retry-After")
+            retry_after = parse_retry_after(header)
+            if retry_after is not None:
+                return min(retry_after, self.backoff_cap)
+        delay = min(self.backoff_base * 2**attempt, self.backoff_cap)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import heapq
+from collections import Counter, deque
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from typing import Protocol
+
+from esgpull.config import Config
+from esgpull.limiter import Limiter
+
+
+class Schedulable(Protocol):
+    """
+    Fields of a file used to schedule it, either a `File` or a row
+    selected with `sql.file.queued_from_queries`.
+    """
+
+    @property
+    def sha(self) -> str: ...
+
+    @property
+    def size(self) -> int: ...
+
+    @property
+    def data_node(self) -> str: ...
+
+
+class Policy(Enum):
+    Fifo = "fifo"
+    Smallest = "smallest"
+    Largest = "largest"
+    RoundRobin = "round-robin"
+    Priority = "priority"
+    Deadline = "deadline"
+
+
+@dataclass
+class Scheduler:
+    """
+    Picks the next file to download each time a download slot frees up.
+
+    Pending files are kept in one heap per data node, ordered by `policy`:
+        - fifo: in the order they were pushed
+        - smallest/largest: by size
+        - round-robin: one file per data node in turn, fifo on each node
+        - priority: highest `priorities[file.sha]` first (default 0)
+        - deadline: earliest `deadlines[file.sha]` first, then no deadline
+
+    With a `Limiter`, data nodes already running as many downloads as
+    they have slots are skipped while other nodes have pending files,
+    so that a new download does not wait behind a saturated node.
+    """
+
+    policy: Policy = Policy.Fifo
+    priorities: Mapping[str, int] = field(default_factory=dict)
+    deadlines: Mapping[str, datetime] = field(default_factory=dict)
+    heaps: dict[str, list[tuple[float, int, Schedulable]]] = field(
+        init=False, default_factory=dict
+    )
+    nodes: deque[str] = field(init=False, default_factory=deque)
+    running: Counter[str] = field(init=False, default_factory=Counter)
+    count: int = field(init=False, default=0)
+
+    @staticmethod
+    def from_config(config: Config) -> Scheduler:
+        return Scheduler(Policy(config.download.schedule))
+
+    def __len__(self) -> int:
+        return sum(len(heap) for heap in self.heaps.values())
+
+    def key(self, file: Schedulable) -> float:
+        match self.policy:
+            case Policy.Smallest:
+                return file.size
+            case Policy.Largest:
+                return -file.size
+            case Policy.Priority:
+                return -self.priorities.get(file.sha, 0)
+            case Policy.Deadline:
+                if file.sha in self.deadlines:
+                    return self.deadlines[file.sha].timestamp()
+                return float("inf")
+            case _:
+                return 0
+
+    def push(self, *files: Schedulable) -> None:
+        for file in files:
+            if file.data_node not in self.heaps:
+                self.heaps[file.data_node] = []
+                self.nodes.append(file.data_node)
+            entry = (self.key(file), self.count, file)
+            heapq.heappush(self.heaps[file.data_node], entry)
+            self.count += 1
+
+    def available(self, node: str, limiter: Limiter | None) -> bool:
+        if limiter is None:
+            return True
+        return self.running[node] < int(limiter[node].limit)
+
+    def pop(self, limiter: Limiter | None = None) -> Schedulable | None:
+        if not self.nodes:
+            return None
+        candidates = [
+            node for node in self.nodes if self.available(node, limiter)
+        ] or list(self.nodes)
+        if self.policy == Policy.RoundRobin:
+            node = candidates[0]
+        else:
+            node = min(candidates, key=lambda node: self.heaps[node][0][:2])
+        _, _, file = heapq.heappop(self.heaps[node])
+        self.nodes.remove(node)
+        if self.heaps[node]:
+            self.nodes.append(node)  # last in round-robin order
+        else:
+            del self.heaps[node]
+        self.running[node] += 1
+        return file
+
+    def release(self, file: Schedulable) -> None:
+        """
+        Called when the download of `file` is over.
+        """
+        if self.running[file.data_node] > 0:
+            self.running[file.data_node] -= 1
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+DOCS_START = re.compile(r'"docs"\s*:\s*\[')
+SEPARATORS = frozenset(" \t\r\n,")
+
+
+def loads(content: bytes) -> Any:
+    """
+    Decode a json response from an index node.
+
+    Responses are decoded as latin-1 like they always were, since file shas
+    depend on decoded strings. orjson is used when installed and the
+    content is plain ascii, both decodings are then identical.
+    """
+    if orjson is not None and content.isascii():
+        return orjson.loads(content)
+    else:
+        return json.loads(content.decode(encoding="latin-1"))
+
+
+class DocsParser:
+    """
+    Incremental parser for Solr json responses.
+
+    Documents from `response.docs` are decoded as soon as they are complete
+    in the fed chunks, without holding the whole body in memory.
+    The rest of the response is kept to be decoded by `close`,
+    with an empty list of documents.
+    """
+
+    def __init__(self) -> None:
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.prefix: str | None = None
+        self.in_docs = False
+
+    def feed(self, chunk: bytes) -> list[dict[str, Any]]:
+        self.buffer += chunk.decode(encoding="latin-1")
+        docs: list[dict[str, Any]] = []
+        if self.prefix is None:
+            match = DOCS_START.search(self.buffer)
+            if match is None:
+                return docs
+            self.prefix = self.buffer[: match.end()]
+            self.buffer = self.buffer[match.end() :]
+            self.in_docs = True
+        if self.in_docs:
+            buffer = self.buffer
+            pos = 0
+            while True:
+                while pos < len(buffer) and buffer[pos] in SEPARATORS:
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                elif buffer[pos] == "]":
+                    self.in_docs = False
+                    break
+                try:
+                    doc, pos = self.decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    break  # incomplete document, wait for next chunk
+                docs.append(doc)
+            self.buffer = buffer[pos:]
+        return docs
+
+    def close(self) -> dict[str, Any]:
+        """
+        Decode what remains of the response, `response.docs` is empty.
+        """
+        if self.prefix is None:
+            return json.loads(self.buffer)
+        elif self.in_docs:
+            raise ValueError("Truncated response, docs list is not closed.")
+        else:
+            return json.loads(self.prefix + self.buffer)
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import mmap
+import os
+from collections import Counter
+from collections.abc import Callable, Iterator, Mapping
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from esgpull.config import Config
+from esgpull.database import Database
+from esgpull.fs import Digest, FileCheck, Filesystem
+from esgpull.models import File, FileStatus, sql
+from esgpull.tui import logger
+
+
+@dataclass(frozen=True)
+class VerifyJob:
+    """
+    Picklable description of a file to verify in a worker process.
+    """
+
+    sha: str
+    path: str
+    size: int
+    checksum: str
+    checksum_type: str
+
+
+def aligned_block_size(block_size: int, fd: int) -> int:
+    """
+    Round `block_size` down to a multiple of the filesystem's block size.
+    """
+    fs_block_size = max(os.fstat(fd).st_blksize, mmap.PAGESIZE)
+    return max(fs_block_size, block_size // fs_block_size * fs_block_size)
+
+
+def verify_path(
+    job: VerifyJob,
+    block_size: int,
+    use_mmap: bool = False,
+) -> FileCheck:
+    """
+    Check size and checksum of a single file, runs in a worker process.
+
+    The file is read sequentially into a reused buffer (or mapped in memory
+    with `use_mmap`), hashlib releases the GIL on large blocks.
+    """
+    try:
+        return _verify_path(job, block_size, use_mmap)
+    except FileNotFoundError:
+        return FileCheck.Missing
+    except OSError:
+        return FileCheck.Unreadable
+
+
+def _verify_path(job: VerifyJob, block_size: int, use_mmap: bool) -> FileCheck:
+    fd = os.open(job.path, os.O_RDONLY)
+    with open(fd, "rb", buffering=0) as f:
+        if os.fstat(fd).st_size != job.size:
+            return FileCheck.BadSize
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        block_size = aligned_block_size(block_size, fd)
+        try:
+            alg = Digest.algorithm(job.checksum_type)
+        except NotImplementedError:
+            return FileCheck.Unsupported
+        if use_mmap and job.size > 0:
+            with (
+                mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped,
+                memoryview(mapped) as view,
+            ):
+                for start in range(0, job.size, block_size):
+                    alg.update(view[start : start + block_size])
+        else:
+            buffer = bytearray(block_size)
+            with memoryview(buffer) as view:
+                while nbytes := f.readinto(buffer):
+                    alg.update(view[:nbytes])
+    if alg.hexdigest() == job.checksum:
+        return FileCheck.Ok
+    else:
+        return FileCheck.BadChecksum
+
+
+@dataclass
+class Verifier:
+    """
+    Verify `done` files against their checksum using a process pool.
+
+    Results are written back to the database by batches of `flush_every`
+    files, the shas of verified files are then appended to a state file
+    so that an interrupted run resumes where it stopped.
+    Corrupted or missing files are removed from the data directory and
+    sent back to the download queue, unless `requeue` is disabled, they
+    are then only collected in `bad` (e.g. for `send_back` once confirmed).
+    Files with an unsupported checksum type are only reported, unreadable
+    files are also left out of the state file to be checked again.
+    With `dry_run`, nothing is written (neither database nor state file).
+    """
+
+    config: Config
+    db: Database
+    fs: Filesystem
+    requeue: bool = True
+    dry_run: bool = False
+    flush_every: int = 100
+    bad: dict[str, FileCheck] = field(init=False, default_factory=dict)
+    _results: dict[str, FileCheck] = field(init=False, default_factory=dict)
+
+    @property
+    def state_path(self) -> Path:
+        return self.fs.db / "verify.state"
+
+    @property
+    def max_workers(self) -> int:
+        return self.config.verify.max_workers or os.cpu_count() or 1
+
+    def verified_shas(self) -> set[str]:
+        if self.state_path.is_file():
+            return set(self.state_path.read_text().split())
+        else:
+            return set()
+
+    def reset(self) -> None:
+        if not self.dry_run:
+            self.state_path.unlink(missing_ok=True)
+
+    def jobs(self, resume: bool = True) -> list[VerifyJob]:
+        """
+        Files with status `done`, excluding those verified by a previous run
+        when resuming.
+        """
+        verified = self.verified_shas() if resume else set()
+        rows = self.db.rows(sql.file.checksums_with_status(FileStatus.Done))
+        jobs: list[VerifyJob] = []
+        for sha, local_path, filename, size, checksum, checksum_type in rows:
+            if sha in verified:
+                continue
+            path = self.fs.data / local_path / filename
+            job = VerifyJob(sha, str(path), size, checksum, checksum_type)
+            jobs.append(job)
+        return jobs
+
+    def flush(self) -> None:
+        if not self._results:
+            return
+        if self.dry_run:
+            self._results.clear()
+            return
+        reported = (FileCheck.Ok, FileCheck.Unsupported, FileCheck.Unreadable)
+        bad = {
+            sha: check
+            for sha, check in self._results.items()
+            if check not in reported
+        }
+        self.bad.update(bad)
+        if bad and self.requeue:
+            self.send_back(bad)
+        with self.state_path.open("a") as f:
+            f.writelines(
+                f"{sha}\n"
+                for sha, check in self._results.items()
+                if check != FileCheck.Unreadable
+            )
+        self._results.clear()
+
+    def send_back(self, bad: Mapping[str, FileCheck]) -> int:
+        """
+        Delete corrupted files and send them back to the download queue,
+        along with missing files. Returns the number of files sent back.
+        """
+        files: list[File] = []
+        for sha, check in bad.items():
+            file = self.db.get(File, sha)
+            if file is None:
+                continue
+            if check != FileCheck.Missing:
+                self.fs.delete(file)
+            file.status = FileStatus.Queued
+            files.append(file)
+        if files:
+            self.db.add(*files)
+        return len(files)
+
+    def iter_checks(
+        self,
+        jobs: list[VerifyJob],
+    ) -> Iterator[tuple[VerifyJob, FileCheck]]:
+        """
+        Submit jobs lazily, keeping at most twice as many jobs in flight
+        as there are workers.
+        """
+        remaining = iter(jobs)
+        pending: dict[Future[FileCheck], VerifyJob] = {}
+        block_size = self.config.verify.block_size
+        use_mmap = self.config.verify.use_mmap
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            try:
+                while True:
+                    while len(pending) < 2 * self.max_workers:
+                        job = next(remaining, None)
+                        if job is None:
+                            break
+                        future = executor.submit(
+                            verify_path, job, block_size, use_mmap
+                        )
+                        pending[future] = job
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future.result()
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def run(
+        self,
+        jobs: list[VerifyJob],
+        on_check: Callable[[VerifyJob, FileCheck], None] | None = None,
+    ) -> Counter[FileCheck]:
+        counts: Counter[FileCheck] = Counter()
+        try:
+            for job, check in self.iter_checks(jobs):
+                if check != FileCheck.Ok:
+                    logger.warning(f"{job.path}: {check.name}")
+                counts[check] += 1
+                self._results[job.sha] = check
+                if len(self._results) >= self.flush_every:
+                    self.flush()
+                if on_check is not None:
+                    on_check(job, check)
+        finally:
+            self.flush()
+        self.reset()
+        return counts
@@ -0,0 +1,59 @@
+import subprocess
+import sys
+
+import click
+
+from esgpull.cli import SUBCOMMANDS, cli
+
+HELP = """
+import sys
+from esgpull.cli import main
+sys.argv = ["esgpull", "--help"]
+try:
+    main()
+except SystemExit:
+    pass
+"""
+HEAVY_MODULES = [
+    "aiostream",
+    "alembic",
+    "httpx",
+    "myproxy",
+    "OpenSSL",
+    "rich",
+    "sqlalchemy",
+]
+
+
+def importtime(code: str) -> dict[str, int]:
+    """
+    Cumulative import time in microseconds of each module imported by `code`.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_help_importtime():
+    times = importtime(HELP)
+    for name in times:
+        assert name.split(".")[0] not in HEAVY_MODULES
+    # no bound on `times["esgpull.cli"]`, too noisy with parallel tests
+
+
+def test_short_help():
+    ctx = click.Context(cli)
+    for name, (_, short_help) in SUBCOMMANDS.items():
+        command = cli.get_command(ctx, name)
+        assert command is not None
+        assert command.get_short_help_str(limit=1000) == short_help
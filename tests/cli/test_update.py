@@ -1,12 +1,20 @@
+import json
+import re
+from datetime import datetime
 from time import perf_counter
 
+import httpx
+import pytest
 from click.testing import CliRunner
 
+from esgpull import Esgpull
 from esgpull.cli.add import add
 from esgpull.cli.config import config
+from esgpull.cli.nodes import nodes
 from esgpull.cli.self import install
-from esgpull.cli.update import update
+from esgpull.cli.update import CLOCK_SKEW_MARGIN, update
 from esgpull.install_config import InstallConfig
+from esgpull.models import sql
 
 
 def test_fast_update(tmp_path):
@@ -34,3 +42,159 @@ def test_fast_update(tmp_path):
     assert result_update.exit_code == 0
     assert stop - start < 30  # 30 seconds to fetch ~6k files is plenty enough
     InstallConfig.setup()
+
+
+def search_handler(requests: list[httpx.Request], nb_files: list[int]):
+    """
+    Mock index node, files are published in order and at most
+    `nb_files[-1]` of them exist. No file is ever modified since a `from`.
+    """
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        params = request.url.params
+        hits = nb_files[-1] if "from" not in params else 0
+        if "facets" in params:
+            index_node = [request.url.host, hits] if hits else []
+            content = {
+                "response": {"numFound": hits, "docs": []},
+                "facet_counts": {"facet_fields": {"index_node": index_node}},
+            }
+        else:
+            docs = [
+                {
+                    "id": f"project.model.v20200101.file{i}.nc|data_node",
+                    "dataset_id": "project.model.v20200101|data_node",
+                    "title": f"file{i}.nc",
+                    "url": f"https://data_node/file{i}.nc|application/netcdf",
+                    "data_node": "data_node",
+                    "checksum": f"{i:064x}",
+                    "checksum_type": "SHA256",
+                    "size": 1,
+                    "project": "project",
+                    "model": "model",
+                    "directory_format_template_": "%(root)s/%(project)s/%(model)s",
+                }
+                for i in range(hits)
+            ]
+            if match := re.search(r"title:\(?([^)]*)\)?", params["query"]):
+                titles = match.group(1).split()
+                docs = [doc for doc in docs if doc["title"] in titles]
+            if params["fields"] != "*":
+                fields = params["fields"].split(",")
+                docs = [{k: doc[k] for k in fields} for doc in docs]
+            content = {"response": {"numFound": len(docs), "docs": docs}}
+        stream = httpx.ByteStream(json.dumps(content).encode())
+        return httpx.Response(200, stream=stream)
+
+    return handler
+
+
+@pytest.fixture
+def mock_index(mock_transport):
+    requests: list[httpx.Request] = []
+    nb_files = [3]
+    mock_transport(search_handler(requests, nb_files), "esgpull.context")
+    return requests, nb_files
+
+
+@pytest.fixture
+def tracked(tmp_path):
+    InstallConfig.setup(tmp_path)
+    install_path = tmp_path / "esgpull"
+    runner = CliRunner()
+    assert runner.invoke(install, [f"{install_path}"]).exit_code == 0
+    result_add = runner.invoke(
+        add,
+        ["project:project", "--distrib", "false", "--track"],
+    )
+    assert result_add.exit_code == 0
+    yield runner
+    InstallConfig.setup()
+
+
+def nb_linked_files() -> int:
+    return len(Esgpull().db.scalars(sql.file.linked()))
+
+
+# updates with files already linked used to attach unsaved queries to them
+raise_sa_warnings = pytest.mark.filterwarnings(
+    "error::sqlalchemy.exc.SAWarning"
+)
+
+
+@raise_sa_warnings
+def test_incremental_update(mock_index, tracked):
+    requests, _ = mock_index
+    result_update = tracked.invoke(update, ["--yes"])
+    assert result_update.exit_code == 0
+    assert "3 files found" in result_update.output
+    assert nb_linked_files() == 3
+    assert all("from" not in r.url.params for r in requests)
+    requests.clear()
+    result_update = tracked.invoke(update, ["--yes"])
+    assert result_update.exit_code == 0
+    assert "No files found" in result_update.output
+    assert len(requests) == 1
+    assert "from" in requests[0].url.params
+    requests.clear()
+    result_update = tracked.invoke(update, ["--yes", "--full"])
+    assert result_update.exit_code == 0
+    assert "already up-to-date" in result_update.output
+    assert all("from" not in r.url.params for r in requests)
+    assert nb_linked_files() == 3
+
+
+@raise_sa_warnings
+def test_two_phase_update(mock_index, tracked):
+    requests, nb_files = mock_index
+    result_update = tracked.invoke(update, ["--yes"])
+    assert result_update.exit_code == 0
+    assert (
+        "title:(file0.nc file1.nc file2.nc)"
+        in requests[-1].url.params["query"]
+    )
+    nb_files.append(5)
+    requests.clear()
+    result_update = tracked.invoke(update, ["--yes", "--full"])
+    assert result_update.exit_code == 0
+    hints, fast, full = requests
+    assert "facets" in hints.url.params
+    assert fast.url.params["fields"] == "id,dataset_id,title,checksum"
+    assert full.url.params["fields"] == "*"
+    assert "title:(file3.nc file4.nc)" in full.url.params["query"]
+    assert nb_linked_files() == 5
+    requests.clear()
+    result_update = tracked.invoke(update, ["--yes", "--full"])
+    assert result_update.exit_code == 0
+    assert "already up-to-date" in result_update.output
+    assert len(requests) == 2  # no full fetch when all files are known
+
+
+def test_update_cached(mock_index, tracked):
+    requests, _ = mock_index
+    enable_cache = tracked.invoke(config, ["api.cache.enabled", "true"])
+    assert enable_cache.exit_code == 0
+    first_update = datetime.utcnow()
+    assert tracked.invoke(update, ["--yes"]).exit_code == 0
+    requests.clear()
+    second_update = datetime.utcnow()
+    assert tracked.invoke(update, ["--yes", "--full"]).exit_code == 0
+    assert requests == []  # served from the cache of the first update
+    esg = Esgpull()
+    esg.graph.load_db()
+    [query] = esg.graph.queries.values()
+    # not the start of the second update, its responses are older
+    assert query.updated_at is not None
+    assert query.updated_at < first_update < second_update
+    assert query.updated_at >= first_update - CLOCK_SKEW_MARGIN * 2
+
+
+def test_nodes(mock_index, tracked):
+    result_nodes = tracked.invoke(nodes)
+    assert result_nodes.exit_code == 0
+    assert "No index node" in result_nodes.output
+    assert tracked.invoke(update, ["--yes"]).exit_code == 0
+    result_nodes = tracked.invoke(nodes)
+    assert result_nodes.exit_code == 0
+    assert "esgf-node.ipsl.upmc.fr" in result_nodes.output
@@ -1,3 +1,10 @@
+import asyncio
+from collections.abc import Callable
+from functools import partial
+from hashlib import sha256
+from typing import Any
+
+import httpx
 import pytest
 
 from esgpull.config import Config
@@ -43,3 +50,101 @@ def file():
     )
     f.compute_sha()
     return f
+
+
+@pytest.fixture
+def make_file() -> Callable[..., File]:
+    """
+    Factory of queued files named `file{i}.nc`, with the size and checksum
+    of `content`. Other fields are set with keyword arguments.
+    """
+
+    def make(i: int | str = 0, content: bytes = b"", **fields: Any) -> File:
+        kwargs: dict[str, Any] = dict(
+            file_id=f"project.dataset.v0.file{i}.nc",
+            dataset_id="project.dataset.v0",
+            master_id=f"project.dataset.file{i}.nc",
+            url=f"https://data_node/file{i}.nc",
+            version="v0",
+            filename=f"file{i}.nc",
+            local_path="project/dataset/v0",
+            data_node="data_node",
+            checksum=sha256(content).hexdigest(),
+            checksum_type="SHA256",
+            size=len(content),
+            status=FileStatus.Queued,
+        )
+        file = File(**(kwargs | fields))
+        file.compute_sha()
+        return file
+
+    return make
+
+
+@pytest.fixture
+def mock_transport(monkeypatch) -> Callable[..., None]:
+    """
+    Send requests of clients created by `module` to `handler`.
+    """
+
+    def mock(handler: Callable, module: str = "esgpull.processor") -> None:
+        transport = httpx.MockTransport(handler)
+        monkeypatch.setattr(
+            f"{module}.AsyncClient",
+            partial(httpx.AsyncClient, transport=transport),
+        )
+
+    return mock
+
+
+@pytest.fixture
+def data_node(mock_transport) -> Callable[..., list[str]]:
+    """
+    Serve `contents[i]` at the url of `make_file(i)`, with byte ranges,
+    each answer waits `delay` seconds. Returns the paths of GET requests.
+    """
+
+    def serve(contents: list[bytes], delay: float = 0) -> list[str]:
+        requests: list[str] = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            path = request.url.path
+            i = int(path.removeprefix("/file").removesuffix(".nc"))
+            content = contents[i]
+            headers = {
+                "Accept-Ranges": "bytes",
+                "Content-Length": str(len(content)),
+            }
+            if request.method == "HEAD":
+                return httpx.Response(200, headers=headers)
+            requests.append(path)
+            await asyncio.sleep(delay)
+            if "Range" not in request.headers:
+                return httpx.Response(200, stream=httpx.ByteStream(content))
+            start, end = request.headers["Range"][6:].split("-")
+            part = content[int(start) : int(end) + 1]
+            return httpx.Response(206, stream=httpx.ByteStream(part))
+
+        mock_transport(handler)
+        return requests
+
+    return serve
+
+
+class ResetStream(httpx.AsyncByteStream):
+    """
+    Response body cut after `size` bytes by a connection reset.
+    """
+
+    def __init__(self, content: bytes, size: int) -> None:
+        self.content = content
+        self.size = size
+
+    async def __aiter__(self):
+        yield self.content[: self.size]
+        raise httpx.ReadError("Connection reset by peer")
+
+
+@pytest.fixture
+def reset_stream() -> type[ResetStream]:
+    return ResetStream
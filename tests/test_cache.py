@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+from httpx import AsyncClient, ByteStream, MockTransport, Response
+
+from esgpull.cache import Cache
+from esgpull.context import Context
+from esgpull.models import Query
+from esgpull.utils import sync
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return Cache(
+        tmp_path / "cache.db",
+        max_size=1 << 20,
+        ttl={"hits": 60, "search": 60},
+    )
+
+
+def test_cache_ttl(cache, monkeypatch):
+    cache.set("url", "hits", b"content")
+    assert cache.oldest is None
+    assert cache.get("url", "hits") == b"content"
+    assert cache.oldest is not None
+    assert cache.get("other", "hits") is None
+    cache.set("url_hints", "hints", b"content")  # ttl is 0, not cached
+    assert cache.get("url_hints", "hints") is None
+    monkeypatch.setattr("esgpull.cache.time", lambda: 1e12)
+    assert cache.get("url", "hits") is None
+    assert cache.size() == 0
+
+
+def test_cache_lru(cache):
+    content = os.urandom(1 << 16)  # incompressible
+    cache.max_size = 3 * len(content) // 2
+    cache.set("first", "search", content)
+    cache.set("second", "search", content)
+    assert cache.get("first", "search") is None
+    assert cache.get("second", "search") == content
+    cache.max_size = 1 << 30
+    cache.set("third", "search", content)
+    cache.get("second", "search")
+    cache.max_size = 3 * cache.size() // 4
+    cache.evict()
+    assert cache.get("third", "search") is None
+    assert cache.get("second", "search") == content
+
+
+def test_context_cache(config):
+    config.api.cache.enabled = True
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        content = json.dumps({"response": {"numFound": 42}}).encode()
+        return Response(200, stream=ByteStream(content))
+
+    ctx = Context(config)
+    assert ctx.cache is not None
+    query = Query(selection=dict(project="CMIP6"))
+
+    async def hits() -> list[int]:
+        ctx.client = AsyncClient(transport=MockTransport(handler))
+        results = ctx.prepare_hits(query, file=False)
+        return await ctx._hits(*results)
+
+    assert sync(hits()) == [42]
+    assert sync(hits()) == [42]
+    assert len(requests) == 1
+    content = ctx.cache.get(str(requests[0].url), "hits")
+    assert json.loads(content) == {"response": {"numFound": 42}}
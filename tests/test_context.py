@@ -1,10 +1,18 @@
+import asyncio
+import json
 import logging
+import sys
 from time import perf_counter
 
+import httpx
 import pytest
 
+if sys.version_info < (3, 11):
+    from exceptiongroup import BaseExceptionGroup
+
 from esgpull.context import Context
-from esgpull.models import Query
+from esgpull.health import Health
+from esgpull.models import File, Query
 
 
 @pytest.fixture
@@ -167,3 +175,249 @@ def test_ignore_facet_hits(ctx):
     hits_not_ipsl = ctx.hits(query_not_ipsl, file=False)[0]
     assert all(hits > 0 for hits in [hits_all, hits_ipsl, hits_not_ipsl])
     assert hits_all == hits_ipsl + hits_not_ipsl
+
+
+def test_prepare_search_filenames(ctx, cmip6_ipsl):
+    index_url = "https://index/esg-search/search"
+    filenames = [f"{i:0100}.nc" for i in range(100)]
+    results = ctx.prepare_search_filenames(cmip6_ipsl, filenames, index_url)
+    assert len(results) == 3
+    requested: list[str] = []
+    for result in results:
+        params = result.request.url.params
+        assert result.index_url == index_url
+        assert params["distrib"] == "false"
+        assert "institution_id:IPSL" in params["query"]
+        titles = params["query"].split("title:(")[1].rstrip(")").split()
+        requested.extend(titles)
+    assert requested == filenames
+    cmip6_ipsl.selection.title = filenames[0]
+    results = ctx.prepare_search_filenames(cmip6_ipsl, filenames, index_url)
+    assert len(results) == 1
+
+
+@pytest.fixture
+def mock_client(monkeypatch):
+    clients: list[httpx.AsyncClient] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        content = json.dumps({"response": {"numFound": 42, "docs": []}})
+        return httpx.Response(200, stream=httpx.ByteStream(content.encode()))
+
+    def make_client(**kwargs) -> httpx.AsyncClient:
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler),
+            **kwargs,
+        )
+        clients.append(client)
+        return client
+
+    monkeypatch.setattr("esgpull.context.AsyncClient", make_client)
+    return clients
+
+
+def test_async_api(mock_client, cmip6_ipsl):
+    async def main() -> tuple[list[int], list[File]]:
+        async with Context() as ctx:
+            hits = await ctx.ahits(cmip6_ipsl, file=True)
+            files = await ctx.afiles(cmip6_ipsl, hits=hits)
+            return hits, files
+
+    assert asyncio.run(main()) == ([42], [])
+    assert len(mock_client) == 1
+
+
+def test_sync_api_reuses_client(mock_client, cmip6_ipsl):
+    ctx = Context()
+    assert ctx.hits(cmip6_ipsl, file=True) == [42]
+    assert ctx.files(cmip6_ipsl) == []
+    assert len(mock_client) == 1
+    ctx.close()
+    assert mock_client[0].is_closed
+    assert ctx.hits(cmip6_ipsl, file=True) == [42]
+    assert len(mock_client) == 2
+    ctx.close()
+
+
+def test_iter_files(cmip6_ipsl, mock_transport):
+    requests: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        offset = int(request.url.params["offset"])
+        limit = int(request.url.params["limit"])
+        docs = [
+            {
+                "dataset_id": "project.model.v20200101|data_node",
+                "title": f"file{i % 15}.nc",
+                "url": f"https://data_node/file{i}.nc|application/netcdf",
+                "data_node": "data_node",
+                "checksum": f"{i % 15:064x}",
+                "checksum_type": "SHA256",
+                "size": 1,
+                "project": "project",
+                "model": "model",
+                "directory_format_template_": "%(root)s/%(project)s/%(model)s",
+            }
+            for i in range(offset, offset + limit)
+        ]
+        content = json.dumps({"response": {"numFound": 20, "docs": docs}})
+        return httpx.Response(200, stream=httpx.ByteStream(content.encode()))
+
+    mock_transport(handler, "esgpull.context")
+
+    async def main(**kwargs) -> tuple[int, list[File]]:
+        requests.clear()
+        async with Context() as ctx:
+            files = ctx.iter_files(
+                cmip6_ipsl,
+                hits=[20],
+                max_hits=None,
+                page_limit=2,
+                max_pages=2,
+                **kwargs,
+            )
+            first = await anext(files)
+            nb_requests = len(requests)
+            return nb_requests, [first] + [file async for file in files]
+
+    nb_requests, files = asyncio.run(main())
+    assert nb_requests <= 2
+    assert len(requests) == 10
+    assert len(files) == 20
+    _, files = asyncio.run(main(keep_duplicates=False))
+    assert len({file.sha for file in files}) == len(files) == 15
+
+
+def test_retry(config, cmip6_ipsl, mock_transport, reset_stream):
+    config.api.retry.backoff_base = 0
+    requests: list[httpx.Request] = []
+    docs = [
+        {
+            "id": f"project.model.v20200101.file{i}.nc|data_node",
+            "dataset_id": "project.model.v20200101|data_node",
+            "title": f"file{i}.nc",
+            "url": f"https://data_node/file{i}.nc|application/netcdf",
+            "data_node": "data_node",
+            "checksum": f"{i:064x}",
+            "checksum_type": "SHA256",
+            "size": 1,
+            "project": "project",
+            "model": "model",
+            "directory_format_template_": "%(root)s/%(project)s/%(model)s",
+        }
+        for i in range(3)
+    ]
+    content = json.dumps({"response": {"numFound": 3, "docs": docs}}).encode()
+    # sorted differently, as by another index node
+    docs_reversed = {"response": {"numFound": 3, "docs": docs[::-1]}}
+    content_reversed = json.dumps(docs_reversed).encode()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) == 1:
+            return httpx.Response(503, headers={"Retry-After": "0"})
+        elif len(requests) == 2:
+            cut = content.index(b"file2.nc")
+            return httpx.Response(200, stream=reset_stream(content, cut))
+        else:
+            stream = httpx.ByteStream(content_reversed)
+            return httpx.Response(200, stream=stream)
+
+    mock_transport(handler, "esgpull.context")
+
+    async def main() -> list[File]:
+        async with Context(config) as ctx:
+            results = ctx.prepare_search(cmip6_ipsl, file=True, hits=[3])
+            files = await ctx._files(*results, keep_duplicates=True)
+            assert [result.retries for result in results] == [2]
+            return files
+
+    files = asyncio.run(main())
+    assert len(requests) == 3
+    assert [file.filename for file in files] == [
+        "file0.nc",
+        "file1.nc",
+        "file2.nc",
+    ]
+    requests.clear()
+    config.api.retry.max_attempts = 1
+    with pytest.raises(BaseExceptionGroup):
+        asyncio.run(main())
+    assert len(requests) == 1
+
+
+def hits_response(hits: int) -> httpx.Response:
+    content = json.dumps({"response": {"numFound": hits, "docs": []}})
+    return httpx.Response(200, stream=httpx.ByteStream(content.encode()))
+
+
+def test_failover(config, cmip6_ipsl, mock_transport):
+    config.api.failover.enabled = True
+    config.api.retry.max_attempts = 1
+    index_node = config.api.index_node
+    hosts: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hosts.append(request.url.host)
+        if request.url.host == index_node:
+            return httpx.Response(503)
+        return hits_response(42)
+
+    mock_transport(handler, "esgpull.context")
+    ctx = Context(config)
+    ctx.health = Health()
+    ctx.health.add("backup-node")
+    assert ctx.hits(cmip6_ipsl, file=True) == [42]
+    assert hosts == [index_node, "backup-node"]
+    assert ctx.health[index_node].errors == 1
+    hosts.clear()
+    assert ctx.hits(cmip6_ipsl, file=True) == [42]
+    assert hosts == ["backup-node"]
+    hosts.clear()
+    # requests to a specific index node are never rerouted
+    with pytest.raises(BaseExceptionGroup):
+        ctx.hits(cmip6_ipsl, file=True, index_node=index_node)
+    assert hosts == [index_node]
+    ctx.close()
+
+
+def test_health_client_error(config, cmip6_ipsl, mock_transport):
+    config.api.failover.enabled = True
+    index_node = config.api.index_node
+    hosts: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        hosts.append(request.url.host)
+        return httpx.Response(400)
+
+    mock_transport(handler, "esgpull.context")
+    ctx = Context(config)
+    ctx.health = Health()
+    with pytest.raises(BaseExceptionGroup):
+        ctx.hits(cmip6_ipsl, file=True)
+    assert hosts == [index_node]
+    assert ctx.health[index_node].errors == 0
+    ctx.close()
+
+
+def test_hedging(config, cmip6_ipsl, mock_transport):
+    config.api.failover.enabled = True
+    config.api.failover.hedge = True
+    config.api.failover.hedge_delay = 0
+    index_node = config.api.index_node
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == index_node:
+            await asyncio.sleep(10)
+            return hits_response(1)
+        return hits_response(2)
+
+    mock_transport(handler, "esgpull.context")
+    ctx = Context(config)
+    ctx.health = Health()
+    ctx.health.add("backup-node")
+    start = perf_counter()
+    assert ctx.hits(cmip6_ipsl, file=True) == [2]
+    assert perf_counter() - start < 5
+    ctx.close()
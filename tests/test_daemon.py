@@ -0,0 +1,149 @@
+import asyncio
+
+import httpx
+import pytest
+
+from esgpull import Esgpull
+from esgpull.daemon import Daemon
+from esgpull.database import WriteBuffer
+from esgpull.lease import Lease
+from esgpull.models import File, FileStatus, sql
+from esgpull.processor import Task
+
+
+def test_daemon(root, make_file, data_node):
+    esg = Esgpull(root, install=True)
+    contents = [bytes([i]) * 1024 for i in range(5)]
+    statuses = [
+        FileStatus.Queued,
+        FileStatus.Queued,
+        FileStatus.Queued,
+        FileStatus.Started,  # interrupted by a previous daemon
+        FileStatus.Error,
+    ]
+    files = [
+        make_file(i, content, status=status)
+        for i, (content, status) in enumerate(zip(contents, statuses))
+    ]
+    esg.db.add(*files)
+    requests = data_node(contents)
+    daemon = Daemon(
+        esg,
+        Lease(esg.db),
+        WriteBuffer(esg.db, max_items=2),
+        poll_interval=0.01,
+        max_inflight=2,
+    )
+
+    async def main() -> None:
+        task = asyncio.create_task(daemon.run())
+        while daemon.done < 4:
+            await asyncio.sleep(0.01)
+        # queued while running
+        file = make_file(5, b"new")
+        contents.append(b"new")
+        esg.db.add(file)
+        while daemon.done < 5:
+            await asyncio.sleep(0.01)
+        daemon.stop()
+        await task
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+    assert sorted(requests) == [f"/file{i}.nc" for i in [0, 1, 2, 3, 5]]
+    done = esg.db.scalars(sql.file.with_status(FileStatus.Done))
+    assert len(done) == 5
+    assert esg.db.scalars(sql.file.with_status(FileStatus.Error)) == [files[4]]
+    for file in done:
+        assert esg.fs[file].drs.is_file()
+        assert file.worker is None and file.lease_expiry is None
+
+
+@pytest.mark.parametrize("max_connections", [1, 4])
+def test_daemon_chunks(root, make_file, data_node, max_connections):
+    esg = Esgpull(root, install=True)
+    esg.config.download.chunk_size = 4096
+    esg.config.download.range_size = 10_000
+    esg.config.download.max_connections_per_file = max_connections
+    contents = [bytes([i]) * 50_000 for i in range(4)]
+    files = [make_file(i, content) for i, content in enumerate(contents)]
+    esg.db.add(*files)
+    data_node(contents)
+    daemon = Daemon(
+        esg,
+        Lease(esg.db),
+        WriteBuffer(esg.db),
+        poll_interval=0.01,
+        max_inflight=2,
+    )
+
+    async def main() -> None:
+        task = asyncio.create_task(daemon.run())
+        while daemon.done + daemon.errors < 4 and not task.done():
+            await asyncio.sleep(0.01)
+        daemon.stop()
+        await task
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+    assert (daemon.done, daemon.errors) == (4, 0)
+    for file, content in zip(files, contents):
+        assert file.status == FileStatus.Done
+        assert esg.fs[file].drs.read_bytes() == content
+
+
+def test_daemon_errors(root, monkeypatch, make_file, data_node):
+    esg = Esgpull(root, install=True)
+    contents = [bytes([i]) * 1024 for i in range(2)]
+    files = [make_file(i, content) for i, content in enumerate(contents)]
+    esg.db.add(*files)
+    data_node(contents)
+    attempt = Task.attempt
+
+    def broken_attempt(self, limiter, client):
+        if self.file.sha == files[1].sha:
+            raise PermissionError("denied")
+        return attempt(self, limiter, client)
+
+    monkeypatch.setattr(Task, "attempt", broken_attempt)
+    daemon = Daemon(esg, Lease(esg.db), WriteBuffer(esg.db), 0.01, 2)
+
+    async def main() -> None:
+        task = asyncio.create_task(daemon.run())
+        while daemon.done + daemon.errors < 2:
+            await asyncio.sleep(0.01)
+        daemon.stop()
+        await task
+
+    asyncio.run(asyncio.wait_for(main(), 10))
+    assert (daemon.done, daemon.errors) == (1, 1)
+    assert files[1].status == FileStatus.Error
+    assert files[1].worker is None and files[1].lease_expiry is None
+
+
+def test_daemon_poll_error(root, monkeypatch, make_file, mock_transport):
+    esg = Esgpull(root, install=True)
+    file = make_file(0, bytes(1024))
+    esg.db.add(file)
+    started = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        started.set()
+        await asyncio.sleep(10)
+        return httpx.Response(200)
+
+    mock_transport(handler)
+    lease = Lease(esg.db)
+    claim_next = lease.claim_next
+
+    def broken_claim_next(limit: int = 1) -> list[File]:
+        if started.is_set():
+            raise RuntimeError("database is locked")
+        return claim_next(limit)
+
+    monkeypatch.setattr(lease, "claim_next", broken_claim_next)
+    daemon = Daemon(esg, lease, WriteBuffer(esg.db), 0.01, 2)
+    with pytest.raises(RuntimeError, match="database is locked"):
+        asyncio.run(asyncio.wait_for(daemon.run(), 10))
+    # the file in flight goes back to the queue
+    esg.db.session.expire_all()
+    assert file.status == FileStatus.Queued
+    assert file.worker is None and file.lease_expiry is None
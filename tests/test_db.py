@@ -1,9 +1,11 @@
+import asyncio
+
 import pytest
 import sqlalchemy as sa
 
 from esgpull import __version__
-from esgpull.database import Database
-from esgpull.models import Facet, FileStatus, sql
+from esgpull.database import Database, WriteBuffer
+from esgpull.models import Facet, File, FileStatus, Query, sql
 
 
 @pytest.fixture
@@ -16,6 +18,30 @@ def test_empty(root, db):
     assert db.version == __version__
 
 
+def test_skip_migrations(config, db, monkeypatch):
+    def fail():
+        raise AssertionError("migrations should be skipped")
+
+    monkeypatch.setattr(Database, "_update", lambda self: fail())
+    other = Database.from_config(config)
+    assert other.version == db.version == __version__
+
+
+def test_indexes(db):
+    inspector = sa.inspect(db._engine)
+    file_indexes = {index["name"] for index in inspector.get_indexes("file")}
+    assert {
+        "ix_file_status",
+        "ix_file_master_id",
+        "ix_file_dataset_id",
+        "ix_file_data_node",
+    } <= file_indexes
+    query_file_indexes = inspector.get_indexes("query_file")
+    assert [index["column_names"] for index in query_file_indexes] == [
+        ["file_sha", "query_sha"]
+    ]
+
+
 def test_CRUD(db):
     stmt = sa.select(Facet)
     facets = db.scalars(stmt)
@@ -59,3 +85,86 @@ def test_sql_status(db, file):
     db.add(file)
     assert db.scalars(sql.file.with_status(FileStatus.Queued)) == [file]
     assert db.scalars(sql.file.with_status(FileStatus.Done)) == []
+
+
+def test_queued_from_queries(db, file):
+    query = Query(selection=dict(project="IPSL"))
+    other = Query(selection=dict(project="CMIP6"))
+    query.compute_sha()
+    other.compute_sha()
+    done = File(**{**file.asdict(), "file_id": "done"})
+    done.status = FileStatus.Done
+    done.compute_sha()
+    db.add(query, file, done)
+    other = db.merge(other, commit=True)
+    db.link_many(query, file, done)
+    db.link_many(other, file)
+    stmt = sql.file.queued_from_queries([query.sha, other.sha])
+    assert db.rows(stmt) == [(file.sha, file.size, file.data_node)]
+    assert db.rows(sql.file.queued_from_queries([])) == []
+
+
+def test_add_no_refresh(db, file):
+    db.add(file, refresh=False)
+    assert "status" in file.state.dict  # not expired
+    file.status = FileStatus.Done
+    db.add(file, refresh=False)
+    db.session.expire_all()
+    assert db.scalars(sql.file.with_status(FileStatus.Done)) == [file]
+
+
+def test_upsert(db, file):
+    db.batch_size = 2
+    files = [file]
+    for i in range(4):
+        other = File(**{**file.asdict(), "file_id": f"file{i}"})
+        other.compute_sha()
+        files.append(other)
+    db.upsert(*files)
+    assert len(db.scalars(sql.file.all())) == 5
+    file.status = FileStatus.Done
+    db.upsert(file, update=False)
+    assert db.scalars(sql.file.with_status(FileStatus.Done)) == []
+    db.upsert(file)
+    db.session.expire_all()
+    assert db.scalars(sql.file.with_status(FileStatus.Done)) == [file]
+    query = Query(selection=dict(project="CMIP6"))
+    query.compute_sha()
+    db.add(query)
+    db.link_many(query, *files)
+    db.link_many(query, *files)  # existing links are ignored
+    assert set(db.scalars(sql.file.linked())) == {f.sha for f in files}
+
+
+def test_write_buffer(db, file):
+    files = [file]
+    for i in range(2):
+        other = File(**{**file.asdict(), "file_id": f"file{i}"})
+        other.compute_sha()
+        files.append(other)
+    db.add(*files)
+    reader = Database(db.url, run_migrations=False)
+
+    def nb_done() -> int:
+        reader.session.close()  # see latest commit
+        return len(reader.scalars(sql.file.with_status(FileStatus.Done)))
+
+    buffer = WriteBuffer(db, max_items=2, max_delay=0.05)
+    files[0].status = FileStatus.Done
+    buffer.add(files[0])
+    buffer.add(files[0])  # same item is written once
+    assert nb_done() == 0
+    files[1].status = FileStatus.Done
+    buffer.add(files[1])
+    assert nb_done() == 2
+
+    async def main() -> None:
+        async with buffer.autoflush():
+            files[2].status = FileStatus.Done
+            buffer.add(files[2])
+            assert nb_done() == 2
+            await asyncio.sleep(0.2)
+            assert nb_done() == 3
+
+    asyncio.run(main())
+    assert buffer.items == {}
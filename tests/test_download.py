@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+
+from esgpull.download import Extents
+from esgpull.fs import FileCheck, Filesystem
+from esgpull.limiter import Limiter
+from esgpull.models import File
+from esgpull.processor import Task
+from esgpull.result import Ok
+
+CONTENT = bytes(range(256)) * 1000
+
+
+def make_handler(accept_ranges: bool):
+    def handler(request: httpx.Request) -> httpx.Response:
+        headers = {"Content-Length": str(len(CONTENT))}
+        if accept_ranges:
+            headers["Accept-Ranges"] = "bytes"
+        if request.method == "HEAD":
+            return httpx.Response(200, headers=headers)
+        range_header = request.headers.get("Range")
+        if accept_ranges and range_header is not None:
+            start, end = range_header.removeprefix("bytes=").split("-")
+            stop = int(end) + 1 if end else len(CONTENT)
+            content = CONTENT[int(start) : stop]
+            return httpx.Response(206, content=content)
+        return httpx.Response(200, content=CONTENT)
+
+    return handler
+
+
+@pytest.fixture
+def remote_file():
+    file = File(
+        file_id="dataset.v0.file.nc",
+        dataset_id="dataset.v0",
+        master_id="dataset.file.nc",
+        url="https://data_node/file.nc",
+        version="v0",
+        filename="file.nc",
+        local_path="dataset/v0",
+        data_node="data_node",
+        checksum=hashlib.sha256(CONTENT).hexdigest(),
+        checksum_type="SHA256",
+        size=len(CONTENT),
+    )
+    file.compute_sha()
+    return file
+
+
+@pytest.fixture
+def fs(config):
+    return Filesystem.from_config(config, install=True)
+
+
+async def run_task(task, accept_ranges):
+    limiter = Limiter(max_concurrent=1, max_concurrent_per_node=1)
+    transport = httpx.MockTransport(make_handler(accept_ranges))
+    async with httpx.AsyncClient(transport=transport) as client:
+        async for result in task.stream(limiter, client):
+            ...
+    return result
+
+
+@pytest.mark.parametrize("accept_ranges", [True, False])
+def test_ranged(config, fs, remote_file, accept_ranges, monkeypatch):
+    config.download.range_size = 10_000
+    config.download.max_connections_per_file = 4
+    task = Task(config, fs, file=remote_file)
+    result = asyncio.run(run_task(task, accept_ranges))
+    if not result.ok:
+        raise result.err
+    assert result.data.completed == remote_file.size
+    # hashed by the task, not synchronously by `finalize`
+    assert result.data.digest is not None
+    monkeypatch.setattr(fs, "compute_checksum", None)
+    assert fs.finalize(remote_file, result.data.digest) == Ok(FileCheck.Ok)
+    assert fs[remote_file].drs.read_bytes() == CONTENT
+
+
+def test_distributed(config, fs, remote_file):
+    config.download.range_size = 10_000
+    config.download.distributed = True
+    task = Task(config, fs, file=remote_file)
+    mirror_url = "https://mirror/file.nc"
+    broken_url = "https://broken/file.nc"
+
+    async def fetch_urls(file):
+        return [file.url, mirror_url, broken_url]
+
+    task.downloader.fetch_urls = fetch_urls  # type: ignore [attr-defined]
+    handler = make_handler(accept_ranges=True)
+    requested_hosts = set()
+
+    def mirrors_handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "GET":
+            requested_hosts.add(request.url.host)
+        if request.url.host == "broken" and request.method == "GET":
+            return httpx.Response(503)
+        return handler(request)
+
+    async def run() -> Ok:
+        limiter = Limiter(max_concurrent=1, max_concurrent_per_node=1)
+        transport = httpx.MockTransport(mirrors_handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            async for result in task.stream(limiter, client):
+                ...
+        return result
+
+    result = asyncio.run(run())
+    if not result.ok:
+        raise result.err
+    assert requested_hosts == {"data_node", "mirror", "broken"}
+    assert fs.finalize(remote_file, result.data.digest) == Ok(FileCheck.Ok)
+    assert fs[remote_file].drs.read_bytes() == CONTENT
+
+
+def test_distributed_redirects(config, fs, remote_file):
+    config.download.range_size = 10_000
+    config.download.distributed = True
+    task = Task(config, fs, file=remote_file)
+    aliases = ["https://alias1/file.nc", "https://alias2/file.nc"]
+
+    async def fetch_urls(file):
+        return [file.url, *aliases]
+
+    task.downloader.fetch_urls = fetch_urls  # type: ignore [attr-defined]
+    handler = make_handler(accept_ranges=True)
+
+    def mirrors_handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host.startswith("alias"):
+            location = "https://broken/file.nc"
+            return httpx.Response(302, headers={"Location": location})
+        if request.url.host == "broken" and request.method == "GET":
+            return httpx.Response(503)
+        return handler(request)
+
+    async def run() -> Ok:
+        limiter = Limiter(max_concurrent=1, max_concurrent_per_node=1)
+        transport = httpx.MockTransport(mirrors_handler)
+        async with httpx.AsyncClient(
+            transport=transport,
+            follow_redirects=True,
+        ) as client:
+            async for result in task.stream(limiter, client):
+                ...
+        return result
+
+    # both aliases are the same mirror, dropped once
+    result = asyncio.run(asyncio.wait_for(run(), timeout=10))
+    if not result.ok:
+        raise result.err
+    assert fs.finalize(remote_file, result.data.digest) == Ok(FileCheck.Ok)
+
+
+@pytest.mark.parametrize(
+    "accept_ranges,max_connections,checkpoint",
+    [
+        (True, 1, None),
+        (False, 1, None),
+        (True, 4, 20_000),
+        (True, 4, 0),
+    ],
+)
+def test_resume(
+    config,
+    fs,
+    remote_file,
+    accept_ranges,
+    max_connections,
+    checkpoint,
+):
+    config.download.range_size = 10_000
+    config.download.max_connections_per_file = max_connections
+    path = fs[remote_file]
+    if checkpoint is None:
+        path.tmp.write_bytes(CONTENT[:50_000])
+    else:
+        # part file with a gap after the checkpoint, as left by ranged downloads
+        gap = bytes(10_000)
+        path.tmp.write_bytes(CONTENT[:30_000] + gap + CONTENT[40_000:50_000])
+        path.checkpoint.write_text(str(checkpoint))
+    task = Task(config, fs, file=remote_file)
+    result = asyncio.run(run_task(task, accept_ranges))
+    if not result.ok:
+        raise result.err
+    assert result.data.completed == remote_file.size
+    assert fs.finalize(remote_file, result.data.digest) == Ok(FileCheck.Ok)
+    assert fs[remote_file].drs.read_bytes() == CONTENT
+    assert not path.checkpoint.exists()
+
+
+def test_extents():
+    extents = Extents(prefix=10)
+    assert extents.add(30, 10) == 10
+    assert extents.add(20, 10) == 10
+    assert extents.add(50, 10) == 10
+    assert extents.add(10, 10) == 40
+    assert extents.add(40, 10) == 60
+    assert extents.ends == {}
@@ -1,7 +1,16 @@
+import asyncio
+import gc
+import socket
+import subprocess
+from datetime import datetime, timedelta
+
 import pytest
+import sqlalchemy as sa
 
 from esgpull import Esgpull
-from esgpull.models import Query
+from esgpull.lease import Lease
+from esgpull.models import File, FileStatus, Query, sql
+from esgpull.scheduler import Policy, Scheduler
 
 
 def test_insert_default_query(root):
@@ -40,3 +49,199 @@ def test_insert_default_query(root):
             assert query.require == new_queries[3].sha
         elif i == 5:
             assert query.require == new_queries[4].sha
+
+
+def test_close(root):
+    with Esgpull(root, install=True) as esg:
+        esg.context._sync(asyncio.sleep(0))
+        client = esg.context.client
+    assert client.is_closed and esg.context._loop is None
+    # also closed when garbage collected
+    esg = Esgpull(root)
+    context = esg.context
+    context._sync(asyncio.sleep(0))
+    del esg
+    gc.collect()
+    assert context._loop is None
+
+
+def test_link_files(root, file):
+    esg = Esgpull(root, install=True)
+    esg.db.batch_size = 2
+    query = Query(selection=dict(project="IPSL"))
+    legacy = Query(selection=dict(project="CMIP6"))
+    query.compute_sha()
+    legacy.compute_sha()
+    esg.graph.add(query, legacy)
+    esg.graph.merge()
+    legacy = esg.db.get(Query, legacy.sha)
+    esg.legacy_query = legacy  # stands in for the synda import query
+    files = []
+    for i in range(5):
+        new = File(**{**file.asdict(), "file_id": f"file{i}"})
+        new.compute_sha()
+        files.append(new)
+    legacy_file = files[0]
+    esg.db.upsert(legacy_file)
+    esg.db.link_many(legacy, legacy_file)
+    conflict = File(**{**file.asdict(), "file_id": "file1", "checksum": "1"})
+    conflict.compute_sha()
+    rejected = esg.link_files(query, files + [conflict])
+    assert rejected == [conflict]
+    linked = set(esg.db.scalars(sql.file.shas_from_query(query.sha)))
+    assert linked == {f.sha for f in files}
+    assert esg.db.scalars(sql.file.shas_from_query(legacy.sha)) == []
+    queued = esg.db.scalars(sql.file.with_status(FileStatus.Queued))
+    assert len(queued) == 5
+
+
+def test_download(root, make_file, data_node):
+    esg = Esgpull(root, install=True)
+    contents = [bytes([i]) * (i + 1) * 100 for i in range(20)]
+    queue = [make_file(i, content) for i, content in enumerate(contents)]
+    esg.db.add(*queue)
+    # leased by another process, not downloaded
+    [other] = Lease(esg.db, worker="other").claim(queue[-1])
+    data_node(contents)
+    esg.config.download.max_concurrent = 2
+    files, errors = asyncio.run(esg.download(queue, show_progress=False))
+    assert errors == []
+    assert len(files) == 19 and other not in files
+    done = esg.db.scalars(sql.file.with_status(FileStatus.Done))
+    assert len(done) == 19
+    for file in done:
+        assert esg.fs[file].drs.read_bytes() == contents[queue.index(file)]
+        assert file.worker is None
+    assert other.status == FileStatus.Starting and other.worker == "other"
+
+
+def test_download_statements(root, make_file, data_node):
+    esg = Esgpull(root, install=True)
+    contents = [bytes([i]) * 100 for i in range(40)]
+    queue = [make_file(i, content) for i, content in enumerate(contents)]
+    esg.db.add(*queue)
+    data_node(contents)
+    commits: list[None] = []
+    selects: list[str] = []
+
+    def on_execute(conn, cursor, statement, *args) -> None:
+        if statement.startswith("SELECT"):
+            selects.append(statement)
+
+    sa.event.listen(esg.db.session, "after_commit", commits.append)
+    sa.event.listen(esg.db._engine, "before_cursor_execute", on_execute)
+    files, errors = asyncio.run(esg.download(queue, show_progress=False))
+    assert errors == [] and len(files) == 40
+    # claims neither flush nor expire the buffered files
+    assert len(commits) <= 2
+    assert len(selects) <= 2
+
+
+def test_download_workers(root, make_file, data_node):
+    contents = [bytes([i]) * 1000 for i in range(12)]
+    queue = [make_file(i, content) for i, content in enumerate(contents)]
+    Esgpull(root, install=True).db.add(*queue)
+    requests = data_node(contents, delay=0.01)
+
+    async def worker(name: str) -> list[File]:
+        # two processes sharing the same database
+        esg = Esgpull(root)
+        esg.config.download.max_concurrent = 2
+        stmt = sql.file.with_status(FileStatus.Queued)
+        files = list(esg.db.scalars(stmt))
+        lease = Lease(esg.db, worker=name)
+        done, errors = await esg.download(
+            files, show_progress=False, lease=lease
+        )
+        assert errors == []
+        return done
+
+    async def main() -> tuple[list[File], list[File]]:
+        return await asyncio.gather(worker("a"), worker("b"))
+
+    done_a, done_b = asyncio.run(main())
+    assert done_a and done_b
+    assert sorted(requests) == sorted(f"/file{i}.nc" for i in range(12))
+    shas = {file.sha for file in done_a} | {file.sha for file in done_b}
+    assert len(shas) == len(done_a) + len(done_b) == 12
+    esg = Esgpull(root)
+    done = esg.db.scalars(sql.file.with_status(FileStatus.Done))
+    assert len(done) == 12
+
+
+def test_download_chunks(root, make_file, data_node):
+    esg = Esgpull(root, install=True)
+    contents = [bytes([i]) * 50_000 for i in range(3)]
+    queue = [make_file(i, content) for i, content in enumerate(contents)]
+    esg.db.add(*queue)
+    data_node(contents)
+    esg.config.download.chunk_size = 4096
+    files, errors = asyncio.run(esg.download(queue, show_progress=False))
+    assert errors == []
+    assert files == queue
+    for file, content in zip(files, contents):
+        assert file.status == FileStatus.Done
+        assert esg.fs[file].drs.read_bytes() == content
+
+
+def test_download_rows(root, make_file, data_node):
+    esg = Esgpull(root, install=True)
+    contents = [bytes([i]) * (i + 1) * 100 for i in range(6)]
+    queue = [make_file(i, content) for i, content in enumerate(contents)]
+    query = Query(selection=dict(project="IPSL"))
+    query.compute_sha()
+    esg.db.add(query, *queue)
+    esg.db.link_many(query, *queue)
+    Lease(esg.db, worker="other").claim(queue[0])
+    stmt = sql.file.queued_from_queries([query.sha])
+    largest_first = [file.sha for file in queue[:0:-1]]
+    content_of = {file.sha: content for file, content in zip(queue, contents)}
+    esg.db.session.expunge_all()
+    rows = esg.db.rows(stmt)
+    assert len(rows) == 5 and len(esg.db.session.identity_map) == 0
+    data_node(contents)
+    scheduler = Scheduler(Policy.Largest)
+    esg.config.download.max_concurrent = 1
+    coro = esg.download(rows, show_progress=False, scheduler=scheduler)
+    files, errors = asyncio.run(coro)
+    assert errors == []
+    # files are loaded when picked, in scheduling order
+    assert [file.sha for file in files] == largest_first
+    for file in files:
+        assert file.status == FileStatus.Done
+        assert esg.fs[file].drs.read_bytes() == content_of[file.sha]
+
+
+def test_recover_installed(root, make_file):
+    esg = Esgpull(root, install=True)
+    files = [
+        make_file(i, bytes(10), status=FileStatus.Started) for i in range(4)
+    ]
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    host = socket.gethostname()
+    live_expiry = datetime.utcnow() + timedelta(hours=1)
+    # killed before its lease expired
+    files[0].worker = f"{host}:{dead.pid}"
+    files[0].lease_expiry = live_expiry
+    # lease expired
+    files[1].worker = "otherhost:1"
+    files[1].lease_expiry = datetime.utcnow() - timedelta(hours=1)
+    # live lease on another host
+    files[2].worker = "otherhost:1"
+    files[2].lease_expiry = live_expiry
+    # not installed
+    files[3].worker = f"{host}:{dead.pid}"
+    files[3].lease_expiry = live_expiry
+    esg.db.add(*files)
+    for file in files[:3]:
+        esg.fs[file].drs.parent.mkdir(parents=True, exist_ok=True)
+        esg.fs[file].drs.write_bytes(bytes(10))
+    assert esg.recover_installed() == files[:2]
+    assert [file.status for file in files] == [
+        FileStatus.Done,
+        FileStatus.Done,
+        FileStatus.Started,
+        FileStatus.Started,
+    ]
+    assert files[0].worker is None
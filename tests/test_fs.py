@@ -1,9 +1,11 @@
 import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
 from esgpull.config import Config
-from esgpull.fs import FileCheck, Filesystem
+from esgpull.fs import Digest, FileCheck, Filesystem
 
 
 @pytest.fixture
@@ -176,3 +178,19 @@ def test_check(
             f.write(str(content).encode())
     check = fs.check(file)
     assert check == expected_check
+
+
+async def digest_steps(digest, chunks):
+    for chunk in chunks:
+        await digest.aupdate(chunk)
+        assert len(digest._pending) <= digest.max_pending
+    await digest.wait()
+
+
+def test_digest_executor(file):
+    file.checksum_type = "SHA256"
+    chunks = [bytes([i]) * (i + 1) * 1000 for i in range(100)]
+    with ThreadPoolExecutor(4) as executor:
+        digest = Digest(file, executor=executor)
+        asyncio.run(digest_steps(digest, chunks))
+    assert digest.hexdigest() == hashlib.sha256(b"".join(chunks)).hexdigest()
@@ -279,3 +279,31 @@ def test_delete_add_merge(base, db):
     graph2.merge()
     graph3 = Graph(db)
     assert base in graph3
+
+
+def test_matching_shas(base, a, b, c):
+    graph = Graph(None)
+    graph.add(base, a, b, c)
+    assert graph._sorted_shas == sorted(graph._shas)
+    for query in [base, a, b, c]:
+        assert graph.matching_shas(query.sha[:8], graph._sorted_shas) == [
+            query.sha
+        ]
+        assert graph.get(query.sha[:8]).sha == query.sha
+        assert graph.get("#" + query.sha[:8]).sha == query.sha
+    assert graph.matching_shas("", graph._sorted_shas) == graph._sorted_shas
+    assert graph.matching_shas("not a sha", graph._sorted_shas) == []
+    graph.delete(a)
+    assert a.sha[:8] not in graph
+    assert graph._sorted_shas == sorted(graph._shas)
+    graph.add(a)
+    assert graph._sorted_shas == sorted(graph._shas)
+
+
+def test_add_rollback(base, a):
+    graph = Graph(None)
+    graph.add(base)
+    bad = Query(require=base.sha[:8], selection=dict(variable="tas"))
+    with pytest.raises(ValueError):
+        graph.add(a, bad)
+    assert graph._sorted_shas == [base.sha]
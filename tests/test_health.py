@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from esgpull.database import Database
+from esgpull.health import Health
+
+
+def test_ranked():
+    health = Health()
+    assert health.ranked("default") == ["default"]
+    health.record("slow", 2.0)
+    health.record("fast", 0.5)
+    assert health.ranked("default") == ["fast", "slow", "default"]
+    health.record("fast", error=True)
+    health.record("fast", error=True)
+    assert health["fast"].error_rate > 0.2
+    assert health.score("fast") > 0.5
+    for _ in range(3):
+        health.record("fast", error=True)
+    assert not health.healthy("fast")
+    assert health.ranked("default") == ["slow", "default", "fast"]
+    last_error = health["fast"].last_error
+    assert last_error is not None
+    health["fast"].last_error = last_error - timedelta(seconds=301)
+    assert health.healthy("fast")
+
+
+def test_save(config):
+    db = Database.from_config(config)
+    health = Health.from_db(db, config)
+    assert health.nodes == {}
+    health.record("index_node", 1.0)
+    health.record("index_node", 2.0)
+    health.record("index_node", error=True)
+    health.save()
+    assert not health.dirty
+    loaded = Health.from_db(db, config)
+    node = loaded["index_node"]
+    assert not loaded.dirty
+    assert (node.requests, node.errors) == (3, 1)
+    assert node.latency == 1.2
+    assert node.last_seen is not None
+    assert datetime.utcnow() - node.last_seen < timedelta(seconds=10)
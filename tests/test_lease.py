@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+from esgpull.database import Database
+from esgpull.lease import Lease
+from esgpull.models import FileStatus, sql
+
+
+def test_claim(config, make_file):
+    url = f"sqlite:///{config.paths.db / config.db.filename}"
+    db = Database(url)
+    files = [make_file(i) for i in range(4)]
+    db.add(*files)
+    # two processes sharing the same database
+    a = Lease(Database(url, run_migrations=False), worker="a")
+    b = Lease(Database(url, run_migrations=False), worker="b")
+    claimed_a = a.claim(*files[:3])
+    claimed_b = b.claim(*files)
+    assert {f.sha for f in claimed_a} == {f.sha for f in files[:3]}
+    assert [f.sha for f in claimed_b] == [files[3].sha]
+    assert all(f.status == FileStatus.Starting for f in claimed_a)
+    assert all(f.worker == "a" for f in claimed_a)
+    assert b.claim_next() == []
+    # the lease of `a` expires without heartbeat
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    assert a.db.update(sql.file.renew("a", expired)) == 3
+    assert len(b.orphaned()) == 3
+    assert len(b.claim_next(limit=2)) == 2
+    assert a.renew() == 1
+    assert len(b.claim_next(limit=2)) == 0
+    assert a.claim(*files) == []
+
+
+def test_release(config, make_file):
+    url = f"sqlite:///{config.paths.db / config.db.filename}"
+    db = Database(url)
+    db.add(make_file())
+    lease = Lease(db, worker="a")
+    [file] = lease.claim_next()
+    assert file.lease_expiry is not None
+    assert lease.orphaned() == []
+    file.status = FileStatus.Done
+    lease.release(file)
+    db.add(file)
+    assert file.worker is None and file.lease_expiry is None
+    assert lease.renew() == 0
+
+
+def test_claim_pending(config, make_file):
+    url = f"sqlite:///{config.paths.db / config.db.filename}"
+    db = Database(url)
+    done, queued = make_file(0), make_file(1)
+    db.add(done, queued)
+    lease = Lease(db, worker="a")
+    done.status = FileStatus.Done
+    assert lease.claim(queued) == [queued]
+    # claims do not flush pending changes
+    assert done in db.session.dirty
+    # once flushed, the session holds the write lock until its commit
+    db.session.flush()
+    assert lease.renew() == 1
+    other = Database(url, run_migrations=False)
+    assert len(other.scalars(sql.file.with_status(FileStatus.Done))) == 1
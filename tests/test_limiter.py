@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from esgpull.limiter import Limiter
+
+
+def test_aimd():
+    limiter = Limiter(max_concurrent=10, max_concurrent_per_node=4)
+    slots = limiter["node"]
+    slots.interval = 0.0
+    assert slots.limit == 1
+    slots.active = 4  # streams are all in use
+    for _ in range(10):
+        slots.received = 0
+        slots.speed = 0.0
+        slots.record(1)
+    assert slots.limit == 4  # capped by max_concurrent_per_node
+    slots.failure()
+    assert slots.limit == 2
+    slots.failure()
+    slots.failure()
+    assert slots.limit == 1
+
+
+def test_not_adaptive():
+    limiter = Limiter(3, 2, adaptive=False)
+    slots = limiter["node"]
+    slots.interval = 0.0
+    assert slots.limit == 2
+    slots.failure()
+    slots.active = 2
+    slots.record(1)
+    assert slots.limit == 2
+
+
+async def acquire_many(limiter: Limiter, nodes: list[str]) -> list[str]:
+    order: list[str] = []
+
+    async def run(node: str) -> None:
+        async with limiter.slot(node):
+            order.append(node)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[run(node) for node in nodes])
+    return order
+
+
+def test_slot_per_node():
+    limiter = Limiter(max_concurrent=2, max_concurrent_per_node=1)
+    order = asyncio.run(acquire_many(limiter, ["a", "a", "a", "b"]))
+    # "b" is not blocked behind the queued "a" downloads
+    assert order.index("b") == 1
+    assert limiter["a"].active == limiter["b"].active == 0
+
+
+def test_slot_failure():
+    limiter = Limiter(max_concurrent=2, max_concurrent_per_node=4)
+    limiter["a"].limit = 4
+
+    async def fail() -> None:
+        async with limiter.slot("a"):
+            raise ValueError
+
+    with pytest.raises(ValueError):
+        asyncio.run(fail())
+    assert limiter["a"].limit == 2
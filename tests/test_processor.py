@@ -1,12 +1,16 @@
 import asyncio
+from collections.abc import AsyncIterator
+from hashlib import sha256
 
 import httpx
 import pytest
 
+from esgpull.auth import Auth
 from esgpull.fs import FileCheck, Filesystem
+from esgpull.limiter import Limiter
 from esgpull.models import File
-from esgpull.processor import Task
-from esgpull.result import Ok
+from esgpull.processor import Processor, Task
+from esgpull.result import Ok, Result
 
 
 @pytest.fixture
@@ -62,9 +66,9 @@ def task(config, fs, smallfile):
 
 
 async def run_task(task_):
-    semaphore = asyncio.Semaphore(1)
+    limiter = Limiter(max_concurrent=1, max_concurrent_per_node=1)
     async with httpx.AsyncClient() as client:
-        async for result in task_.stream(semaphore, client):
+        async for result in task_.stream(limiter, client):
             ...
     return result
 
@@ -83,6 +87,153 @@ def test_task(fs, smallfile, task):
     assert len(data) == smallfile.size
 
 
+def test_task_retry(config, fs, smallfile, reset_stream):
+    config.download.chunk_size = 1 << 10
+    config.download.retry.backoff_base = 0
+    content = bytes(range(256)) * 64
+    smallfile.size = len(content)
+    smallfile.checksum = sha256(content).hexdigest()
+    ranges: list[str | None] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        ranges.append(request.headers.get("Range"))
+        if len(ranges) == 1:
+            return httpx.Response(200, stream=reset_stream(content, 5000))
+        elif len(ranges) == 2:
+            return httpx.Response(502)
+        start = int(request.headers["Range"][6:-1])  # bytes={start}-
+        stream = httpx.ByteStream(content[start:])
+        return httpx.Response(206, stream=stream)
+
+    async def main() -> Task:
+        task = Task(config, fs, file=smallfile)
+        limiter = Limiter(max_concurrent=1, max_concurrent_per_node=1)
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            async for result in task.stream(limiter, client):
+                assert result.ok
+        return task
+
+    task = asyncio.run(main())
+    # only full chunks of 1 KiB were written before the reset
+    assert ranges == [None, "bytes=4096-", "bytes=4096-"]
+    assert task.ctx.retries == 2
+    assert fs.finalize(smallfile, digest=task.ctx.digest) == Ok(FileCheck.Ok)
+    assert fs[smallfile].drs.read_bytes() == content
+
+
+def test_process_schedule(config, fs, make_file, data_node):
+    config.download.max_concurrent = 1
+    config.download.schedule = "smallest"
+    contents = [bytes(size) for size in [300, 100, 200]]
+    files = [make_file(i, content) for i, content in enumerate(contents)]
+    requested = data_node(contents)
+    processor = Processor(
+        config=config,
+        auth=Auth.from_config(config),
+        fs=fs,
+        files=files,
+    )
+
+    async def main() -> None:
+        async for result in processor.process():
+            assert result.ok
+
+    asyncio.run(main())
+    assert requested == ["/file1.nc", "/file2.nc", "/file0.nc"]
+
+
+def test_process_lazy(config, fs, make_file, data_node):
+    config.download.max_concurrent = 3
+    contents = [bytes(100)] * 50
+    files = [make_file(i, content) for i, content in enumerate(contents)]
+    # already installed, not downloaded again
+    fs[files[7]].drs.parent.mkdir(parents=True, exist_ok=True)
+    fs[files[7]].drs.write_bytes(bytes(100))
+    requested = data_node(contents)
+    created: list[Task] = []
+    finished: list[File] = []
+    max_alive = 0
+
+    def on_task(task: Task) -> None:
+        nonlocal max_alive
+        created.append(task)
+        max_alive = max(max_alive, len(created) - len(finished))
+
+    processor = Processor(
+        config=config,
+        auth=Auth.from_config(config),
+        fs=fs,
+        files=files,
+        on_task=on_task,
+    )
+
+    async def main() -> None:
+        async for result in processor.process():
+            assert result.ok
+            if result.data.finished:
+                finished.append(result.data.file)
+
+    asyncio.run(main())
+    assert len(created) == len(finished) == 50
+    assert max_alive <= 3
+    assert sorted(requested) == sorted(
+        f"/file{i}.nc" for i in range(50) if i != 7
+    )
+
+
+def test_process_task_error(monkeypatch, config, fs, make_file, data_node):
+    contents = [bytes(100)] * 3
+    files = [make_file(i, content) for i, content in enumerate(contents)]
+    data_node(contents)
+    attempt = Task.attempt
+
+    def broken_attempt(self, limiter, client):
+        if self.file is files[1]:
+            raise PermissionError("denied")
+        return attempt(self, limiter, client)
+
+    monkeypatch.setattr(Task, "attempt", broken_attempt)
+    processor = Processor(
+        config=config,
+        auth=Auth.from_config(config),
+        fs=fs,
+        files=files,
+    )
+
+    async def main() -> list[Result]:
+        return [result async for result in processor.process()]
+
+    results = asyncio.run(main())
+    errors = [result for result in results if not result.ok]
+    assert [err.data.file for err in errors] == [files[1]]
+    assert isinstance(errors[0].err, PermissionError)
+    finished = [r.data.file for r in results if r.ok and r.data.finished]
+    assert sorted(finished, key=files.index) == [files[0], files[2]]
+
+
+def test_feed_error(config, fs, make_file, data_node):
+    contents = [bytes(100)] * 3
+    files = [make_file(i, content) for i, content in enumerate(contents)]
+    data_node(contents)
+    processor = Processor(
+        config=config,
+        auth=Auth.from_config(config),
+        fs=fs,
+    )
+
+    async def source() -> AsyncIterator[File]:
+        yield files[0]
+        raise RuntimeError("database is locked")
+
+    async def main() -> None:
+        async for _ in processor.feed(source(), max_inflight=2):
+            ...
+
+    with pytest.raises(RuntimeError, match="database is locked"):
+        asyncio.run(main())
+
+
 # def test_task_url_multiple_version_correct():
 #     # fmt:off
 #     url_old = "http://vesg.ipsl.upmc.fr/thredds/fileServer/cmip6/CMIP/IPSL/IPSL-CM6A-LR/1pctCO2/r1i1p1f1/Oyr/bfe/gn/v20180727/bfe_Oyr_IPSL-CM6A-LR_1pctCO2_r1i1p1f1_gn_1850-1999.nc"
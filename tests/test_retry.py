@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from esgpull.config import Retry
+from esgpull.retry import RetryPolicy, parse_retry_after
+
+
+def status_error(status_code: int, **headers: str) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://esgf-node/esg-search/search")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError("", request=request, response=response)
+
+
+def test_from_config():
+    retry = Retry(status_codes="500, 503")
+    policy = RetryPolicy.from_config(retry)
+    assert policy.status_codes == {500, 503}
+    assert policy.retryable(status_error(503))
+    assert not policy.retryable(status_error(502))
+    assert not policy.retryable(status_error(404))
+    assert policy.retryable(httpx.ConnectError(""))
+    assert policy.retryable(httpx.ReadTimeout(""))
+    assert not policy.retryable(httpx.UnsupportedProtocol(""))
+    assert not policy.retryable(ValueError())
+
+
+def test_backoff():
+    policy = RetryPolicy(max_attempts=5, backoff_cap=5, jitter=False)
+    exc = httpx.ReadError("")
+    delays = [policy.delay(attempt, exc) for attempt in range(5)]
+    assert delays == [1, 2, 4, 5, None]
+    policy.jitter = True
+    for attempt in range(4):
+        delay = policy.delay(attempt, exc)
+        assert delay is not None
+        assert 0 <= delay <= min(2**attempt, 5)
+
+
+@pytest.mark.parametrize(
+    "offset,expected",
+    [(0, 0), (30, 30), (120, 60)],
+)
+def test_retry_after(offset, expected):
+    policy = RetryPolicy()
+    exc = status_error(429, **{"Retry-After": str(offset)})
+    assert policy.delay(0, exc) == expected
+    policy.retry_after = False
+    assert policy.delay(0, exc) <= 1
+
+
+def test_parse_retry_after():
+    date = datetime.now(timezone.utc) + timedelta(seconds=100)
+    assert 90 < parse_retry_after(format_datetime(date, usegmt=True)) <= 100
+    assert parse_retry_after("not a date") is None
+    assert parse_retry_after(None) is None
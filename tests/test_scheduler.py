@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+from esgpull.limiter import Limiter
+from esgpull.models import File
+from esgpull.scheduler import Policy, Scheduler
+
+
+def pop_all(scheduler: Scheduler) -> list[str]:
+    names: list[str] = []
+    while (file := scheduler.pop()) is not None:
+        assert isinstance(file, File)
+        names.append(file.filename.removeprefix("file").removesuffix(".nc"))
+    return names
+
+
+@pytest.mark.parametrize(
+    "policy,expected",
+    [
+        (Policy.Fifo, ["a", "b", "c", "d"]),
+        (Policy.Smallest, ["b", "d", "c", "a"]),
+        (Policy.Largest, ["a", "c", "d", "b"]),
+        (Policy.RoundRobin, ["a", "c", "b", "d"]),
+    ],
+)
+def test_policies(make_file, policy, expected):
+    scheduler = Scheduler(policy)
+    scheduler.push(
+        make_file("a", bytes(400), data_node="node1"),
+        make_file("b", bytes(100), data_node="node1"),
+        make_file("c", bytes(300), data_node="node2"),
+        make_file("d", bytes(200), data_node="node1"),
+    )
+    assert len(scheduler) == 4
+    assert pop_all(scheduler) == expected
+    assert len(scheduler) == 0
+
+
+def test_priority_deadline(make_file):
+    files = [make_file(name) for name in "abcd"]
+    priorities = {files[2].sha: 2, files[1].sha: 1}
+    scheduler = Scheduler(Policy.Priority, priorities=priorities)
+    scheduler.push(*files)
+    assert pop_all(scheduler) == ["c", "b", "a", "d"]
+    deadlines = {
+        files[3].sha: datetime(2030, 1, 1),
+        files[1].sha: datetime(2031, 1, 1),
+    }
+    scheduler = Scheduler(Policy.Deadline, deadlines=deadlines)
+    scheduler.push(*files)
+    assert pop_all(scheduler) == ["d", "b", "a", "c"]
+
+
+def test_node_aware(make_file):
+    limiter = Limiter(max_concurrent=4, max_concurrent_per_node=1)
+    scheduler = Scheduler(Policy.Smallest)
+    files = [
+        make_file("a", bytes(100), data_node="node1"),
+        make_file("b", bytes(200), data_node="node1"),
+        make_file("c", bytes(300), data_node="node2"),
+    ]
+    scheduler.push(*files)
+    assert scheduler.pop(limiter) == files[0]
+    # node1 is busy with `a`, node2 is picked even though `b` is smaller
+    assert scheduler.pop(limiter) == files[2]
+    # every node is busy, best file overall
+    assert scheduler.pop(limiter) == files[1]
+    assert scheduler.running == {"node1": 2, "node2": 1}
+    scheduler.release(files[0])
+    assert scheduler.running["node1"] == 1
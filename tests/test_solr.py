@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from esgpull.solr import DocsParser, loads
+
+RESPONSE = {
+    "responseHeader": {"status": 0, "params": {"query": "title:(a b)"}},
+    "response": {
+        "numFound": 3,
+        "start": 0,
+        "docs": [
+            {"title": "a", "size": 1, "url": ["https://a|HTTPServer"]},
+            {"title": "b]}", "nested": {"docs": [1, 2]}},
+            {"title": "cé", "size": 3},
+        ],
+    },
+    "facet_counts": {"facet_fields": {"index_node": ["node", 3]}},
+}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 16])
+def test_docs_parser(chunk_size):
+    content = json.dumps(RESPONSE, indent=1, ensure_ascii=False).encode()
+    parser = DocsParser()
+    docs = []
+    for start in range(0, len(content), chunk_size):
+        docs.extend(parser.feed(content[start : start + chunk_size]))
+    envelope = parser.close()
+    expected = json.loads(content.decode("latin-1"))
+    assert docs == expected["response"]["docs"]
+    assert envelope["response"]["docs"] == []
+    assert envelope["response"]["numFound"] == 3
+    assert envelope["facet_counts"] == RESPONSE["facet_counts"]
+
+
+def test_docs_parser_no_docs():
+    content = json.dumps({"response": {"numFound": 0}}).encode()
+    parser = DocsParser()
+    assert parser.feed(content) == []
+    assert parser.close() == {"response": {"numFound": 0}}
+
+
+def test_docs_parser_truncated():
+    content = json.dumps(RESPONSE).encode()
+    parser = DocsParser()
+    parser.feed(content[: len(content) // 2])
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_loads():
+    ascii_content = json.dumps(RESPONSE).encode()
+    utf8_content = json.dumps(RESPONSE, ensure_ascii=False).encode()
+    for content in [ascii_content, utf8_content]:
+        assert loads(content) == json.loads(content.decode("latin-1"))
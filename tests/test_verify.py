@@ -0,0 +1,134 @@
+import hashlib
+
+import pytest
+
+from esgpull.database import Database
+from esgpull.fs import FileCheck, Filesystem
+from esgpull.models import File, FileStatus
+from esgpull.verify import Verifier, VerifyJob, verify_path
+
+CONTENT = bytes(range(256)) * 1000
+
+
+@pytest.fixture
+def verifier(config):
+    config.verify.max_workers = 2
+    db = Database.from_config(config)
+    fs = Filesystem.from_config(config, install=True)
+    return Verifier(config, db, fs, flush_every=2)
+
+
+@pytest.fixture
+def done_file(make_file, verifier):
+    """
+    Factory of done files, installed with `content` unless it is None.
+    """
+
+    def make(name: str, content: bytes | None) -> File:
+        file = make_file(name, CONTENT, status=FileStatus.Done)
+        if content is not None:
+            path = verifier.fs[file].drs
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+        return file
+
+    return make
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_verify_path(tmp_path, use_mmap):
+    path = tmp_path / "file.nc"
+    path.write_bytes(CONTENT)
+    checksum = hashlib.sha256(CONTENT).hexdigest()
+    job = VerifyJob("sha", str(path), len(CONTENT), checksum, "SHA256")
+    assert verify_path(job, 10_000, use_mmap) == FileCheck.Ok
+    path.write_bytes(CONTENT[::-1])
+    assert verify_path(job, 10_000, use_mmap) == FileCheck.BadChecksum
+    path.write_bytes(CONTENT[1:])
+    assert verify_path(job, 10_000, use_mmap) == FileCheck.BadSize
+    path.unlink()
+    assert verify_path(job, 10_000, use_mmap) == FileCheck.Missing
+
+
+def test_verify_path_unreadable(tmp_path, monkeypatch):
+    path = tmp_path / "file.nc"
+    path.write_bytes(CONTENT)
+    job = VerifyJob("sha", str(path), len(CONTENT), "", "SHA256")
+
+    def os_open(path, flags):
+        raise PermissionError(path)
+
+    monkeypatch.setattr("esgpull.verify.os.open", os_open)
+    assert verify_path(job, 10_000) == FileCheck.Unreadable
+
+
+def test_verifier(verifier, done_file):
+    fs, db = verifier.fs, verifier.db
+    ok = done_file("ok", CONTENT)
+    corrupted = done_file("corrupted", CONTENT[::-1])
+    missing = done_file("missing", None)
+    db.add(ok, corrupted, missing)
+    counts = verifier.run(verifier.jobs())
+    assert counts == {
+        FileCheck.Ok: 1,
+        FileCheck.BadChecksum: 1,
+        FileCheck.Missing: 1,
+    }
+    assert ok.status == FileStatus.Done
+    assert corrupted.status == missing.status == FileStatus.Queued
+    assert not fs[corrupted].drs.exists()
+    assert fs[ok].drs.exists()
+    assert not verifier.state_path.exists()
+
+
+def test_verifier_confirm(verifier, done_file):
+    fs, db = verifier.fs, verifier.db
+    verifier.requeue = False
+    ok = done_file("ok", CONTENT)
+    corrupted = done_file("corrupted", CONTENT[::-1])
+    missing = done_file("missing", None)
+    db.add(ok, corrupted, missing)
+    verifier.run(verifier.jobs())
+    assert verifier.bad == {
+        corrupted.sha: FileCheck.BadChecksum,
+        missing.sha: FileCheck.Missing,
+    }
+    # nothing is deleted until sent back
+    assert corrupted.status == missing.status == FileStatus.Done
+    assert fs[corrupted].drs.exists()
+    assert verifier.send_back(verifier.bad) == 2
+    assert corrupted.status == missing.status == FileStatus.Queued
+    assert not fs[corrupted].drs.exists()
+    assert ok.status == FileStatus.Done
+
+
+def test_verifier_resume(verifier, done_file):
+    fs, db = verifier.fs, verifier.db
+    files = [done_file(f"{i}", CONTENT) for i in range(3)]
+    db.add(*files)
+    verifier.state_path.write_text(f"{files[0].sha}\n")
+    jobs = verifier.jobs()
+    assert {job.sha for job in jobs} == {files[1].sha, files[2].sha}
+    verifier.reset()
+    assert len(verifier.jobs()) == 3
+
+
+def test_verifier_dry_run(verifier, done_file):
+    fs, db = verifier.fs, verifier.db
+    verifier.dry_run = True
+    ok = done_file("ok", CONTENT)
+    corrupted = done_file("corrupted", CONTENT[::-1])
+    md5 = done_file("md5", CONTENT)
+    md5.checksum_type = "MD5"
+    db.add(ok, corrupted, md5)
+    verifier.state_path.write_text(f"{ok.sha}\n")
+    counts = verifier.run(verifier.jobs(resume=False))
+    assert counts == {
+        FileCheck.Ok: 1,
+        FileCheck.BadChecksum: 1,
+        FileCheck.Unsupported: 1,
+    }
+    assert corrupted.status == FileStatus.Done
+    assert fs[corrupted].drs.exists()
+    # state of the interrupted run is kept as is
+    assert verifier.state_path.read_text() == f"{ok.sha}\n"